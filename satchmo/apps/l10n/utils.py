@@ -31,15 +31,7 @@ def lookup_translation(obj, attr, language_code=None, version=-1):
     if not hasattr(obj, '_translationcache'):
         obj._translationcache = {}
 
-    short_code = language_code
-    pos = language_code.find('_')
-    if pos > -1:
-        short_code = language_code[:pos]
-
-    else:
-        pos = language_code.find('-')
-        if pos > -1:
-            short_code = language_code[:pos]
+    short_code = _short_code(language_code)
 
     trans = None
     has_key = obj._translationcache.has_key(language_code)
@@ -92,6 +84,72 @@ def lookup_translation(obj, attr, language_code=None, version=-1):
 
     return mark_safe(val)
 
+def _short_code(language_code):
+    for sep in ('_', '-'):
+        pos = language_code.find(sep)
+        if pos > -1:
+            return language_code[:pos]
+    return language_code
+
+def _pick_translation(rows, version=-1):
+    """Pick a translation as `lookup_translation` does, from rows sorted by
+    descending version: the requested version, else the most recent one."""
+    for row in rows:
+        if row.version == version:
+            return row
+    if rows:
+        return rows[0]
+    return None
+
+def prefetch_translations(objects, language_code=None):
+    """Load the translations of `objects` for a language in one query per
+    model, and fill the `_translationcache` `lookup_translation` reads.
+
+    `lookup_translation` runs up to four queries per object and attribute,
+    so call this on the products, categories or options of a listing before
+    rendering it.  The objects must have a `translations` relation with
+    `languagecode` and `version` fields.
+    """
+    if not language_code:
+        language_code = get_language()
+    short_code = _short_code(language_code)
+
+    bymodel = {}
+    for obj in objects:
+        if obj is None or obj.pk is None:
+            continue
+        if not hasattr(obj, '_translationcache'):
+            obj._translationcache = {}
+        if not obj._translationcache.has_key(language_code):
+            bymodel.setdefault(obj.__class__, []).append(obj)
+
+    for model, instances in bymodel.items():
+        related = getattr(model, 'translations').related
+        fieldname = related.field.attname
+        pks = set([obj.pk for obj in instances])
+
+        found = {}
+        q = related.model._default_manager.filter(
+            languagecode__istartswith=short_code).order_by('-version')
+        for trans in q.filter(**{related.field.name + '__in' : pks}):
+            found.setdefault(getattr(trans, fieldname), []).append(trans)
+
+        for obj in instances:
+            rows = found.get(obj.pk, [])
+            exact = [t for t in rows if t.languagecode.lower() == language_code.lower()]
+            trans = _pick_translation(exact)
+            obj._translationcache[language_code] = trans
+            if trans is None:
+                # as lookup_translation falls back to the short code, then
+                # to any code starting with it
+                short = [t for t in rows if t.languagecode.lower() == short_code.lower()]
+                if not short:
+                    short = rows
+                obj._translationcache[short_code] = _pick_translation(short)
+
+    log.debug('Prefetched %s translations of %i objects', language_code,
+        sum([len(instances) for instances in bymodel.values()]))
+
 
 
 def moneyfmt(val, currency_code=None, wrapcents='', places=None):
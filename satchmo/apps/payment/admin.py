@@ -1,4 +1,4 @@
-from payment.models import CreditCardDetail
+from payment.models import CaptureRequest, CreditCardDetail, RecurringCharge
 from django.contrib import admin
 
 
@@ -7,3 +7,16 @@ class CreditCardDetail_Inline(admin.StackedInline):
     extra = 1
 
 
+class RecurringChargeOptions(admin.ModelAdmin):
+    list_display = ('order', 'orderitem', 'status', 'attempts', 'next_attempt', 'time_stamp')
+    list_filter = ('status',)
+    raw_id_fields = ('order', 'orderitem', 'renewal')
+
+admin.site.register(RecurringCharge, RecurringChargeOptions)
+
+class CaptureRequestOptions(admin.ModelAdmin):
+    list_display = ('order', 'status', 'attempts', 'message', 'time_stamp', 'completed')
+    list_filter = ('status',)
+    raw_id_fields = ('order',)
+
+admin.site.register(CaptureRequest, CaptureRequestOptions)
@@ -0,0 +1,227 @@
+"""
+Queued capture of the authorizations of shipped orders.
+
+`capture_on_ship_listener` used to capture the authorizations of an order
+while its status was changed to shipped, so marking hundreds of orders
+shipped waited on a gateway round trip for each of them.  With the
+CAPTURE_QUEUE payment setting, the listener only calls `enqueue_capture`,
+which creates or requeues the `CaptureRequest` of the order.
+
+`CaptureQueue` captures the queued orders a chunk at a time.  The orders of
+a chunk are grouped by the payment module of their authorizations, and each
+module gets up to `workers` threads, sending at most `rate` captures per
+second.  A request is claimed with a conditional update before its capture,
+so several runs at the same time never capture an order twice, and its
+result is written as soon as the capture is done.  A request left running
+by a run which was killed is queued again once it has been claimed for
+`timeout` minutes.  `capture_progress` counts the requests by status.
+
+`satchmo_capture_payments` runs the queue, typically from cron.
+"""
+from datetime import datetime, timedelta
+from django.db import connection
+from django.db.models import Count, F
+from livesettings import config_value
+from payment.models import CaptureRequest, CAPTURE_STATUS
+from payment.utils import get_processor_by_key
+from satchmo_store.shop.models import OrderAuthorization
+from satchmo_utils.db import chunked, DEFAULT_CHUNK_SIZE
+import logging
+import Queue
+import threading
+import time
+
+log = logging.getLogger('payment.capture')
+
+def enqueue_capture(order):
+    """Queue the capture of the outstanding authorizations of `order`."""
+    request, created = CaptureRequest.objects.get_or_create(order=order)
+    if not created and request.status in ('DONE', 'FAILED'):
+        CaptureRequest.objects.filter(id=request.id, status=request.status).update(
+            status='QUEUED', message='', completed=None, time_stamp=datetime.now())
+    log.debug('Queued the capture of order #%i', order.id)
+    return request
+
+def capture_progress():
+    """Return the number of capture requests in each status."""
+    counts = dict([(status, 0) for status, label in CAPTURE_STATUS])
+    for row in CaptureRequest.objects.order_by().values('status').annotate(count=Count('id')):
+        counts[row['status']] = row['count']
+    return counts
+
+class RateLimiter(object):
+    """Spaces out the calls to `wait` to at most `rate` per second, or not
+    at all for a rate of 0."""
+
+    def __init__(self, rate):
+        if rate:
+            self.interval = 1.0 / rate
+        else:
+            self.interval = 0
+        self.next = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        self._lock.acquire()
+        try:
+            now = time.time()
+            at = max(self.next, now)
+            self.next = at + self.interval
+        finally:
+            self._lock.release()
+        if at > now:
+            time.sleep(at - now)
+
+class CaptureQueue(object):
+    """Captures the queued orders, with `workers` threads and at most `rate`
+    captures per second for each payment module.  Requests running for more
+    than `timeout` minutes are queued again."""
+
+    def __init__(self, workers=None, rate=None, chunk_size=DEFAULT_CHUNK_SIZE, timeout=None):
+        if workers is None:
+            workers = config_value('PAYMENT', 'CAPTURE_WORKERS')
+        if rate is None:
+            rate = config_value('PAYMENT', 'CAPTURE_RATE')
+        if timeout is None:
+            timeout = config_value('PAYMENT', 'CAPTURE_TIMEOUT')
+
+        self.workers = max(1, workers)
+        self.rate = max(0, rate)
+        self.timeout = timedelta(minutes=max(1, timeout))
+        self.chunk_size = chunk_size
+        self.counts = {'captured' : 0, 'failed' : 0, 'skipped' : 0}
+        self.limiters = {}
+        self._lock = threading.Lock()
+
+    def _limiter(self, key):
+        self._lock.acquire()
+        try:
+            limiter = self.limiters.get(key, None)
+            if limiter is None:
+                limiter = RateLimiter(self.rate)
+                self.limiters[key] = limiter
+            return limiter
+        finally:
+            self._lock.release()
+
+    def run(self, retry_failed=False):
+        """Capture the queued orders, and with `retry_failed` the ones which
+        failed before.  Returns the counts of captured, failed and skipped
+        orders."""
+        stale = CaptureRequest.objects.filter(status='RUNNING',
+            claimed__lt=datetime.now() - self.timeout).update(status='QUEUED')
+        if stale:
+            log.warn('Queued %i interrupted captures again', stale)
+        if retry_failed:
+            CaptureRequest.objects.filter(status='FAILED').update(status='QUEUED')
+
+        pks = list(CaptureRequest.objects.filter(status='QUEUED').order_by('id').values_list('id', flat=True))
+        done = 0
+        for chunk in chunked(pks, self.chunk_size):
+            self._run_chunk(chunk)
+            done += len(chunk)
+            log.info('Processed %i of %i queued captures: %s', done, len(pks), self.counts)
+        return self.counts
+
+    def _run_chunk(self, pks):
+        requests = list(CaptureRequest.objects.filter(id__in=pks, status='QUEUED').select_related('order'))
+        orders = [request.order_id for request in requests]
+
+        keys = {}
+        for order, key in OrderAuthorization.objects.filter(order__in=orders, complete=False).order_by(
+            'payment').values_list('order', 'payment').distinct():
+            if not key in keys.setdefault(order, []):
+                keys[order].append(key)
+
+        jobs = {}
+        nothing = []
+        for request in requests:
+            orderkeys = keys.get(request.order_id, None)
+            if not orderkeys:
+                nothing.append(request.id)
+                continue
+            # an order paid through several modules is captured by the workers of the first
+            jobs.setdefault(orderkeys[0], []).append((request, orderkeys))
+
+        if nothing:
+            CaptureRequest.objects.filter(id__in=nothing, status='QUEUED').update(status='DONE',
+                message='Nothing to capture', completed=datetime.now())
+            self.counts['skipped'] += len(nothing)
+
+        if self.workers == 1:
+            for key in sorted(jobs.keys()):
+                for job in jobs[key]:
+                    self._capture(job)
+        else:
+            threads = []
+            for key, keyjobs in jobs.items():
+                queue = Queue.Queue()
+                for job in keyjobs:
+                    queue.put(job)
+                for i in range(min(self.workers, len(keyjobs))):
+                    thread = threading.Thread(target=self._worker, args=(queue,))
+                    thread.start()
+                    threads.append(thread)
+            for thread in threads:
+                thread.join()
+
+    def _worker(self, queue):
+        try:
+            while True:
+                try:
+                    job = queue.get_nowait()
+                except Queue.Empty:
+                    break
+                self._capture(job)
+        finally:
+            # every thread has its own connection
+            connection.close()
+
+    def _capture(self, job):
+        request, keys = job
+        order = request.order
+        # claim the capture, unless another run got to it first
+        if not CaptureRequest.objects.filter(id=request.id, status='QUEUED').update(
+            status='RUNNING', attempts=F('attempts') + 1, claimed=datetime.now()):
+            self._count('skipped')
+            return
+
+        success = True
+        messages = []
+        try:
+            for key in keys:
+                self._limiter(key).wait()
+                processor = get_processor_by_key('PAYMENT_%s' % key)
+                for result in processor.capture_authorized_payments(order):
+                    if not result.success:
+                        success = False
+                        messages.append(unicode(result.message))
+        except Exception, e:
+            log.exception('Error capturing order #%i', order.id)
+            success = False
+            messages.append(unicode(e))
+
+        self._record(request.id, success, u", ".join(messages)[:255])
+        if success:
+            self._count('captured')
+        else:
+            self._count('failed')
+
+    def _count(self, key):
+        self._lock.acquire()
+        try:
+            self.counts[key] += 1
+        finally:
+            self._lock.release()
+
+    def _record(self, pk, success, message):
+        """Save the result of a capture as soon as it is done, so that an
+        interrupted run loses none of them."""
+        if success:
+            status = 'DONE'
+        else:
+            status = 'FAILED'
+        CaptureRequest.objects.filter(id=pk).update(status=status,
+            message=message, completed=datetime.now())
@@ -87,7 +87,67 @@ config_register_list(
         'USE_DISCOUNTS',
         description=_("Use discounts"),
         help_text=_("""If disabled, customers will not be asked for any discount codes."""),
-        default=True)
+        default=True),
+
+    PositiveIntegerValue(PAYMENT_GROUP,
+        'REBILL_WORKERS',
+        description=_("Rebilling workers"),
+        help_text=_("Number of subscription orders charged at the same time by the recurring billing."),
+        default=1),
+
+    PositiveIntegerValue(PAYMENT_GROUP,
+        'REBILL_RETRIES',
+        description=_("Rebilling attempts"),
+        help_text=_("Number of times a failed subscription renewal is charged before giving up."),
+        default=3),
+
+    PositiveIntegerValue(PAYMENT_GROUP,
+        'REBILL_RETRY_HOURS',
+        description=_("Hours between rebilling attempts"),
+        help_text=_("Number of hours to wait before charging a failed subscription renewal again."),
+        default=24),
+
+    PositiveIntegerValue(PAYMENT_GROUP,
+        'GATEWAY_TIMEOUT',
+        description=_("Gateway timeout"),
+        help_text=_("Number of seconds to wait for a payment gateway to answer."),
+        default=30),
+
+    PositiveIntegerValue(PAYMENT_GROUP,
+        'GATEWAY_RETRIES',
+        description=_("Gateway retries"),
+        help_text=_("Number of times a void or a verification is sent again when the payment gateway can't be reached or answers with a server error.  Calls which time out, and charges and captures, are never sent twice."),
+        default=2),
+
+    PositiveIntegerValue(PAYMENT_GROUP,
+        'GATEWAY_CONNECTIONS',
+        description=_("Gateway connections"),
+        help_text=_("Number of connections kept open to each payment gateway."),
+        default=4),
+
+    BooleanValue(PAYMENT_GROUP,
+        'CAPTURE_QUEUE',
+        description=_("Queue captures on shipping"),
+        help_text=_("If True, the authorizations of shipped orders are captured by the satchmo_capture_payments command instead of while the order status is changed."),
+        default=False),
+
+    PositiveIntegerValue(PAYMENT_GROUP,
+        'CAPTURE_WORKERS',
+        description=_("Capture workers"),
+        help_text=_("Number of queued captures sent to each payment gateway at the same time."),
+        default=2),
+
+    PositiveIntegerValue(PAYMENT_GROUP,
+        'CAPTURE_RATE',
+        description=_("Capture rate"),
+        help_text=_("Maximum number of queued captures sent to each payment gateway per second, 0 for no limit."),
+        default=0),
+
+    PositiveIntegerValue(PAYMENT_GROUP,
+        'CAPTURE_TIMEOUT',
+        description=_("Capture timeout"),
+        help_text=_("Number of minutes after which a queued capture still running, because the satchmo_capture_payments command was interrupted, is queued again."),
+        default=30)
 )
 
 # --- helper functions ---
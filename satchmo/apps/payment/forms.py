@@ -19,6 +19,7 @@ from satchmo_store.shop.signals import satchmo_shipping_price_query
 from satchmo_utils.dynamic import lookup_template
 from satchmo_utils.views import CreditCard
 from shipping.config import shipping_methods, shipping_method_by_key
+from shipping.quotes import quote_methods
 from shipping.signals import shipping_choices_query
 from shipping.utils import update_shipping
 from signals_ahoy.signals import form_init, form_initialdata, form_presave, form_postsave, form_validate
@@ -80,8 +81,7 @@ def _get_shipping_choices(request, paymentmodule, cart, contact, default_view_ta
         taxer = _get_taxprocessor(request)
         shipping_tax = TaxClass.objects.get(title=config_value('TAX', 'TAX_CLASS'))
 
-    for method in methods:
-        method.calculate(cart, contact)
+    for method in quote_methods(methods, cart, contact):
         if method.valid():
             template = lookup_template(paymentmodule, 'shipping/options.html')
             t = loader.get_template(template)
@@ -27,8 +27,13 @@ def shipping_hide_if_one(sender, form=None, **kwargs):
     log.warn("shipping_hide_if_one listener is deprecated, please configure this in your site settings in the shipping section.")
     
 def capture_on_ship_listener(sender, oldstatus="", newstatus="", order=None, **kwargs):
-    """Listen for a transition to 'shipped', and capture authorizations."""
+    """Listen for a transition to 'shipped', and capture authorizations, or
+    queue their capture if CAPTURE_QUEUE is set."""
 
     log.debug('heard satchmo_order_status_changed, %s=%s', oldstatus, newstatus)
     if oldstatus != 'Shipped' and newstatus == 'Shipped':
-        capture_authorizations(order)
+        if config_value('PAYMENT', 'CAPTURE_QUEUE'):
+            from payment.capture import enqueue_capture
+            enqueue_capture(order)
+        else:
+            capture_authorizations(order)
@@ -1,4 +1,7 @@
 from django.core.management.base import NoArgsCommand
+from optparse import make_option
+from satchmo_utils.db import DEFAULT_CHUNK_SIZE
+import time
 
 class Command(NoArgsCommand):
     help = ("Invokes recurring billing system to do stuff like "
@@ -6,6 +9,32 @@ class Command(NoArgsCommand):
             "want to invoke this from a cron script.  For non-root "
             "users this is generally done with ``crontab -e``.")
 
+    option_list = NoArgsCommand.option_list + (
+        make_option('--days', dest='days', type='int', default=1,
+            help='Also bill the subscriptions which expired this many days ago, '
+                'after a missed run.  Billing twice is safe.'),
+        make_option('--workers', dest='workers', type='int', default=None,
+            help='Number of orders charged at the same time, default the '
+                'PAYMENT.REBILL_WORKERS setting.'),
+        make_option('--chunk-size', dest='chunk_size', type='int', default=DEFAULT_CHUNK_SIZE,
+            help='Number of orders loaded per batch of queries.'),
+    )
+
+    requires_model_validation = True
+
     def handle_noargs(self, **options):
-        from payment.views.cron import cron_rebill
-        cron_rebill()
+        from payment.rebill import Rebiller
+        from payment.transport import latency_histograms
+        verbosity = int(options.get('verbosity', 1))
+
+        start = time.time()
+        rebiller = Rebiller(days=options.get('days') or 1, workers=options.get('workers'),
+            chunk_size=options.get('chunk_size') or DEFAULT_CHUNK_SIZE)
+        counts = rebiller.run()
+
+        if verbosity > 0:
+            print "Billed %(billed)i, failed %(failed)i, skipped %(skipped)i, retried %(retried)i" % counts,
+            print "in %.2fs" % (time.time() - start)
+        if verbosity > 1:
+            for histogram in latency_histograms():
+                print unicode(histogram)
@@ -0,0 +1,44 @@
+from django.core.management.base import NoArgsCommand
+from optparse import make_option
+from satchmo_utils.db import DEFAULT_CHUNK_SIZE
+import time
+
+class Command(NoArgsCommand):
+    help = ("Captures the authorizations of the shipped orders queued when "
+            "the PAYMENT.CAPTURE_QUEUE setting is on.  You typically want to "
+            "invoke this from a cron script every few minutes.")
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--workers', dest='workers', type='int', default=None,
+            help='Number of orders captured at the same time by each payment module, '
+                'default the PAYMENT.CAPTURE_WORKERS setting.'),
+        make_option('--rate', dest='rate', type='int', default=None,
+            help='Maximum number of captures per second for each payment module, '
+                'default the PAYMENT.CAPTURE_RATE setting.'),
+        make_option('--timeout', dest='timeout', type='int', default=None,
+            help='Number of minutes after which an interrupted capture is queued again, '
+                'default the PAYMENT.CAPTURE_TIMEOUT setting.'),
+        make_option('--retry-failed', action='store_true', dest='retry_failed', default=False,
+            help='Also capture the orders which failed before.'),
+        make_option('--chunk-size', dest='chunk_size', type='int', default=DEFAULT_CHUNK_SIZE,
+            help='Number of orders loaded per batch of queries.'),
+    )
+
+    requires_model_validation = True
+
+    def handle_noargs(self, **options):
+        from payment.capture import CaptureQueue, capture_progress
+        verbosity = int(options.get('verbosity', 1))
+
+        start = time.time()
+        queue = CaptureQueue(workers=options.get('workers'), rate=options.get('rate'),
+            chunk_size=options.get('chunk_size') or DEFAULT_CHUNK_SIZE,
+            timeout=options.get('timeout'))
+        counts = queue.run(retry_failed=options.get('retry_failed'))
+
+        if verbosity > 0:
+            print "Captured %(captured)i, failed %(failed)i, skipped %(skipped)i" % counts,
+            print "in %.2fs" % (time.time() - start)
+        if verbosity > 1:
+            progress = capture_progress()
+            print "Queue: %(QUEUED)i queued, %(RUNNING)i running, %(DONE)i done, %(FAILED)i failed" % progress
@@ -12,7 +12,7 @@ from django.utils.translation import ugettext_lazy as _
 from livesettings import config_value, config_choice_values, SettingNotSet
 from payment.fields import PaymentChoiceCharField, CreditChoiceCharField
 from satchmo_store.contact.models import Contact
-from satchmo_store.shop.models import OrderPayment
+from satchmo_store.shop.models import Order, OrderItem, OrderPayment
 import base64
 import config
 import keyedcache
@@ -107,6 +107,66 @@ class CreditCardDetail(models.Model):
         verbose_name = _("Credit Card")
         verbose_name_plural = _("Credit Cards")
 
+RECURRING_CHARGE_STATUS = (
+    ('PENDING', _('Pending')),
+    ('PAID', _('Paid')),
+    ('FAILED', _('Failed')),
+    ('SKIPPED', _('Skipped')),
+)
+
+class RecurringCharge(models.Model):
+    """
+    The renewal of a subscription `OrderItem` by the recurring billing, see
+    `payment.rebill`.  It is created before the card is charged, and the item
+    is unique, so an item is never renewed twice.  Failed charges are retried
+    after `next_attempt`.
+    """
+    orderitem = models.ForeignKey(OrderItem, unique=True, related_name="recurringcharges")
+    order = models.ForeignKey(Order, related_name="recurringcharges")
+    renewal = models.ForeignKey(OrderItem, null=True, blank=True, related_name="renewalcharges")
+    status = models.CharField(_("Status"), max_length=10, choices=RECURRING_CHARGE_STATUS,
+        default='PENDING')
+    attempts = models.IntegerField(_("Attempts"), default=0)
+    next_attempt = models.DateTimeField(_("Next Attempt"), null=True, blank=True, db_index=True)
+    message = models.CharField(_("Message"), max_length=255, blank=True)
+    time_stamp = models.DateTimeField(_("Timestamp"), default=datetime.now)
+
+    def __unicode__(self):
+        return u"Recurring charge of %s: %s" % (self.orderitem, self.status)
+
+    class Meta:
+        verbose_name = _("Recurring Charge")
+        verbose_name_plural = _("Recurring Charges")
+
+CAPTURE_STATUS = (
+    ('QUEUED', _('Queued')),
+    ('RUNNING', _('Running')),
+    ('DONE', _('Done')),
+    ('FAILED', _('Failed')),
+)
+
+class CaptureRequest(models.Model):
+    """
+    The capture of the authorizations of a shipped order, queued by
+    `capture_on_ship_listener` when CAPTURE_QUEUE is set, and done by
+    `payment.capture`.
+    """
+    order = models.ForeignKey(Order, unique=True, related_name="capturerequests")
+    status = models.CharField(_("Status"), max_length=10, choices=CAPTURE_STATUS,
+        default='QUEUED', db_index=True)
+    attempts = models.IntegerField(_("Attempts"), default=0)
+    message = models.CharField(_("Message"), max_length=255, blank=True)
+    time_stamp = models.DateTimeField(_("Timestamp"), default=datetime.now)
+    claimed = models.DateTimeField(_("Claimed"), null=True, blank=True)
+    completed = models.DateTimeField(_("Completed"), null=True, blank=True)
+
+    def __unicode__(self):
+        return u"Capture of %s: %s" % (self.order, self.status)
+
+    class Meta:
+        verbose_name = _("Capture Request")
+        verbose_name_plural = _("Capture Requests")
+
 def _decrypt_code(code):
     """Decrypt code encrypted by _encrypt_code"""
     secret_key = settings.SECRET_KEY
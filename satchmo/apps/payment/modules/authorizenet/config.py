@@ -120,3 +120,11 @@ config_register(
         requires=ARB_ENABLED,
         default='https://apitest.authorize.net/xml/v1/request.api'))
 
+config_register(
+    PositiveIntegerValue(PAYMENT_GROUP,
+        'ARB_CONNECTIONS',
+        description=_("Concurrent ARB requests"),
+        help_text=_("""The number of subscriptions of an order which are submitted to ARB at the same time."""),
+        requires=ARB_ENABLED,
+        default=4))
+
@@ -1,6 +1,7 @@
 from datetime import datetime
 from decimal import Decimal
 from django.template import loader, Context
+from django.utils.encoding import smart_str
 from django.utils.http import urlencode
 from django.utils.translation import ugettext_lazy as _
 from payment.modules.base import BasePaymentProcessor, ProcessorResult
@@ -8,7 +9,9 @@ from satchmo_store.shop.models import Config
 from satchmo_utils.numbers import trunc_decimal
 from tax.utils import get_tax_processor
 from xml.dom import minidom
+import Queue
 import random
+import threading
 import urllib2
 
 class PaymentProcessor(BasePaymentProcessor):
@@ -170,6 +173,8 @@ class PaymentProcessor(BasePaymentProcessor):
             testflag = 'FALSE'
 
         trans['connection'] = conn
+        # voiding twice does no harm, so it is retried on errors
+        trans['idempotent'] = True
 
         trans['configuration'] = {
             'x_login' : settings.LOGIN.value,
@@ -397,46 +402,94 @@ class PaymentProcessor(BasePaymentProcessor):
         return trans
 
     def process_recurring_subscriptions(self, recurlist, testing=False):
-        """Post all subscription requests."""
+        """Post all subscription requests.
 
+        The requests are all rendered first, then posted at the same time,
+        at most ARB_CONNECTIONS at once, and the payments of the
+        subscriptions which went through are recorded at the end.
+        """
+        requests = self.render_recurring_requests(recurlist)
+        responses = self.post_recurring_requests(recurlist[0]['connection'], requests)
+
+        success = True
         results = []
-        for recur in recurlist:
-            success, reason, response, subscription_id = self.process_recurring_subscription(recur, testing=testing)
-            if success:
+        for recur, response in zip(recurlist, responses):
+            ok, reason, response_text, subscription_id = response
+            if ok:
                 if not testing:
                     payment = self.record_payment(order=self.order, amount=recur['charged_today'], transaction_id=subscription_id, reason_code=reason)
-                    results.append(ProcessorResult(self.key, success, response, payment=payment))
+                    results.append(ProcessorResult(self.key, ok, response_text, payment=payment))
             else:
-                self.log.info("Failed to process recurring subscription, %s: %s", reason, response)
-                break
+                self.log.info("Failed to process recurring subscription, %s: %s", reason, response_text)
+                success = False
 
         return success, results
 
     def process_recurring_subscription(self, data, testing=False):
         """Post one subscription request."""
-        self.log_extra('Processing subscription: %s', data['product'].slug)
+        request = self.render_recurring_requests([data])[0]
+        return self.post_recurring_requests(data['connection'], [request])[0]
 
+    def render_recurring_requests(self, recurlist):
+        """Render the ARB request of each subscription, with the template
+        loaded once."""
         t = loader.get_template('shop/checkout/authorizenet/arb_create_subscription.xml')
-        ctx = Context(data)
-        request = t.render(ctx)
-
-        if self.settings.EXTRA_LOGGING.value:
-            data['redact'] = True
-            ctx = Context(data)
-            redacted = t.render(ctx)
-            self.log_extra('Posting data to: %s\n%s', data['connection'], redacted)
-
+        requests = []
+        for data in recurlist:
+            self.log_extra('Processing subscription: %s', data['product'].slug)
+            requests.append(smart_str(t.render(Context(data))))
+
+            if self.settings.EXTRA_LOGGING.value:
+                data['redact'] = True
+                redacted = t.render(Context(data))
+                del data['redact']
+                self.log_extra('Posting data to: %s\n%s', data['connection'], redacted)
+        return requests
+
+    def post_recurring_requests(self, connection, requests):
+        """Post the rendered ARB requests to `connection` over kept-alive
+        connections, at most ARB_CONNECTIONS at the same time.
+
+        Returns a (success, reason, response_text, subscription_id) tuple for
+        each request, in order.
+        """
+        workers = max(1, self.settings.ARB_CONNECTIONS.value)
+        responses = [None] * len(requests)
+        work = Queue.Queue()
+        for ix in range(len(requests)):
+            work.put(ix)
+
+        def worker():
+            while True:
+                try:
+                    ix = work.get_nowait()
+                except Queue.Empty:
+                    break
+                responses[ix] = self._post_recurring_request(connection, requests[ix])
+
+        if len(requests) == 1:
+            worker()
+        else:
+            threads = [threading.Thread(target=worker) for i in range(min(workers, len(requests)))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        return responses
+
+    def _post_recurring_request(self, connection, request):
         headers = {'Content-type':'text/xml'}
-        conn = urllib2.Request(data['connection'], request, headers)
         try:
-            f = urllib2.urlopen(conn)
-            all_results = f.read()
+            all_results = self.post(connection, request, headers)
         except urllib2.URLError, ue:
-            self.log.error("error opening %s\n%s", data['connection'], ue)
+            self.log.error("error opening %s\n%s", connection, ue)
             return (False, 'ERROR', _('Could not talk to Authorize.net gateway'), None)
 
         self.log_extra('Authorize response: %s', all_results)
+        return self.parse_recurring_response(all_results)
 
+    def parse_recurring_response(self, all_results):
+        """Parse an ARB response into (success, reason, response_text, subscription_id)."""
         subscriptionID = None
         try:
             response = minidom.parseString(all_results)
@@ -489,10 +542,9 @@ class PaymentProcessor(BasePaymentProcessor):
         """
         self.log.info("About to send a request to authorize.net: %(connection)s\n%(logPostString)s", data)
 
-        conn = urllib2.Request(url=data['connection'], data=data['postString'])
         try:
-            f = urllib2.urlopen(conn)
-            all_results = f.read()
+            all_results = self.post(data['connection'], data['postString'],
+                idempotent=data.get('idempotent', False))
             self.log_extra('Authorize response: %s', all_results)
         except urllib2.URLError, ue:
             self.log.error("error opening %s\n%s", data['connection'], ue)
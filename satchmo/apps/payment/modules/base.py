@@ -1,6 +1,9 @@
 from datetime import datetime
 from decimal import Decimal
+from django.db.models import Count
 from django.utils.translation import ugettext_lazy as _
+from payment.transport import get_transport
+from product.utils import load_subtypes
 from satchmo_store.shop.models import OrderAuthorization, OrderPayment, OrderPaymentFailure, OrderPendingPayment, OrderStatus
 import logging
 
@@ -89,15 +92,28 @@ class BasePaymentProcessor(object):
 
     def get_recurring_orderitems(self):
         """Iterate through the order and get all recurring billing items"""
+        orderitems = list(self.order.orderitem_set.select_related('product'))
+        load_subtypes([orderitem.product for orderitem in orderitems])
+
+        # the number of trials of the non-recurring subscriptions, in one query
+        trials = {}
+        nonrecurring = [orderitem.product_id for orderitem in orderitems
+            if orderitem.product.is_subscription and not orderitem.product.subscriptionproduct.recurring]
+        if nonrecurring:
+            from product.modules.subscription.models import Trial
+            for row in Trial.objects.filter(subscription__in=nonrecurring).order_by().values(
+                'subscription').annotate(count=Count('id')):
+                trials[row['subscription']] = row['count']
+
         subscriptions = []
-        for orderitem in self.order.orderitem_set.all():
+        for orderitem in orderitems:
             product = orderitem.product
             if product.is_subscription:
                 self.log_extra('Found subscription product: %s', product.slug)
                 if product.subscriptionproduct.recurring:
                     self.log_extra('Subscription is recurring: %s', product.slug)
                     subscriptions.append(orderitem)
-                elif product.subscriptionproduct.trial_set.count() > 0:
+                elif trials.get(product.id, 0) > 0:
                     self.log_extra('Not recurring, but it has a trial: %s', product.slug)
                     subscriptions.append(orderitem)
                 else:
@@ -114,6 +130,12 @@ class BasePaymentProcessor(object):
         if self.settings.EXTRA_LOGGING.value:
             self.log.info("(Extra logging) " + msg, *args)
 
+    def post(self, url, data, headers=None, idempotent=False):
+        """POST `data` to the gateway at `url` over a kept-alive connection,
+        and return the body of the response.  Only set `idempotent` for calls
+        which can safely be sent twice, they are retried on errors."""
+        return get_transport(self.key).post(url, data, headers=headers, idempotent=idempotent)
+
     def prepare_data(self, order):
         self.order = order
 
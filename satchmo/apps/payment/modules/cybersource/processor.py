@@ -1,4 +1,5 @@
 from django.template import Context, loader
+from django.utils.encoding import smart_str
 from payment.modules.base import BasePaymentProcessor, ProcessorResult
 from satchmo_utils.numbers import trunc_decimal
 from django.utils.translation import ugettext_lazy as _
@@ -130,16 +131,16 @@ class PaymentProcessor(BasePaymentProcessor):
             'card' : self.card,
         })
         request = t.render(c)
-        conn = urllib2.Request(url=self.connection, data=request)
         try:
-            f = urllib2.urlopen(conn)
+            all_results = self.post(self.connection, smart_str(request))
         except urllib2.HTTPError, e:
             # we probably didn't authenticate properly
             # make sure the 'v' in your account number is lowercase
             return ProcessorResult(self.key, False, 'Problem parsing results')
+        except urllib2.URLError, ue:
+            self.log.error("error opening %s\n%s", self.connection, ue)
+            return ProcessorResult(self.key, False, 'Could not talk to the Cybersource gateway')
 
-        f = urllib2.urlopen(conn)
-        all_results = f.read()
         tree = fromstring(all_results)
         parsed_results = tree.getiterator('{urn:schemas-cybersource-com:transaction-data-1.26}reasonCode')
         try:
@@ -9,6 +9,7 @@ from django.utils.translation import ugettext as _
 from django.views.decorators.cache import never_cache
 from livesettings import config_get_group, config_value
 from payment.config import gateway_live
+from payment.transport import get_transport
 from payment.utils import get_processor_by_key
 from payment.views import payship
 from satchmo_store.shop.models import Cart
@@ -18,7 +19,6 @@ from satchmo_utils.dynamic import lookup_url, lookup_template
 from sys import exc_info
 from traceback import format_exception
 import logging
-import urllib2
 from django.views.decorators.csrf import csrf_exempt
 
 
@@ -200,16 +200,13 @@ def confirm_ipn_data(data, PP_URL):
     newparams['cmd'] = "_notify-validate"
     params = urlencode(newparams)
 
-    req = urllib2.Request(PP_URL)
-    req.add_header("Content-type", "application/x-www-form-urlencoded")
-    fo = urllib2.urlopen(req, params)
-
-    ret = fo.read()
+    # verifying twice does no harm, so it is retried on errors
+    status, ret = get_transport('PAYPAL').request(PP_URL, params, idempotent=True)
     if ret == "VERIFIED":
         log.info("PayPal IPN data verification was successful.")
     else:
         log.info("PayPal IPN data verification failed.")
-        log.debug("HTTP code %s, response text: '%s'" % (fo.code, ret))
+        log.debug("HTTP code %s, response text: '%s'" % (status, ret))
         return False
 
     return True
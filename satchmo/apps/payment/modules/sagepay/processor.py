@@ -154,10 +154,8 @@ class PaymentProcessor(BasePaymentProcessor):
 
             else:
                 self.log_extra("About to post to server: %s?%s", self.url, self.postString)
-                conn = urllib2.Request(self.url, data=self.postString)
                 try:
-                    f = urllib2.urlopen(conn)
-                    result = f.read()
+                    result = self.post(self.url, self.postString)
                     self.log_extra('Process: url=%s\nPacket=%s\nResult=%s', self.url, self.packet, result)
 
                 except urllib2.URLError, ue:
@@ -0,0 +1,343 @@
+"""
+Recurring billing of subscriptions.
+
+`cron_rebill` used to look at every order item which hadn't expired yet, ran
+several queries for each of them, and charged the cards one at a time.
+`Rebiller` selects the completed subscription items which expire in the
+billing window with an indexed query on `OrderItem.expire_date`, and loads
+the item counts, trial terms and payments of their orders a chunk of orders
+at a time.
+
+The orders are charged by a pool of `workers` threads.  All the items of an
+order are billed by the same worker, one after the other, since every charge
+is for the balance of the order.  Before an item is renewed, a
+`RecurringCharge` is created for it.  The item is unique, so running the
+billing again, or in another process at the same time, skips the items
+which are already claimed.  A failed charge keeps its `RecurringCharge`,
+and is retried by the following runs until it succeeds or runs out of
+attempts.  An error while renewing the item or preparing the charge fails
+the charge the same way, so a claimed item is never left unbilled.
+"""
+from django.db import connection, IntegrityError, transaction
+from django.db.models import Count, Max
+from django.utils.translation import ugettext
+from livesettings import config_get_group, config_value
+from payment.models import RecurringCharge
+from product import active_product_types
+from satchmo_store.shop.models import OrderItem, OrderPayment
+from satchmo_utils.db import chunked, DEFAULT_CHUNK_SIZE
+import datetime
+import logging
+import Queue
+import threading
+
+log = logging.getLogger('payment.rebill')
+
+# payment modules which bill through a third party, and tell us with an IPN
+IPN_BASED = ('PAYPAL',)
+
+def _trial(trials, n):
+    if n >= 0 and n < len(trials):
+        return trials[n]
+    return None
+
+class Rebiller(object):
+    """Rebills the subscriptions expiring in the `days` up to `day`, today by
+    default, and retries the failed charges which are due."""
+
+    def __init__(self, day=None, days=1, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        if day is None:
+            day = datetime.date.today()
+        if workers is None:
+            workers = config_value('PAYMENT', 'REBILL_WORKERS')
+
+        self.day = day
+        self.days = max(1, days)
+        self.workers = max(1, workers)
+        self.chunk_size = chunk_size
+        self.retries = config_value('PAYMENT', 'REBILL_RETRIES')
+        self.retry_delay = datetime.timedelta(hours=config_value('PAYMENT', 'REBILL_RETRY_HOURS'))
+        self.counts = {'billed' : 0, 'failed' : 0, 'skipped' : 0, 'retried' : 0}
+        self._lock = threading.Lock()
+
+    def _count(self, key):
+        self._lock.acquire()
+        try:
+            self.counts[key] += 1
+        finally:
+            self._lock.release()
+
+    def run(self):
+        """Retry the failed charges, then bill the expiring items.  Returns
+        the counts of billed, failed, skipped and retried charges."""
+        if not 'SubscriptionProduct' in [subtype for module, subtype in active_product_types()]:
+            log.debug('Subscription products are not installed, nothing to rebill')
+            return self.counts
+
+        self.retry_failed()
+        self.bill_due()
+        log.info('Rebilled subscriptions expiring %s: %s', self.day, self.counts)
+        return self.counts
+
+    def due_items(self):
+        """The completed subscription items expiring in the billing window."""
+        start = self.day - datetime.timedelta(days=self.days - 1)
+        return OrderItem.objects.filter(expire_date__range=(start, self.day), completed=True,
+            product__subscriptionproduct__isnull=False)
+
+    def bill_due(self):
+        byorder = {}
+        for pk, order in self.due_items().order_by('order', 'id').values_list('id', 'order'):
+            byorder.setdefault(order, []).append(pk)
+
+        for orders in chunked(sorted(byorder.keys()), self.chunk_size):
+            itemids = []
+            for order in orders:
+                itemids.extend(byorder[order])
+            self._run_jobs(self._load_jobs(orders, itemids), self._bill_order)
+
+    def _load_jobs(self, orders, itemids):
+        """Load the items, and everything needed to bill them, for a chunk
+        of orders.  Returns a job per order."""
+        from product.modules.subscription.models import SubscriptionProduct, Trial
+
+        items = list(OrderItem.objects.filter(id__in=itemids).select_related(
+            'order', 'product').order_by('order', 'id'))
+        productids = set([item.product_id for item in items])
+        subscriptions = SubscriptionProduct.objects.in_bulk(list(productids))
+
+        trials = {}
+        for trial in Trial.objects.filter(subscription__in=productids).order_by('id'):
+            trials.setdefault(trial.subscription_id, []).append(trial)
+
+        # the number of items of each product in the orders, and the last one
+        counts = {}
+        last = {}
+        ordercounts = {}
+        for row in OrderItem.objects.filter(order__in=orders).order_by().values(
+            'order', 'product').annotate(count=Count('id'), last=Max('id')):
+            key = (row['order'], row['product'])
+            counts[key] = row['count']
+            last[key] = row['last']
+            ordercounts[row['order']] = ordercounts.get(row['order'], 0) + row['count']
+
+        payments = {}
+        for payment in OrderPayment.objects.filter(order__in=orders).order_by('id'):
+            payments.setdefault(payment.order_id, payment)
+
+        claimed = set(RecurringCharge.objects.filter(orderitem__in=itemids).values_list(
+            'orderitem', flat=True))
+
+        jobs = {}
+        for item in items:
+            key = (item.order_id, item.product_id)
+            subscription = subscriptions.get(item.product_id, None)
+            if subscription is None or item.id in claimed:
+                continue
+            producttrials = trials.get(item.product_id, [])
+            if subscription.recurring_times and \
+                subscription.recurring_times + len(producttrials) == counts[key]:
+                # all the payments are made
+                continue
+            if item.id != last[key]:
+                # renewed already
+                continue
+            job = jobs.setdefault(item.order_id, {
+                'order' : item.order,
+                'ordercount' : ordercounts[item.order_id],
+                'payment' : payments.get(item.order_id, None),
+                'items' : [],
+            })
+            job['items'].append((item, subscription, producttrials))
+
+        return [jobs[order] for order in sorted(jobs.keys())]
+
+    def _run_jobs(self, jobs, func):
+        """Run `func` for each job, on a pool of worker threads."""
+        if self.workers == 1 or len(jobs) < 2:
+            for job in jobs:
+                self._run_job(func, job)
+            return
+
+        queue = Queue.Queue()
+        for job in jobs:
+            queue.put(job)
+        threads = []
+        for i in range(min(self.workers, len(jobs))):
+            thread = threading.Thread(target=self._worker, args=(queue, func))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+    def _worker(self, queue, func):
+        try:
+            while True:
+                try:
+                    job = queue.get_nowait()
+                except Queue.Empty:
+                    break
+                self._run_job(func, job)
+        finally:
+            # every thread has its own connection
+            connection.close()
+
+    def _run_job(self, func, job):
+        try:
+            func(job)
+        except Exception, e:
+            log.exception('Error rebilling order #%i: %s', job['order'].id, e)
+
+    def _bill_order(self, job):
+        order = job['order']
+        ordercount = job['ordercount']
+        for item, subscription, trials in job['items']:
+            charge = self._claim(item)
+            if charge is None:
+                self._count('skipped')
+                continue
+
+            try:
+                self._renew(charge, order, item, subscription, trials, ordercount)
+            except Exception, e:
+                log.exception('Error renewing item #%i of order #%i', item.id, order.id)
+                charge.attempts += 1
+                self._failed(charge, e)
+                continue
+            ordercount += 1
+            self.charge(charge, order, job['payment'])
+
+    def _renew(self, charge, order, item, subscription, trials, ordercount):
+        """Add the renewal of `item` to `order`, and save it in `charge`."""
+        renewal = OrderItem(order=order, product=item.product, quantity=item.quantity,
+            unit_price=item.unit_price, line_item_price=item.line_item_price)
+        if subscription.recurring:
+            renewal.expire_date = subscription.calc_expire_date()
+
+        # with two or more trial periods, check whether the last one paid
+        # was a trial or a regular payment
+        previous = _trial(trials, ordercount - 1)
+        following = _trial(trials, ordercount)
+        if len(trials) > 1 and previous and following and item.unit_price == previous.price:
+            renewal.unit_price = following.price
+            renewal.line_item_price = renewal.quantity * renewal.unit_price
+            renewal.expire_date = following.calc_expire_date()
+
+        renewal.save()
+        charge.renewal = renewal
+        charge.save()
+        order.recalculate_total()
+
+    def _claim(self, item):
+        """Create the `RecurringCharge` of `item`, or return None if it has one."""
+        try:
+            return RecurringCharge.objects.create(orderitem=item, order=item.order)
+        except IntegrityError:
+            transaction.rollback_unless_managed()
+            return None
+
+    def charge(self, charge, order, payment):
+        """Charge the balance of `order` with the payment module of its
+        first `payment`, and record the result in `charge`."""
+        if payment is None or payment.payment in IPN_BASED or order.balance <= 0:
+            charge.status = 'SKIPPED'
+            charge.save()
+            self._count('skipped')
+            return
+
+        try:
+            payment_module = config_get_group('PAYMENT_%s' % payment.payment)
+            credit_processor = payment_module.MODULE.load_module('processor')
+            processor = credit_processor.PaymentProcessor(payment_module)
+            processor.prepare_data(order)
+            result = processor.process()
+            success, message = result.success, result.message
+            if result.payment:
+                reason_code = result.payment.reason_code
+            else:
+                reason_code = "unknown"
+        except Exception, e:
+            log.exception('Error charging order #%i', order.id)
+            success, message, reason_code = False, unicode(e), "error"
+
+        log.info("""Processing %s recurring transaction
+            Order #%i
+            Results=%s
+            Response=%s
+            Reason=%s""",
+            payment.payment,
+            order.id,
+            success,
+            reason_code,
+            message)
+
+        charge.attempts += 1
+        if success:
+            order.add_status(status='New', notes = ugettext("Subscription Renewal Order successfully submitted"))
+            charge.renewal.completed = True
+            charge.renewal.save()
+            orderpayment = OrderPayment(order=order, amount=order.balance, payment=unicode(payment_module.KEY.value))
+            orderpayment.save()
+            charge.status = 'PAID'
+            charge.message = unicode(message)[:255]
+            charge.next_attempt = None
+            charge.save()
+            self._count('billed')
+        else:
+            self._failed(charge, message)
+
+    def _failed(self, charge, message):
+        """Record the failure of `charge`, to be retried after the retry delay
+        unless it has run out of attempts."""
+        charge.status = 'FAILED'
+        charge.message = unicode(message)[:255]
+        if charge.attempts < self.retries:
+            charge.next_attempt = datetime.datetime.now() + self.retry_delay
+        else:
+            charge.next_attempt = None
+        charge.save()
+        self._count('failed')
+
+    def retry_failed(self):
+        """Charge the orders of the failed charges which are due for a retry."""
+        due = RecurringCharge.objects.filter(status='FAILED', next_attempt__lte=datetime.datetime.now())
+        for pks in chunked(list(due.order_by('order', 'id').values_list('id', flat=True)), self.chunk_size):
+            jobs = {}
+            for charge in RecurringCharge.objects.filter(id__in=pks).select_related('order', 'renewal'):
+                jobs.setdefault(charge.order_id, {'order' : charge.order, 'charges' : []})['charges'].append(charge)
+            payments = {}
+            for payment in OrderPayment.objects.filter(order__in=jobs.keys()).order_by('id'):
+                payments.setdefault(payment.order_id, payment)
+            for order, job in jobs.items():
+                job['payment'] = payments.get(order, None)
+            self._run_jobs([jobs[order] for order in sorted(jobs.keys())], self._retry_order)
+
+    def _retry_order(self, job):
+        for charge in job['charges']:
+            # claim the retry, unless another run got to it first
+            if not RecurringCharge.objects.filter(id=charge.id, status='FAILED',
+                attempts=charge.attempts).update(status='PENDING'):
+                continue
+            self._count('retried')
+            try:
+                if charge.renewal is None:
+                    # the renewal failed before the card was charged
+                    self._renew_again(charge, job['order'])
+                else:
+                    job['order'].recalculate_total()
+            except Exception, e:
+                log.exception('Error renewing item #%i of order #%i', charge.orderitem_id, charge.order_id)
+                charge.attempts += 1
+                self._failed(charge, e)
+                continue
+            self.charge(charge, job['order'], job['payment'])
+
+    def _renew_again(self, charge, order):
+        """Add the renewal of the item of `charge` to `order`."""
+        from product.modules.subscription.models import SubscriptionProduct, Trial
+
+        item = charge.orderitem
+        subscription = SubscriptionProduct.objects.get(pk=item.product_id)
+        trials = list(Trial.objects.filter(subscription=subscription).order_by('id'))
+        ordercount = OrderItem.objects.filter(order=order).count()
+        self._renew(charge, order, item, subscription, trials, ordercount)
@@ -10,9 +10,17 @@ from payment import utils
 from product.models import *
 from satchmo_store.contact.models import *
 from satchmo_store.shop.models import *
+from satchmo_utils import sslurllib
 from satchmo_utils.dynamic import lookup_template, lookup_url
 from urls import make_urlpatterns
+import BaseHTTPServer
+import datetime
 import keyedcache
+import re
+import SocketServer
+import threading
+import time
+import urllib2
 
 alphabet = 'abcdefghijklmnopqrstuvwxyz'
 
@@ -255,6 +263,57 @@ class TestPaymentHandling(TestCase):
         self.assertEqual(order.authorized_remaining, Decimal('0'))
         self.assertEqual(order.balance, Decimal('0'))
 
+    def test_capture_queue(self):
+        """Test queueing the capture of a shipped order, and capturing it later."""
+        from payment.capture import CaptureQueue, capture_progress
+        from payment.models import CaptureRequest
+
+        queued = config_get('PAYMENT', 'CAPTURE_QUEUE')
+        queued.update(True)
+        try:
+            order = make_test_order(self.US, '')
+            processor = utils.get_processor_by_key('PAYMENT_DUMMY')
+            processor.create_pending_payment(order=order, amount=order.total)
+            processor.prepare_data(order)
+            result = processor.authorize_payment()
+            self.assertEqual(result.success, True)
+
+            order.add_status('Shipped')
+            self.assertEqual(order.authorized_remaining, Decimal('125.00'))
+            self.assertEqual(capture_progress()['QUEUED'], 1)
+
+            counts = CaptureQueue(workers=1).run()
+            self.assertEqual(counts['captured'], 1)
+            self.assertEqual(order.authorized_remaining, Decimal('0'))
+            self.assertEqual(order.balance, Decimal('0'))
+            request = CaptureRequest.objects.get(order=order)
+            self.assertEqual(request.status, 'DONE')
+            self.assertEqual(request.attempts, 1)
+
+            # running again captures nothing
+            counts = CaptureQueue(workers=1).run()
+            self.assertEqual(counts['captured'], 0)
+
+            # a capture left running by a killed run is queued again once
+            # it times out
+            order = make_test_order(self.US, '')
+            processor.create_pending_payment(order=order, amount=order.total)
+            processor.prepare_data(order)
+            processor.authorize_payment()
+            order.add_status('Shipped')
+            claimed = datetime.datetime.now() - datetime.timedelta(minutes=10)
+            CaptureRequest.objects.filter(order=order).update(status='RUNNING', claimed=claimed)
+            counts = CaptureQueue(workers=1, timeout=15).run()
+            self.assertEqual(counts['captured'], 0)
+            self.assertEqual(capture_progress()['RUNNING'], 1)
+
+            counts = CaptureQueue(workers=1, timeout=5).run()
+            self.assertEqual(counts['captured'], 1)
+            self.assertEqual(order.authorized_remaining, Decimal('0'))
+            self.assertEqual(CaptureRequest.objects.get(order=order).status, 'DONE')
+        finally:
+            queued.update(False)
+
     def test_authorize_multiple(self):
         """Test making multiple authorization using DUMMY."""
         order = make_test_order(self.US, '')
@@ -326,3 +385,170 @@ class TestPaymentHandling(TestCase):
 
         self.assertEqual(order.pendingpayments.count(), 1)
         self.assertEqual(order.payments.count(), 1)
+
+class MockArbHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers ARB requests with a subscription id made from the request."""
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_POST(self):
+        request = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests += 1
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        if self.server.drops:
+            # the request was read, but the connection breaks before the answer
+            self.server.drops -= 1
+            self.close_connection = 1
+            return
+        if self.server.failures:
+            self.server.failures -= 1
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        subscription = re.search(r'<refId>(\d+)</refId>', request).group(1)
+        body = ('<?xml version="1.0" encoding="utf-8"?><ARBCreateSubscriptionResponse>'
+            '<messages><resultCode>Ok</resultCode><message><code>I00001</code><text>Successful.</text>'
+            '</message></messages><subscriptionId>sub-%s</subscriptionId></ARBCreateSubscriptionResponse>'
+            % subscription)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if self.server.hangups:
+            # the connection is kept alive, but closed once idle
+            self.server.hangups -= 1
+            self.close_connection = 1
+
+    def log_message(self, *args):
+        pass
+
+class MockGateway(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    connections = 0
+    requests = 0
+    failures = 0
+    drops = 0
+    hangups = 0
+    delay = 0
+
+    def handle_error(self, request, client_address):
+        # answers to clients which gave up
+        pass
+
+class TestArbSubmission(TestCase):
+
+    def setUp(self):
+        import payment.modules.authorizenet.config
+        self.server = MockGateway(('127.0.0.1', 0), MockArbHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%i/xml/v1/request.api' % self.server.server_address[1]
+
+    def tearDown(self):
+        sslurllib.get_pool(self.url).close()
+        self.server.shutdown()
+        self.server.server_close()
+        keyedcache.cache_delete()
+
+    def testPostRecurringRequests(self):
+        from payment.modules.authorizenet.processor import PaymentProcessor
+        settings = config_get_group('PAYMENT_AUTHORIZENET')
+        processor = PaymentProcessor(settings)
+        requests = ['<ARBCreateSubscriptionRequest><refId>%i</refId></ARBCreateSubscriptionRequest>' % i
+            for i in range(10)]
+
+        responses = processor.post_recurring_requests(self.url, requests)
+        self.assertEqual([response[0] for response in responses], [True] * 10)
+        self.assertEqual([response[3] for response in responses], ['sub-%i' % i for i in range(10)])
+        self.assertEqual(self.server.requests, 10)
+        # the connections are kept alive and shared
+        self.assert_(self.server.connections <= settings.ARB_CONNECTIONS.value)
+
+        responses = processor.post_recurring_requests(self.url, requests[:1])
+        self.assertEqual(responses, [(True, 'I00001', 'Successful.', 'sub-0')])
+        self.assert_(self.server.connections <= settings.ARB_CONNECTIONS.value)
+
+    def testDroppedConnection(self):
+        request = '<refId>1</refId>'
+        sslurllib.post(self.url, request)
+        self.assertEqual(self.server.requests, 1)
+
+        # a charge is not sent again on a new connection
+        self.server.drops = 1
+        self.assertRaises(urllib2.URLError, sslurllib.post, self.url, request)
+        self.assertEqual(self.server.requests, 2)
+
+        sslurllib.post(self.url, request)
+        self.assertEqual(self.server.requests, 3)
+
+        # an idempotent call is
+        self.server.drops = 1
+        body = sslurllib.post(self.url, request, idempotent=True)
+        self.assert_('sub-1' in body)
+        self.assertEqual(self.server.requests, 5)
+
+    def testIdleConnections(self):
+        request = '<refId>1</refId>'
+        self.server.hangups = 1
+        sslurllib.post(self.url, request)
+        time.sleep(0.2)
+
+        # a charge isn't sent on the connection the gateway closed
+        sslurllib.post(self.url, request)
+        self.assertEqual(self.server.requests, 2)
+        self.assertEqual(self.server.connections, 2)
+
+        sslurllib.post(self.url, request)
+        self.assertEqual(self.server.connections, 2)
+
+        # nor on one idle for too long
+        pool = sslurllib.get_pool(self.url)
+        keepalive = pool.keepalive
+        pool.keepalive = 0
+        try:
+            time.sleep(0.01)
+            sslurllib.post(self.url, request)
+        finally:
+            pool.keepalive = keepalive
+        self.assertEqual(self.server.requests, 4)
+        self.assertEqual(self.server.connections, 3)
+
+    def testTransportRetries(self):
+        from payment.transport import GatewayTransport
+        transport = GatewayTransport('TEST', timeout=5, retries=2, backoff=0)
+        calls, errors = transport.histogram.calls, transport.histogram.errors
+
+        # idempotent calls are sent again after a server error
+        self.server.failures = 1
+        body = transport.post(self.url, '<refId>1</refId>', idempotent=True)
+        self.assert_('sub-1' in body)
+        self.assertEqual(self.server.requests, 2)
+        self.assertEqual(transport.histogram.calls - calls, 2)
+        self.assertEqual(transport.histogram.errors - errors, 1)
+
+        # the others are not
+        self.server.failures = 1
+        self.assertRaises(urllib2.HTTPError, transport.post, self.url, '<refId>2</refId>')
+        self.assertEqual(self.server.requests, 3)
+
+        # nor on a dropped connection
+        self.server.drops = 1
+        self.assertRaises(urllib2.URLError, transport.post, self.url, '<refId>3</refId>')
+        self.assertEqual(self.server.requests, 4)
+
+    def testTransportTimeout(self):
+        from payment.transport import GatewayTransport
+        transport = GatewayTransport('TEST', timeout=1, retries=2, backoff=0)
+        transport.post(self.url, '<refId>1</refId>')
+
+        # a gateway which times out is not called again, even for a void
+        self.server.delay = 2
+        self.assertRaises(urllib2.URLError, transport.post, self.url, '<refId>2</refId>', idempotent=True)
+        self.assertEqual(self.server.requests, 2)
@@ -0,0 +1,160 @@
+"""
+The HTTP transport shared by the payment modules.
+
+Every payment module used to open a new connection, with a new SSL handshake,
+for each authorization, capture or void.  `GatewayTransport` posts to the
+gateways over the kept-alive connection pools of `satchmo_utils.sslurllib`,
+with the GATEWAY_TIMEOUT of the PAYMENT settings.  Calls which can safely be
+made twice, such as a void or a PayPal IPN verification, are retried
+GATEWAY_RETRIES times with an exponential backoff when the gateway can't be
+reached or answers with a server error, but not when it times out.  Other
+calls, such as charges and captures, are sent exactly once.
+
+The time taken by each call is counted in a `LatencyHistogram` per gateway,
+which `latency_histograms` returns for the current process.
+"""
+from livesettings import config_value_safe
+from satchmo_utils import sslurllib
+import StringIO
+import logging
+import threading
+import time
+import urllib2
+
+log = logging.getLogger('payment.transport')
+
+# upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class LatencyHistogram(object):
+    """Counts the calls to a gateway by how long they took."""
+
+    def __init__(self, name):
+        self.name = name
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds, error=False):
+        ix = 0
+        while ix < len(LATENCY_BUCKETS) and seconds > LATENCY_BUCKETS[ix]:
+            ix += 1
+        self._lock.acquire()
+        try:
+            self.counts[ix] += 1
+            self.calls += 1
+            self.total += seconds
+            if error:
+                self.errors += 1
+        finally:
+            self._lock.release()
+
+    def _mean(self):
+        if self.calls:
+            return self.total / self.calls
+        return 0.0
+    mean = property(_mean)
+
+    def buckets(self):
+        """Return (upper bound, count) pairs, the last bound is None."""
+        return zip(LATENCY_BUCKETS + (None,), self.counts)
+
+    def __unicode__(self):
+        parts = []
+        for bound, count in self.buckets():
+            if bound is None:
+                parts.append('>%gs: %i' % (LATENCY_BUCKETS[-1], count))
+            else:
+                parts.append('<=%gs: %i' % (bound, count))
+        return u"%s: %i calls, %i errors, mean %.3fs (%s)" % (self.name, self.calls,
+            self.errors, self.mean, ", ".join(parts))
+
+_HISTOGRAMS = {}
+_HISTOGRAMS_LOCK = threading.Lock()
+
+def get_histogram(name):
+    """Return the `LatencyHistogram` of gateway `name` in this process."""
+    _HISTOGRAMS_LOCK.acquire()
+    try:
+        histogram = _HISTOGRAMS.get(name, None)
+        if histogram is None:
+            histogram = LatencyHistogram(name)
+            _HISTOGRAMS[name] = histogram
+        return histogram
+    finally:
+        _HISTOGRAMS_LOCK.release()
+
+def latency_histograms():
+    """Return the `LatencyHistogram`s of the gateways called in this process."""
+    return [_HISTOGRAMS[name] for name in sorted(_HISTOGRAMS.keys())]
+
+class GatewayTransport(object):
+    """Posts requests to the gateway of a payment module."""
+
+    def __init__(self, name, timeout=None, retries=None, backoff=0.5, maxsize=None):
+        if timeout is None:
+            timeout = config_value_safe('PAYMENT', 'GATEWAY_TIMEOUT', 30)
+        if retries is None:
+            retries = config_value_safe('PAYMENT', 'GATEWAY_RETRIES', 2)
+        if maxsize is None:
+            maxsize = config_value_safe('PAYMENT', 'GATEWAY_CONNECTIONS', 4)
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.maxsize = maxsize
+        self.histogram = get_histogram(name)
+
+    def request(self, url, data, headers=None, idempotent=False):
+        """POST `data` to `url`, and return the status and the body of the
+        response.  Raises `urllib2.URLError` if the gateway can't be reached,
+        after retrying if the call is `idempotent`.  A call which isn't is
+        never sent twice."""
+        if headers is None:
+            headers = {'Content-type' : 'application/x-www-form-urlencoded'}
+        pool = sslurllib.get_pool(url, maxsize=self.maxsize, timeout=self.timeout)
+        path = sslurllib.request_path(url)
+
+        attempt = 0
+        while True:
+            start = time.time()
+            try:
+                response, body = pool.request('POST', path, data, headers, idempotent=idempotent)
+                error = response.status >= 500
+            except urllib2.URLError, ue:
+                response = None
+                error = True
+                # a timed out gateway may still be working on the first call
+                if not idempotent or attempt >= self.retries or sslurllib.is_timeout(ue):
+                    self.histogram.record(time.time() - start, error=True)
+                    raise
+            self.histogram.record(time.time() - start, error=error)
+
+            if not error or not idempotent or attempt >= self.retries:
+                return response.status, body
+
+            delay = self.backoff * (2 ** attempt)
+            attempt += 1
+            log.info('Call to %s failed, retry #%i in %.1fs', self.name, attempt, delay)
+            time.sleep(delay)
+
+    def post(self, url, data, headers=None, idempotent=False):
+        """POST `data` to `url`, and return the body of the response.  Raises
+        `urllib2.URLError`, or `urllib2.HTTPError` for an error status, as
+        `urllib2.urlopen` does."""
+        status, body = self.request(url, data, headers=headers, idempotent=idempotent)
+        if status >= 400:
+            raise urllib2.HTTPError(url, status, body[:200], {}, StringIO.StringIO(body))
+        return body
+
+_TRANSPORTS = {}
+
+def get_transport(name):
+    """Return the `GatewayTransport` of the payment module with key `name`."""
+    transport = _TRANSPORTS.get(name, None)
+    if transport is None:
+        transport = GatewayTransport(name)
+        _TRANSPORTS[name] = transport
+    return transport
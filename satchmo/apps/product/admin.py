@@ -120,7 +120,7 @@ class CategoryAdminForm(models.ModelForm):
             if parent.slug == slug:
                 raise ValidationError(_("You must not save a category in itself!"))
 
-            for p in parent._recurse_for_parents(parent):
+            for p in parent.parents():
                 if slug == p.slug:
                     raise ValidationError(_("You must not save a category in itself!"))
 
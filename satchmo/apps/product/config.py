@@ -60,6 +60,34 @@ config_register_list(
         default=True
     ),
     
+    BooleanValue(PRODUCT_GROUP,
+        'DEFERRED_PRICE_LOOKUP',
+        description=_("Defer pricing lookup updates?"),
+        help_text=_("If yes, changed products are queued and their pricing lookups are rebuilt by the satchmo_update_pricing command, instead of while saving."),
+        default=False
+    ),
+
+    BooleanValue(PRODUCT_GROUP,
+        'SEARCH_INDEX',
+        description=_("Use the search index?"),
+        help_text=_("If yes, the shop search looks keywords up in an index of the product and category text, ranked by relevance, instead of scanning the tables for every search."),
+        default=False
+    ),
+
+    BooleanValue(PRODUCT_GROUP,
+        'SEARCH_STEMMING',
+        description=_("Stem search words?"),
+        help_text=_("If yes, the search index strips common English suffixes, so that a search for 'shirts' also finds 'shirt'."),
+        default=False
+    ),
+
+    StringValue(PRODUCT_GROUP,
+        'SEARCH_PRICEBANDS',
+        description=_("Search price bands"),
+        help_text=_("Comma separated price bands to count the search results in, when the price band search listener is used, for example '0-25,25-100,100'."),
+        default=""
+    ),
+
     BooleanValue(PRODUCT_GROUP,
         'SHOW_NO_PHOTO_IN_CATEGORY',
         description=_("Display Photo Not Available Image in the category page?"),
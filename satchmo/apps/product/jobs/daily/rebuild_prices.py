@@ -1,8 +1,14 @@
 from django_extensions.management.jobs import DailyJob
-from product.models import ProductPriceLookup
+from livesettings import config_value
+from product.models import ProductPriceLookup, ProductPriceLookupQueue
 
 class Job(DailyJob):
     help = "Update the pricing lookup table."
 
     def execute(self):
-        ProductPriceLookup.objects.rebuild_all()
\ No newline at end of file
+        if config_value('PRODUCT', 'DEFERRED_PRICE_LOOKUP'):
+            # changes are already queued, only expiring prices need catching up
+            ProductPriceLookupQueue.objects.mark_expired()
+            ProductPriceLookupQueue.objects.process()
+        else:
+            ProductPriceLookup.objects.rebuild_all()
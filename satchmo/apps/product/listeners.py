@@ -1,7 +1,21 @@
+"""The listeners of the product app.
+
+`product.models` connects the listeners which keep its lookup tables and
+caches up to date when it is loaded, so the models are imported where they
+are used, and this module can be imported before them.
+"""
 from decimal import Decimal, InvalidOperation
 from django.contrib.sites.models import Site
 from django.db.models import Q
-from product.models import Product, Category, Discount
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from livesettings import config_value_safe
+from livesettings.signals import configuration_value_changed
+from product import active_product_types
+from product.prices import invalidate_price_cache
+from product.search import search_categories, search_index_changed, search_index_reset, search_products
+from product.tree import category_tree_changed
+from satchmo_utils.db import chunked
+import keyedcache
 import logging
 
 log = logging.getLogger('search listener')
@@ -11,10 +25,15 @@ def default_product_search_listener(sender, request=None, category=None, keyword
     However, it usually won't have to be overridden, since it just adds data to the results dict.  If you are simply
     adding more results, then leave this listener registered and add more objects in your search listener.
     """
+    from product.models import Category, Product
     log.debug('default product search listener')
     site = Site.objects.get_current()
     productkwargs = {}
     
+    if keywords and config_value_safe('PRODUCT', 'SEARCH_INDEX', False):
+        results.update(indexed_product_search(site, category, keywords))
+        return
+
     if keywords:
         products = Product.objects.active().filter(site=site)
         categories = Category.objects.active().filter(site=site)
@@ -47,48 +66,118 @@ def default_product_search_listener(sender, request=None, category=None, keyword
         'products': products
         })
 
+def indexed_product_search(site, category, keywords):
+    """The search of `default_product_search_listener`, answered from the
+    search index.  Returns lists of products and categories, best match first."""
+    from product.models import Category, Product
+    products = _load_ranked(Product, search_products(keywords, site=site))
+    products = [p for p in products if p.active]
+
+    if category:
+        categories = Category.objects.active().filter(slug=category)
+        if categories:
+            categories = categories[0].get_active_children(include_self=True)
+    else:
+        categories = _load_ranked(Category, search_categories(keywords, site=site))
+        categories = [c for c in categories if c.is_active]
+
+    return {
+        'categories': categories,
+        'products': products
+        }
+
+def _load_ranked(model, pks):
+    """Load the objects with `pks`, in that order, skipping any that are gone."""
+    pks = list(pks)
+    objects = {}
+    for chunk in chunked(pks, 500):
+        objects.update(model.objects.in_bulk(chunk))
+    return [objects[pk] for pk in pks if pk in objects]
+
+def parse_priceband(priceband):
+    """Parse a price band, "low-high" or "low" for low or higher, into a
+    (low, high) pair of Decimals, high being None for an open band.
+    Returns None if it can't be parsed."""
+    bands = priceband.split('-')
+    try:
+        low = Decimal(bands[0].strip())
+        if len(bands) > 1 and bands[1].strip():
+            high = Decimal(bands[1].strip())
+        else:
+            high = None
+    except (TypeError, ValueError, InvalidOperation):
+        return None
+    return (low, high)
+
 def priceband_search_listener(sender, request=None, category=None, keywords=[], results={}, **kwargs):
     """Filter search results by price bands.
     
     If a "priceband" parameter is available, it will be parsed as follows:
         lowval-highval
         if there is no "-", then it will be parsed as lowval or higher
+
+    Prices come from the `ProductPriceLookup` rows for a quantity of one, so
+    the products stay a lazy queryset.  A product is in the band of its
+    lowest price.  If the PRODUCT.SEARCH_PRICEBANDS
+    setting lists bands, the number of products in each of them is added to
+    the results as "pricebands", a list of dicts with "band", "low", "high"
+    and "count".
     """
+    from product.models import Product, ProductPriceLookup
     log.debug('priceband search listener')
     if request.method=="GET":
         data = request.GET
     else:
         data = request.POST
-    
+
+    products = results.get('products', None)
+    if products is None:
+        return
+
+    facets = config_value_safe('PRODUCT', 'SEARCH_PRICEBANDS', '')
+    if facets:
+        bands = []
+        for band in facets.split(','):
+            parsed = parse_priceband(band)
+            if parsed is None:
+                log.warn("Couldn't parse PRODUCT.SEARCH_PRICEBANDS band %s", band)
+            else:
+                bands.append((band.strip(), parsed))
+        counts = ProductPriceLookup.objects.price_band_counts([parsed for band, parsed in bands],
+            products=products)
+        results['pricebands'] = [{'band': band, 'low': low, 'high': high, 'count': count}
+            for (band, parsed), (low, high, count) in zip(bands, counts)]
+
     priceband = data.get('priceband', None)
     
     if not priceband:
         return
-        
-    bands = priceband.split('-')
-    try:
-        if len(bands) > 1:
-            low = int(bands[0])
-            high = int(bands[1])
-        else:
-            low = bands[0]
-            high = Decimal('1000000000.00')
-    except (TypeError, InvalidOperation):
+
+    parsed = parse_priceband(priceband)
+    if parsed is None:
         log.warn("Couldn't parse priceband=%s", priceband)
         return
-    
-    priced = []
-    products = results['products']
-    products = products.filter(productvariation__parent__isnull=True)
-    log.debug('priceband pre-filter length=%i', len(products))
-    for p in products:
-        price = p.unit_price
-        if price>low and price<=high:
-            priced.append(p)
-    log.debug('priceband post-filter length=%i', len(priced))
+    low, high = parsed
+
+    lookups = ProductPriceLookup.objects.in_price_band(low, high)
+    if hasattr(products, 'filter'):
+        priced = products.filter(slug__in=lookups.values('productslug'))
+    else:
+        # ranked results from the search index
+        slugs = set()
+        for chunk in chunked([p.slug for p in products], 500):
+            slugs.update(lookups.filter(productslug__in=chunk).values_list('productslug', flat=True))
+        priced = [p for p in products if p.slug in slugs]
     
     categories = results['categories']
-    categories = categories.filter(product__in = priced)
+    if hasattr(categories, 'filter'):
+        categories = categories.filter(product__in = priced)
+    else:
+        pricedids = set([p.pk for p in priced])
+        through = Product._meta.get_field('category').rel.through
+        members = through.objects.filter(category__in=[c.pk for c in categories]).values_list('category', 'product')
+        keep = set([cat for cat, product in members if product in pricedids])
+        categories = [c for c in categories if c.pk in keep]
     results['products'] = priced
     results['categories'] = categories
 
@@ -97,6 +186,7 @@ def discount_used_listener(sender, order=None, **kwargs):
     
     satchmo_store.shop.signals.order_success listener set up in shop.listeners.
     """
+    from product.models import Discount
     if order.discount_code:
         try:
             discount = Discount.objects.by_code(order.discount_code)
@@ -107,3 +197,145 @@ def discount_used_listener(sender, order=None, **kwargs):
             discount.save()
         except Discount.DoesNotExist:
             pass
+
+def sales_rank_listener(sender, order=None, **kwargs):
+    """Adds the items of an order to the sales ranking of the bestsellers.
+
+    satchmo_store.shop.signals.order_success listener set up in shop.listeners.
+    """
+    from product.models import ProductSales
+    items = order.orderitem_set.values_list('product', 'quantity')
+    day = None
+    if order.time_stamp:
+        day = order.time_stamp.date()
+    ProductSales.objects.record(list(items), day=day)
+
+def price_lookup_listener(sender, instance=None, **kwargs):
+    """Marks the pricing lookup rows of a changed product as out of date.
+
+    Connected to post_save and post_delete for `Product`, `Price` and any
+    other model that has a `product` and feeds into the product's price.
+    Raw saves from fixture loading are ignored, as `Product.save` used to be.
+    Memoized prices for the product are dropped as well.
+    """
+    from product.models import Product, ProductPriceLookup
+    if isinstance(instance, Product):
+        pk = instance.pk
+    else:
+        pk = instance.product_id
+    invalidate_price_cache(pk)
+
+    if kwargs.get('raw', False):
+        return
+    ProductPriceLookup.objects.mark_dirty([pk])
+
+def price_lookup_delete_listener(sender, instance=None, **kwargs):
+    """Removes the pricing lookup rows of a deleted product."""
+    from product.models import ProductPriceLookup
+    ProductPriceLookup.objects.delete_for_product(instance)
+
+def search_index_listener(sender, instance=None, **kwargs):
+    """Updates the search index for a changed product or category.
+
+    Connected to post_save and post_delete for `Product`, `Category` and
+    their translations.  Raw saves from fixture loading are only recorded,
+    the index is brought up to date before the next search.  Nothing is
+    done while the PRODUCT.SEARCH_INDEX setting is off.
+    """
+    if not config_value_safe('PRODUCT', 'SEARCH_INDEX', False):
+        return
+    from product.models import Category, Product, ProductTranslation
+    if isinstance(instance, Product):
+        kind, pk = 'product', instance.pk
+    elif isinstance(instance, ProductTranslation):
+        kind, pk = 'product', instance.product_id
+    elif isinstance(instance, Category):
+        kind, pk = 'category', instance.pk
+    else:
+        kind, pk = 'category', instance.category_id
+    search_index_changed(kind, pk, update=not kwargs.get('raw', False))
+
+def search_settings_listener(sender, setting=None, **kwargs):
+    """Rebuilds the search indexes when the PRODUCT.SEARCH_INDEX setting is
+    switched, since `search_index_listener` doesn't record changes while it
+    is off."""
+    if setting is None:
+        setting = sender
+    if setting.group.key == 'PRODUCT' and setting.key == 'SEARCH_INDEX':
+        search_index_reset()
+
+def featured_listener(sender, instance=None, **kwargs):
+    """Forgets the cached featured products of the site of a changed product."""
+    from product.queries import featured_changed
+    featured_changed(instance.site_id)
+
+def category_tree_listener(sender, action=None, **kwargs):
+    """Reloads the category trees after a category or a product changed.
+
+    Connected to post_save and post_delete for `Category`, post_delete for
+    `Product`, and to m2m_changed for the categories of a product.
+    """
+    if action is None or action.startswith('post_'):
+        category_tree_changed()
+
+def product_tree_listener(sender, instance=None, created=False, **kwargs):
+    """Reloads the category trees after a product was activated, deactivated
+    or moved to another site.
+
+    Connected to post_save for `Product`.  The categories of a product are
+    covered by m2m_changed, so the other saves, such as the stock update of
+    every sale, leave the trees alone.
+    """
+    state = (instance.active, instance.site_id)
+    if not created and getattr(instance, '_tree_state', None) != state:
+        category_tree_changed()
+    instance._tree_state = state
+
+_SUBTYPE_NAMES = None
+
+def _subtype_names():
+    """The class names of the active product subtypes, as `Product.get_subtypes`
+    looks them up."""
+    global _SUBTYPE_NAMES
+    if _SUBTYPE_NAMES is None:
+        _SUBTYPE_NAMES = frozenset([subtype for module, subtype in active_product_types()])
+    return _SUBTYPE_NAMES
+
+def subtype_listener(sender, instance=None, **kwargs):
+    """Forgets the cached subtype names of a product when one of its subtypes
+    is saved or deleted.
+
+    Connected to post_save and post_delete of every model, since the subtype
+    models live in the product modules; a subtype is recognized by its class
+    name among the `active_product_types`, and shares its primary key with
+    the product.
+    """
+    if sender.__name__ in _subtype_names() and instance.pk:
+        from product.models import SUBTYPES_CACHE_KEY
+        keyedcache.cache_delete(SUBTYPES_CACHE_KEY, instance.pk)
+
+def start_default_listening():
+    """Add the listeners which keep the pricing lookup table, the search
+    index, the category trees, the featured products and the cached subtypes
+    up to date."""
+    from product.models import Category, CategoryTranslation, Price, Product, ProductTranslation
+    post_save.connect(price_lookup_listener, sender=Product)
+    post_delete.connect(price_lookup_delete_listener, sender=Product)
+    post_save.connect(featured_listener, sender=Product)
+    post_delete.connect(featured_listener, sender=Product)
+    post_save.connect(price_lookup_listener, sender=Price)
+    post_delete.connect(price_lookup_listener, sender=Price)
+
+    for model in (Product, ProductTranslation, Category, CategoryTranslation):
+        post_save.connect(search_index_listener, sender=model)
+        post_delete.connect(search_index_listener, sender=model)
+    configuration_value_changed.connect(search_settings_listener)
+
+    post_save.connect(category_tree_listener, sender=Category)
+    post_delete.connect(category_tree_listener, sender=Category)
+    post_save.connect(product_tree_listener, sender=Product)
+    post_delete.connect(category_tree_listener, sender=Product)
+    m2m_changed.connect(category_tree_listener, sender=Product.category.through)
+
+    post_save.connect(subtype_listener)
+    post_delete.connect(subtype_listener)
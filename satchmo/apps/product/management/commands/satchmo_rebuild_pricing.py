@@ -1,19 +1,31 @@
 from django.contrib.sites.models import Site
 from django.core.management.base import BaseCommand
-from product.models import Product, ProductPriceLookup
+from optparse import make_option
+from product.utils import PriceLookupBuilder
+from satchmo_utils.db import DEFAULT_CHUNK_SIZE
 
 class Command(BaseCommand):
     help = "Builds Satcho Product pricing lookup tables."
     args = ['sitename...']
 
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=500,
+            help='Number of products to preload per batch of queries.'),
+        make_option('--chunk-size', dest='chunk_size', type='int', default=DEFAULT_CHUNK_SIZE,
+            help='Number of lookup rows written per INSERT statement.'),
+    )
+
     requires_model_validation = True
 
     def handle(self, *sitenames, **options):
         verbosity = int(options.get('verbosity', 1))
+        batch_size = options.get('batch_size') or 500
+        chunk_size = options.get('chunk_size') or DEFAULT_CHUNK_SIZE
+
         if len(sitenames) == 0:
             if verbosity>0:
                 print "Rebuilding pricing for all products for all sites"
-                sites = Site.objects.all()
+            sites = Site.objects.all()
         else:
             sites = []
             for sitename in sitenames:
@@ -24,35 +36,17 @@ class Command(BaseCommand):
 
         total = 0
         for site in sites:
-            ct = 0
             if verbosity > 0:
                 print "Starting product pricing for %s" % site.domain
 
-            if verbosity > 1:
-                print "Deleting old pricing"
-
-            for lookup in ProductPriceLookup.objects.filter(siteid=site.id):
-                lookup.delete()
+            builder = PriceLookupBuilder(site=site, batch_size=batch_size, chunk_size=chunk_size)
+            builder.rebuild()
 
-            products = Product.objects.active_by_site(site=site, variations=False)
             if verbosity > 0:
-                print "Adding %i products" % products.count()
-
-            for product in products:
-                if verbosity > 1:
-                    print "Processing product: %s" % product.slug
-
-                prices = ProductPriceLookup.objects.smart_create_for_product(product)
-                if verbosity > 1:
-                    print "Created %i prices" % len(prices)
+                print "Added %i total prices for %i products in %.2fs (%.1f products/s)" % (
+                    builder.pricect, builder.productct, builder.elapsed, builder.rate)
 
-                ct += len(prices)
-
-            if verbosity > 0:
-                print "Added %i total prices for site" % ct
-
-            total += ct
+            total += builder.pricect
 
         if verbosity > 0:
             print "Added %i total prices" % total
-
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from optparse import make_option
+from product.models import ProductSales
+from satchmo_utils.db import DEFAULT_CHUNK_SIZE
+import time
+
+class Command(BaseCommand):
+    help = "Rebuilds the bestseller sales ranking from the items of all placed orders."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk-size', dest='chunk_size', type='int', default=DEFAULT_CHUNK_SIZE,
+            help='Number of sales rows written per INSERT statement.'),
+    )
+
+    requires_model_validation = True
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get('verbosity', 1))
+        chunk_size = options.get('chunk_size') or DEFAULT_CHUNK_SIZE
+        start = time.time()
+        ct = ProductSales.objects.rebuild(chunk_size=chunk_size)
+
+        if verbosity > 0:
+            print "Ranked %i products in %.2fs" % (ct, time.time() - start)
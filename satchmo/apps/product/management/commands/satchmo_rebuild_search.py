@@ -0,0 +1,20 @@
+from django.core.management.base import NoArgsCommand
+from product.search import rebuild_search_index
+from satchmo_store.shop import get_satchmo_setting
+import time
+
+class Command(NoArgsCommand):
+    help = ("Rebuilds the product search index, and saves it to the SEARCH_INDEX_FILE "
+            "in SATCHMO_SETTINGS if there is one.")
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        start = time.time()
+        index = rebuild_search_index()
+
+        if verbosity > 0:
+            print "Indexed %i products and %i categories in %.2fs" % (
+                len(index.products), len(index.categories), time.time() - start)
+            path = get_satchmo_setting('SEARCH_INDEX_FILE')
+            if path:
+                print "Saved the index to %s" % path
@@ -0,0 +1,46 @@
+from django.core.management.base import NoArgsCommand
+from optparse import make_option
+from product.models import ProductPriceLookupQueue
+from satchmo_utils.db import DEFAULT_CHUNK_SIZE
+import time
+
+class Command(NoArgsCommand):
+    help = ("Rebuilds the pricing lookups of products queued by the pricing listeners. "
+            "Used with the PRODUCT.DEFERRED_PRICE_LOOKUP setting, either from cron "
+            "or as a long running worker with --interval.")
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=500,
+            help='Number of queued products to refresh per batch.'),
+        make_option('--chunk-size', dest='chunk_size', type='int', default=DEFAULT_CHUNK_SIZE,
+            help='Number of lookup rows written per INSERT statement.'),
+        make_option('--limit', dest='limit', type='int', default=None,
+            help='Stop after processing about this many queue entries.'),
+        make_option('--expired', dest='expired', type='int', default=0,
+            help='First queue products with prices that expired in the last N days.'),
+        make_option('--interval', dest='interval', type='int', default=0,
+            help='Keep running, checking the queue every N seconds.'),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        interval = options.get('interval') or 0
+        expired = options.get('expired') or 0
+
+        if expired:
+            ct = ProductPriceLookupQueue.objects.mark_expired(days=expired)
+            if verbosity > 0:
+                print "Queued %i products with expired prices" % ct
+
+        while True:
+            builder = ProductPriceLookupQueue.objects.process(limit=options.get('limit'),
+                batch_size=options.get('batch_size') or 500,
+                chunk_size=options.get('chunk_size') or DEFAULT_CHUNK_SIZE)
+
+            if verbosity > 0 and (builder.productct or not interval):
+                print "Refreshed %i prices for %i products in %.2fs" % (
+                    builder.pricect, builder.productct, builder.elapsed)
+
+            if not interval:
+                break
+            time.sleep(interval)
@@ -0,0 +1,15 @@
+from product.prices import start_price_cache, stop_price_cache
+
+class PriceCacheMiddleware(object):
+    """Memoize product prices for the duration of each request."""
+    def process_request(self, request):
+        # never carry prices over from an earlier request on this thread
+        stop_price_cache(force=True)
+        start_price_cache()
+
+    def process_response(self, request, response):
+        stop_price_cache(force=True)
+        return response
+
+    def process_exception(self, request, exception):
+        stop_price_cache(force=True)
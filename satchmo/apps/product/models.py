@@ -9,8 +9,8 @@ from django.conf import settings
 from django.contrib.sites.models import Site
 from django.core import urlresolvers
 from django.core.cache import cache
-from django.db import models
-from django.db.models import Q
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Q, Sum
 from django.utils.encoding import smart_str
 from django.utils.translation import get_language, ugettext, ugettext_lazy as _
 from l10n.utils import moneyfmt, lookup_translation
@@ -18,7 +18,9 @@ from livesettings import config_value, SettingNotSet, config_value_safe
 from prices import get_product_quantity_price, get_product_quantity_adjustments
 from product import active_product_types
 from product.prices import PriceAdjustmentCalc
+from product.tree import get_category_tree
 from satchmo_utils import get_flat_list
+from satchmo_utils.db import bulk_insert, chunked, DEFAULT_CHUNK_SIZE
 from satchmo_utils.fields import CurrencyField
 from satchmo_utils.thumbnail.field import ImageWithThumbnailField
 from satchmo_utils.unique_id import slugify
@@ -48,6 +50,9 @@ SHIP_CLASS_CHOICES = (
     ('NO', _('Not Shippable'))
 )
 
+# keyedcache key of the subtype names of a product, see `Product.get_subtypes`
+SUBTYPES_CACHE_KEY = 'product-subtypes'
+
 def default_dimension_unit():
     val = config_value_safe('PRODUCT','MEASUREMENT_SYSTEM', (None, None))[0]
     if val == 'metric':
@@ -189,16 +194,31 @@ class Category(models.Model):
             p_list.reverse()
         return p_list
 
+    def _parent_path(self):
+        """Return the site's `CategoryTree` and the ids from the root down to
+        the parent, or None and None when the tree doesn't know the parent."""
+        if not (self.parent_id and self.site_id):
+            return None, None
+        tree = get_category_tree(self.site_id)
+        return tree, tree.path(self.parent_id)
+
     def parents(self):
-        return self._recurse_for_parents(self)
+        if not self.parent_id:
+            return []
+        tree, path = self._parent_path()
+        if path is None:
+            return self._recurse_for_parents(self)
+        return tree.categories(path)
 
     def get_absolute_url(self):
-        parents = self._recurse_for_parents(self)
-        slug_list = [cat.slug for cat in parents]
-        if slug_list:
-            slug_list = "/".join(slug_list) + "/"
-        else:
-            slug_list = ""
+        slug_list = ""
+        if self.parent_id:
+            tree, path = self._parent_path()
+            if path is None:
+                slug_list = "/".join([cat.slug for cat in self._recurse_for_parents(self)])
+            else:
+                slug_list = tree.slug_path(self.parent_id)
+            slug_list += "/"
         return urlresolvers.reverse('satchmo_category',
             kwargs={'parent_slugs' : slug_list, 'slug' : self.slug})
 
@@ -206,7 +226,7 @@ class Category(models.Model):
         return ' :: '
 
     def _parents_repr(self):
-        name_list = [cat.name for cat in self._recurse_for_parents(self)]
+        name_list = [cat.name for cat in self.parents()]
         return self.get_separator().join(name_list)
     _parents_repr.short_description = "Category parents"
 
@@ -214,7 +234,7 @@ class Category(models.Model):
         # Get all the absolute URLs and names for use in the site navigation.
         name_list = []
         url_list = []
-        for cat in self._recurse_for_parents(self):
+        for cat in self.parents():
             name_list.append(cat.translated_name())
             url_list.append(cat.get_absolute_url())
         name_list.append(self.translated_name())
@@ -222,7 +242,7 @@ class Category(models.Model):
         return zip(name_list, url_list)
 
     def __unicode__(self):
-        name_list = [cat.name for cat in self._recurse_for_parents(self)]
+        name_list = [cat.name for cat in self.parents()]
         name_list.append(self.name)
         return self.get_separator().join(name_list)
 
@@ -231,9 +251,11 @@ class Category(models.Model):
             if self.parent and self.parent_id == self.id:
                 raise forms.ValidationError(_("You must not save a category in itself!"))
 
-            for p in self._recurse_for_parents(self):
-                if self.id == p.id:
-                    raise forms.ValidationError(_("You must not save a category in itself!"))
+            tree, path = self._parent_path()
+            if path is None:
+                path = [p.id for p in self._recurse_for_parents(self)]
+            if self.id in path:
+                raise forms.ValidationError(_("You must not save a category in itself!"))
 
         if not self.slug:
             self.slug = slugify(self.name, instance=self)
@@ -269,12 +291,23 @@ class Category(models.Model):
         """
         Gets a list of all of the children categories.
         """
-        children_list = self._recurse_for_children(self, only_active=only_active)
+        ids = None
+        if self.id and self.site_id:
+            tree = get_category_tree(self.site_id)
+            ids = tree.descendants(self.id, only_active=only_active)
+
+        if ids is None:
+            children_list = self._recurse_for_children(self, only_active=only_active)
+            if include_self:
+                ix = 0
+            else:
+                ix = 1
+            flat_list = self._flatten(children_list[ix:])
+            return flat_list
+
+        flat_list = tree.categories(ids)
         if include_self:
-            ix = 0
-        else:
-            ix = 1
-        flat_list = self._flatten(children_list[ix:])
+            flat_list.insert(0, self)
         return flat_list
 
     class Meta:
@@ -505,9 +538,15 @@ class Discount(models.Model):
         return (success['valid'], success['message'])
 
     def _valid_products_in_categories(self):
+        by_site = {}
+        for cat in self.valid_categories.all():
+            ids = by_site.setdefault(cat.site_id, set())
+            ids.update([child.id for child in cat.get_all_children(include_self=True)])
+
         slugs = set()
-        for cat in Category.objects.filter(id__in=self.valid_categories.values_list('id', flat=True)):
-            slugs.update([p.slug for p in cat.active_products(variations=True, include_children=True)])
+        for site_id, ids in by_site.items():
+            slugs.update(Product.objects.filter(site__id=site_id, active=True,
+                category__in=ids).values_list('slug', flat=True))
         return slugs
 
     def _valid_products(self, item_query):
@@ -856,6 +895,12 @@ class Product(models.Model):
 
     objects = ProductManager()
 
+    def __init__(self, *args, **kwargs):
+        super(Product, self).__init__(*args, **kwargs)
+        # what the category trees depend on, see `product_tree_listener`;
+        # read from __dict__ so deferred fields aren't loaded
+        self._tree_state = (self.__dict__.get('active'), self.__dict__.get('site_id'))
+
     def _get_mainCategory(self):
         """Return the first category for the product"""
 
@@ -1013,13 +1058,23 @@ class Product(models.Model):
         if not self.sku:
             self.sku = self.slug
         super(Product, self).save(**kwargs)
-        ProductPriceLookup.objects.smart_create_for_product(self)
 
     def get_subtypes(self):
         # If we've already computed it once, let's not do it again.
         # This is a performance speedup.
         if hasattr(self,"_sub_types"):
             return self._sub_types
+
+        # The names are also kept in the cache, until a subtype of the
+        # product is saved or deleted, see `listeners.subtype_listener`.
+        key = None
+        if self.id:
+            try:
+                self._sub_types = keyedcache.cache_get(SUBTYPES_CACHE_KEY, self.id)
+                return self._sub_types
+            except keyedcache.NotCachedError, nce:
+                key = nce.key
+
         types = []
         try:
             for module, subtype in active_product_types():
@@ -1033,8 +1088,11 @@ class Product(models.Model):
                     pass
         except SettingNotSet:
             log.warn("Error getting subtypes, OK if in SyncDB")
+            key = None
 
         self._sub_types = tuple(types)
+        if key:
+            keyedcache.cache_set(key, value=self._sub_types)
         return self._sub_types
 
     get_subtypes.short_description = _("Product Subtypes")
@@ -1264,23 +1322,81 @@ class ProductPriceLookupManager(models.Manager):
             objs.append(obj)
         return objs
 
-    def delete_for_product(self, product):
-        for obj in self.filter(productslug=product.slug, siteid=product.site.id):
-            obj.delete()
+    def in_price_band(self, low=None, high=None, site=None, quantity=1):
+        """Return the lookup rows for `quantity` of the products of `site`,
+        not their variations, whose price is above `low` and up to `high`.
+        Either bound can be None.
 
-    def rebuild_all(self, site=None):
+        The price of a product is its lowest row, the one it sells at, so a
+        product with a sale price is only in the band of its sale price, not
+        in the band of its regular price too.
+
+        The prices are the ones the lookups were built with, the final prices
+        after the adjustments made by `satchmo_price_query` listeners at that
+        time.  Adjustments which changed since, such as a sale which ended,
+        only show once the lookups are rebuilt.
+        """
         if not site:
             site = Site.objects.get_current()
+        lookups = self.filter(siteid=site.id, quantity=quantity, parentid__isnull=True)
+        banded = lookups
+        if low is not None:
+            banded = banded.exclude(productslug__in=lookups.filter(price__lte=low).values('productslug'))
+        if high is not None:
+            banded = banded.filter(price__lte=high)
+        return banded
+
+    def price_band_counts(self, bands, products=None, site=None):
+        """Count the products in each of `bands`, a list of (low, high) pairs as
+        taken by `in_price_band`.  Returns a list of (low, high, count).
+
+        A product is counted once, in the band of its lowest price.
+        `products` limits the count to a `Product` queryset or list.
+        """
+        if products is None or hasattr(products, 'filter'):
+            counts = []
+            for low, high in bands:
+                lookups = self.in_price_band(low, high, site=site)
+                if products is not None:
+                    lookups = lookups.filter(productslug__in=products.values('slug'))
+                counts.append((low, high, lookups.order_by().values('productslug').distinct().count()))
+            return counts
+
+        prices = {}
+        for chunk in chunked([p.slug for p in products], 500):
+            for slug, price in self.in_price_band(site=site).filter(productslug__in=chunk).values_list(
+                'productslug', 'price'):
+                if slug not in prices or price < prices[slug]:
+                    prices[slug] = price
+        return [(low, high, len([price for price in prices.values()
+            if (low is None or price > low) and (high is None or price <= high)]))
+            for low, high in bands]
+
+    def delete_for_product(self, product):
+        for obj in self.filter(productslug=product.slug, siteid=product.site_id):
+            obj.delete()
+
+    def mark_dirty(self, pks):
+        """Note that the lookup rows for the products with ids in `pks` are out of date.
 
-        for lookup in self.filter(siteid=site.id):
-            lookup.delete()
+        If PRODUCT.DEFERRED_PRICE_LOOKUP is set, the products are queued for the
+        `satchmo_update_pricing` worker, otherwise their rows are rebuilt right away.
+        """
+        if config_value_safe('PRODUCT', 'DEFERRED_PRICE_LOOKUP', False):
+            ProductPriceLookupQueue.objects.mark(pks)
+        else:
+            from product.utils import PriceLookupBuilder
+            PriceLookupBuilder().refresh(pks)
+
+    def rebuild_all(self, site=None, **kwargs):
+        """Rebuild all pricing for the site, using the bulk `PriceLookupBuilder`.
+        Extra keyword arguments (`batch_size`, `chunk_size`) are passed to the builder."""
+        from product.utils import PriceLookupBuilder
 
-        ct = 0
         log.debug('ProductPriceLookup rebuilding all pricing')
-        for p in Product.objects.active_by_site(site=site, variations=False):
-            prices = self.smart_create_for_product(p)
-            ct += len(prices)
-        log.info('ProductPriceLookup built %i prices', ct)
+        builder = PriceLookupBuilder(site=site, **kwargs)
+        builder.rebuild()
+        return builder.pricect
 
     def smart_create_for_product(self, product):
         subtypes = product.get_subtypes()
@@ -1299,8 +1415,8 @@ class ProductPriceLookup(models.Model):
     siteid = models.IntegerField()
     key = models.CharField(max_length=60, null=True)
     parentid = models.IntegerField(null=True)
-    productslug = models.CharField(max_length=255)
-    price = models.DecimalField(max_digits=14, decimal_places=6)
+    productslug = models.CharField(max_length=255, db_index=True)
+    price = models.DecimalField(max_digits=14, decimal_places=6, db_index=True)
     quantity = models.DecimalField(max_digits=18, decimal_places=6)
     active = models.BooleanField()
     discountable = models.BooleanField()
@@ -1323,6 +1439,174 @@ class ProductPriceLookup(models.Model):
 
     dynamic_price = property(fget=_dynamic_price)
 
+class ProductPriceLookupQueueManager(models.Manager):
+
+    def mark(self, pks):
+        """Queue the products with ids in `pks` for a pricing lookup refresh."""
+        for pk in set(pks):
+            self.create(productid=pk)
+
+    def mark_expired(self, days=1):
+        """Queue the products which have a price that expired in the last `days` days.
+        Returns the number of products queued."""
+        today = datetime.date.today()
+        pks = Price.objects.filter(expires__lt=today,
+            expires__gte=today - datetime.timedelta(days=days)).values_list('product', flat=True)
+        pks = set(pks)
+        self.mark(pks)
+        return len(pks)
+
+    def process(self, limit=None, **kwargs):
+        """Refresh the lookup rows of the queued products, oldest first, in
+        batches of `batch_size`, stopping after about `limit` queue entries.
+
+        Returns the `PriceLookupBuilder` used, for its statistics.
+        """
+        from product.utils import PriceLookupBuilder
+        builder = PriceLookupBuilder(**kwargs)
+        done = 0
+        while limit is None or done < limit:
+            entries = list(self.order_by('id').values_list('id', 'productid')[:builder.batch_size])
+            if not entries:
+                break
+            builder.refresh(set([pk for entryid, pk in entries]))
+            # entries queued while we were working have higher ids and stay queued
+            self.filter(id__lte=entries[-1][0]).delete()
+            done += len(entries)
+
+        return builder
+
+class ProductPriceLookupQueue(models.Model):
+    """
+    A product whose `ProductPriceLookup` rows are out of date.  Filled by the
+    pricing listeners when PRODUCT.DEFERRED_PRICE_LOOKUP is set, and emptied by
+    `satchmo_update_pricing`.  A product may be queued more than once.
+    """
+    productid = models.IntegerField()
+    marked = models.DateTimeField(auto_now_add=True)
+
+    objects = ProductPriceLookupQueueManager()
+
+def _add_sales(model, pk, ct, qty, **lookup):
+    """Add `ct` items and `qty` to the row of product `pk` in `model`, which
+    is created on the first sale.  Another order may create the row at the
+    same time, the insert is then rolled back to a savepoint and the row
+    which won is updated instead."""
+    rows = model.objects.filter(product__id=pk, **lookup)
+    if rows.update(items=F('items') + ct, quantity=F('quantity') + qty):
+        return
+    sid = transaction.savepoint()
+    try:
+        model.objects.create(product_id=pk, items=ct, quantity=qty, **lookup)
+        transaction.savepoint_commit(sid)
+    except IntegrityError:
+        transaction.savepoint_rollback(sid)
+        rows.update(items=F('items') + ct, quantity=F('quantity') + qty)
+
+class ProductSalesManager(models.Manager):
+
+    def record(self, items, day=None):
+        """Add sales to the daily and the all time totals.
+
+        `items` is a list of (product id, quantity) pairs, one for each
+        order item sold, and `day` defaults to today.
+        """
+        if day is None:
+            day = datetime.date.today()
+
+        totals = {}
+        for pk, quantity in items:
+            ct, qty = totals.get(pk, (0, Decimal("0")))
+            totals[pk] = (ct + 1, qty + quantity)
+
+        for pk, (ct, qty) in totals.items():
+            _add_sales(ProductSales, pk, ct, qty, day=day)
+            _add_sales(ProductSalesRank, pk, ct, qty)
+
+    def _rebuild(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Rebuild the daily and the all time totals from the items of all
+        orders which were placed, in bulk.  Returns the number of products
+        which sold."""
+        from satchmo_store.shop.models import OrderItem
+
+        daily = {}
+        totals = {}
+        rows = OrderItem.objects.exclude(order__status='').values_list(
+            'product', 'order__time_stamp', 'quantity')
+        for pk, stamp, quantity in rows.iterator():
+            if stamp is None:
+                continue
+            key = (pk, stamp.date())
+            ct, qty = daily.get(key, (0, Decimal("0")))
+            daily[key] = (ct + 1, qty + quantity)
+            ct, qty = totals.get(pk, (0, Decimal("0")))
+            totals[pk] = (ct + 1, qty + quantity)
+
+        self.all().delete()
+        ProductSalesRank.objects.all().delete()
+        bulk_insert(ProductSales, ('product', 'day', 'items', 'quantity'),
+            [(pk, day, ct, qty) for (pk, day), (ct, qty) in daily.iteritems()], chunk_size=chunk_size)
+        bulk_insert(ProductSalesRank, ('product', 'items', 'quantity'),
+            [(pk, ct, qty) for pk, (ct, qty) in totals.iteritems()], chunk_size=chunk_size)
+        return len(totals)
+
+    rebuild = transaction.commit_on_success(_rebuild)
+
+    def top(self, count, site=None, days=None, category=None):
+        """Return the ids of the `count` active products of `site` which sold
+        in the most orders, best first.
+
+        With `days`, only the sales of the last `days` days, today included,
+        are counted.  With `category`, only the products in it and in its
+        child categories are ranked.
+        """
+        if not site:
+            site = Site.objects.get_current()
+
+        if days:
+            since = datetime.date.today() - datetime.timedelta(days=days-1)
+            qs = self.filter(day__gte=since)
+        else:
+            qs = ProductSalesRank.objects.all()
+
+        qs = qs.filter(product__site=site, product__active=True)
+        if category:
+            cats = [cat.id for cat in category.get_all_children(include_self=True)]
+            qs = qs.filter(product__in=Product.objects.filter(category__in=cats).values('pk'))
+
+        if days:
+            qs = qs.values('product').annotate(total=Sum('items')).order_by('-total', 'product')
+            return [row['product'] for row in qs[:count]]
+        else:
+            qs = qs.filter(items__gt=0).order_by('-items', 'product')
+            return list(qs.values_list('product', flat=True)[:count])
+
+class ProductSales(models.Model):
+    """
+    The number of order items and the quantity of a product sold on a day.
+    Kept up to date by `sales_rank_listener` on `order_success`, and rebuilt
+    from the orders by `satchmo_rebuild_sales`.  Used to rank the
+    bestsellers of the last few days.
+    """
+    product = models.ForeignKey(Product)
+    day = models.DateField(db_index=True)
+    items = models.IntegerField(default=0)
+    quantity = models.DecimalField(max_digits=18, decimal_places=6, default=Decimal("0"))
+
+    objects = ProductSalesManager()
+
+    class Meta:
+        unique_together = ('product', 'day')
+
+class ProductSalesRank(models.Model):
+    """
+    The all time totals of `ProductSales` for a product, so that the
+    bestsellers are a single indexed read.
+    """
+    product = models.ForeignKey(Product, unique=True)
+    items = models.IntegerField(default=0, db_index=True)
+    quantity = models.DecimalField(max_digits=18, decimal_places=6, default=Decimal("0"))
+
 # Support the user's setting of custom expressions in the settings.py file
 try:
     user_validations = settings.SATCHMO_SETTINGS.get('ATTRIBUTE_VALIDATIONS')
@@ -1467,7 +1751,6 @@ class Price(models.Model):
             return #Duplicate Price
 
         super(Price, self).save(**kwargs)
-        ProductPriceLookup.objects.smart_create_for_product(self.product)
 
     class Meta:
         ordering = ['expires', '-quantity']
@@ -1567,3 +1850,6 @@ def split_option_unique_id(uid):
 
     parts = uid.split('-')
     return (parts[0], '-'.join(parts[1:]))
+
+import listeners
+listeners.start_default_listening()
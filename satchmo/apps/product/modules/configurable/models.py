@@ -1,8 +1,10 @@
 from decimal import Decimal
 from django import forms
 from django.db import models
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.utils.translation import ugettext_lazy as _
 from django.utils.encoding import smart_str
+from product.listeners import price_lookup_listener
 from product.models import Option, Product, ProductPriceLookup, OptionGroup, Price ,make_option_unique_id
 from product.prices import get_product_quantity_price, get_product_quantity_adjustments
 from satchmo_utils import cross_list
@@ -244,8 +246,6 @@ class ConfigurableProduct(models.Model):
             self.create_subs = False
             super(ConfigurableProduct, self).save(**kwargs)
 
-        ProductPriceLookup.objects.smart_create_for_product(self.product)
-
     def get_absolute_url(self):
         return self.product.get_absolute_url()
 
@@ -427,7 +427,6 @@ class ProductVariation(models.Model):
             self.name = ""
 
         super(ProductVariation, self).save(**kwargs)
-        ProductPriceLookup.objects.smart_create_for_product(self.product)
 
     def _set_name(self, name):
         if not name:
@@ -465,3 +464,45 @@ class ProductVariation(models.Model):
 
     def __unicode__(self):
         return self.product.slug
+
+def _option_variations(option):
+    return list(ProductVariation.objects.filter(options=option).values_list('product', flat=True))
+
+def option_price_listener(sender, instance=None, **kwargs):
+    """An option's price change feeds into the price of every variation using it.
+
+    Connected to post_save and post_delete for `Option`.  A deleted option no
+    longer has its variations, so `option_delete_listener` notes them first.
+    """
+    if kwargs.get('raw', False):
+        return
+    pks = getattr(instance, '_variation_pks', None)
+    if pks is None:
+        pks = _option_variations(instance)
+    ProductPriceLookup.objects.mark_dirty(pks)
+
+def option_delete_listener(sender, instance=None, **kwargs):
+    """Notes the variations of an option which is about to be deleted."""
+    instance._variation_pks = _option_variations(instance)
+
+def variation_options_listener(sender, instance=None, action=None, reverse=False, pk_set=None, **kwargs):
+    """Marks the pricing lookup rows of the variations whose options changed,
+    from either side of `ProductVariation.options`."""
+    if not reverse:
+        if action.startswith('post_'):
+            ProductPriceLookup.objects.mark_dirty([instance.pk])
+    elif action == 'pre_clear':
+        instance._variation_pks = _option_variations(instance)
+    elif action == 'post_clear':
+        ProductPriceLookup.objects.mark_dirty(getattr(instance, '_variation_pks', []))
+    elif action.startswith('post_'):
+        ProductPriceLookup.objects.mark_dirty(pk_set)
+
+post_save.connect(price_lookup_listener, sender=ConfigurableProduct)
+post_delete.connect(price_lookup_listener, sender=ConfigurableProduct)
+post_save.connect(price_lookup_listener, sender=ProductVariation)
+post_delete.connect(price_lookup_listener, sender=ProductVariation)
+m2m_changed.connect(variation_options_listener, sender=ProductVariation.options.through)
+post_save.connect(option_price_listener, sender=Option)
+pre_delete.connect(option_delete_listener, sender=Option)
+post_delete.connect(option_price_listener, sender=Option)
@@ -1,7 +1,7 @@
 from decimal import Decimal
 from django.contrib.sites.models import Site
 from django.test import TestCase
-from product.models import Option, OptionGroup, Product, Price
+from product.models import Option, OptionGroup, Product, Price, ProductPriceLookup
 from product.modules.configurable.models import ConfigurableProduct, ProductVariation
 import datetime
 import keyedcache
@@ -194,6 +194,43 @@ class ConfigurableProductTest(TestCase):
             dj_rocks.get_variations_for_options([])],
             [6, 7, 8, 9, 10, 11, 12, 13, 14])
 
+class PriceLookupTrackingTest(TestCase):
+    """Test that the lookup rows of the variations follow their options."""
+    fixtures = ['l10n-data.yaml','sample-store-data.yaml', 'products.yaml', 'test-config.yaml']
+
+    def setUp(self):
+        ProductPriceLookup.objects.rebuild_all()
+        self.variation = ProductVariation.objects.get(product__slug='dj-rocks-l-bl')
+        self.option = [option for option in self.variation.options.all() if option.price_change][0]
+        self.base = Decimal("23.00") - self.option.price_change
+
+    def tearDown(self):
+        keyedcache.cache_delete()
+
+    def _price(self):
+        return ProductPriceLookup.objects.filter(productslug='dj-rocks-l-bl', quantity=1)[0].price
+
+    def test_options_changed(self):
+        self.assertEqual(self._price(), Decimal("23.00"))
+        self.variation.options.remove(self.option)
+        self.assertEqual(self._price(), self.base)
+
+        # from the option's side
+        self.option.productvariation_set.add(self.variation)
+        self.assertEqual(self._price(), Decimal("23.00"))
+        self.option.productvariation_set.clear()
+        self.assertEqual(self._price(), self.base)
+
+    def test_option_deleted(self):
+        self.option.delete()
+        self.assertEqual(self._price(), self.base)
+
+    def test_configurable_deleted(self):
+        parent = self.variation.parent
+        self.assert_(ProductPriceLookup.objects.filter(parentid=parent.pk).count() > 0)
+        parent.delete()
+        self.assertEqual(ProductPriceLookup.objects.filter(parentid=parent.pk).count(), 0)
+        self.assertEqual(ProductPriceLookup.objects.filter(productslug='dj-rocks-l-bl', key__isnull=False).count(), 0)
 
 if __name__ == "__main__":
     import doctest
@@ -3,10 +3,15 @@ from django.contrib.sites.models import Site
 from django.core import urlresolvers
 from django.test import TestCase
 from django.test.client import Client
+from livesettings import config_get
+from payment.models import RecurringCharge
+from payment.rebill import Rebiller
 from product.models import *
 from satchmo_store.contact.models import *
 from satchmo_store.shop.models import *
+import datetime
 import keyedcache
+import threading
 
 class TestRecurringBilling(TestCase):
     fixtures = ['l10n-data.yaml', 'test_shop.yaml', 'sub_products.yaml', 'config', 'initial_data.yaml']
@@ -78,6 +83,132 @@ class TestRecurringBilling(TestCase):
             self.assertEqual(order.expire_date, datetime.date.today() + datetime.timedelta(days=expire_length))
             self.assertEqual(order.order.balance, Decimal('0.00'))
 
+        # billing again doesn't renew anything twice
+        counts = Rebiller().run()
+        self.assertEqual(counts['billed'], 0)
+        self.assertEqual(order_count, OrderItem.objects.count()/2.0)
+        self.assertEqual(RecurringCharge.objects.filter(status='PAID').count(), order_count)
+
+    def _expire_today(self):
+        OrderItem.objects.all().update(expire_date=datetime.date.today())
+        return OrderItem.objects.count()
+
+    def _make_due(self):
+        RecurringCharge.objects.filter(next_attempt__isnull=False).update(
+            next_attempt=datetime.datetime.now() - datetime.timedelta(hours=1))
+
+    def _rebill(self, cls, method, broken):
+        """Rebill with `method` of `cls` replaced by `broken`."""
+        original = cls.__dict__.get(method, None)
+        setattr(cls, method, broken)
+        try:
+            return Rebiller().run()
+        finally:
+            if original is None:
+                delattr(cls, method)
+            else:
+                setattr(cls, method, original)
+
+    def testFailedChargeRetried(self):
+        from payment.modules.dummy.processor import PaymentProcessor
+
+        item_count = self._expire_today()
+        def prepare_data(processor, order):
+            raise ValueError('Gateway down')
+        counts = self._rebill(PaymentProcessor, 'prepare_data', prepare_data)
+        charge_count = RecurringCharge.objects.count()
+        self.assert_(charge_count > 0)
+        self.assertEqual(counts['failed'], charge_count)
+        for charge in RecurringCharge.objects.all():
+            self.assertEqual(charge.status, 'FAILED')
+            self.assertEqual(charge.attempts, 1)
+            self.assertEqual(charge.message, 'Gateway down')
+            self.assertNotEqual(charge.next_attempt, None)
+            self.assertNotEqual(charge.renewal, None)
+
+        # not due yet
+        counts = Rebiller().run()
+        self.assertEqual(counts['retried'], 0)
+
+        self._make_due()
+        counts = Rebiller().run()
+        self.assertEqual(counts['retried'], charge_count)
+        self.assertEqual(counts['billed'], charge_count)
+        for charge in RecurringCharge.objects.select_related('order'):
+            self.assertEqual(charge.status, 'PAID')
+            self.assertEqual(charge.attempts, 2)
+            self.assertEqual(charge.order.balance, Decimal('0.00'))
+        self.assertEqual(OrderItem.objects.count(), item_count + charge_count)
+
+    def testRenewalErrorRetried(self):
+        """An error before the charge fails it, instead of leaving it pending."""
+        item_count = self._expire_today()
+        def recalculate_total(order, save=True):
+            raise ValueError('Database error')
+        counts = self._rebill(Order, 'recalculate_total', recalculate_total)
+        charge_count = RecurringCharge.objects.count()
+        self.assert_(charge_count > 0)
+        self.assertEqual(counts['failed'], charge_count)
+        self.assertEqual(RecurringCharge.objects.filter(status='FAILED',
+            next_attempt__isnull=False).count(), charge_count)
+
+        self._make_due()
+        counts = Rebiller().run()
+        self.assertEqual(counts['billed'], charge_count)
+        self.assertEqual(RecurringCharge.objects.filter(status='PAID').count(), charge_count)
+        # each item is renewed once
+        self.assertEqual(OrderItem.objects.count(), item_count + charge_count)
+
+    def testRetryLimit(self):
+        from payment.modules.dummy.processor import PaymentProcessor
+
+        retries = config_get('PAYMENT', 'REBILL_RETRIES')
+        retries.update(2)
+        try:
+            self._expire_today()
+            def prepare_data(processor, order):
+                raise ValueError('Gateway down')
+            self._rebill(PaymentProcessor, 'prepare_data', prepare_data)
+            self._make_due()
+            counts = self._rebill(PaymentProcessor, 'prepare_data', prepare_data)
+            charge_count = RecurringCharge.objects.count()
+            self.assertEqual(counts['retried'], charge_count)
+            for charge in RecurringCharge.objects.all():
+                self.assertEqual(charge.status, 'FAILED')
+                self.assertEqual(charge.attempts, 2)
+                self.assertEqual(charge.next_attempt, None)
+
+            # given up
+            self._make_due()
+            counts = Rebiller().run()
+            self.assertEqual(counts['retried'], 0)
+            self.assertEqual(RecurringCharge.objects.filter(status='FAILED').count(), charge_count)
+        finally:
+            retries.update(3)
+
+    def testWorkers(self):
+        """Test that the worker pool runs every job once, and that an error
+        in one job doesn't stop the others.  The workers open connections
+        of their own, which don't see the data of the test transaction, so
+        the jobs don't touch the database."""
+        orders = list(Order.objects.all())
+        self.assert_(len(orders) > 3)
+        done = []
+        lock = threading.Lock()
+        def func(job):
+            lock.acquire()
+            try:
+                done.append(job['order'].id)
+            finally:
+                lock.release()
+            if job['order'].id == orders[1].id:
+                raise ValueError('Broken order')
+
+        rebiller = Rebiller(workers=3)
+        self.assertEqual(rebiller.workers, 3)
+        rebiller._run_jobs([{'order' : order} for order in orders], func)
+        self.assertEqual(sorted(done), sorted([order.id for order in orders]))
+
     def getTerms(self, object, ignore_trial=False):
         if object.subscriptionproduct.get_trial_terms().count() and ignore_trial is False:
             price = object.subscriptionproduct.get_trial_terms(0).price
@@ -1,10 +1,20 @@
 from decimal import Decimal
 from l10n.utils import moneyfmt
+from threaded_multihost import threadlocals
 import datetime
+import logging
+
+log = logging.getLogger('product.prices')
+
+PRICE_CACHE_KEY = 'satchmo_price_cache'
 
 def get_product_quantity_adjustments(product, qty=1, parent=None):
     """Gets a list of adjustments for the price found for a product/qty"""
 
+    cache = get_price_cache()
+    if cache is not None:
+        return cache.adjustments(product, qty=qty, parent=parent)
+
     qty_discounts = product.price_set.exclude(
         expires__isnull=False,
         expires__lt=datetime.date.today()).filter(quantity__lte=qty)
@@ -34,9 +44,118 @@ def get_product_quantity_price(product, qty=Decimal('1'), delta=Decimal("0.00"),
 
     return adjustments.final_price()+delta
 
+def get_price_cache():
+    """Get the active `PriceCache` for this thread, or None."""
+    return threadlocals.get_thread_variable(PRICE_CACHE_KEY)
+
+def start_price_cache():
+    """Activate price memoization for this thread, and return the `PriceCache`.
+    Calls nest, each must be matched by a call to `stop_price_cache`."""
+    cache = get_price_cache()
+    if cache is None:
+        cache = PriceCache()
+        threadlocals.set_thread_variable(PRICE_CACHE_KEY, cache)
+    cache.depth += 1
+    return cache
+
+def stop_price_cache(force=False):
+    """Leave the price memoization scope, dropping the cache when the outermost scope ends."""
+    cache = get_price_cache()
+    if cache is not None:
+        cache.depth -= 1
+        if force or cache.depth <= 0:
+            threadlocals.set_thread_variable(PRICE_CACHE_KEY, None)
+
+def invalidate_price_cache(product=None):
+    """Forget memoized prices for a product (or a product id), or all of them."""
+    cache = get_price_cache()
+    if cache is not None:
+        cache.invalidate(product)
+
 # -------------------------------------------
 # helper objects - not Django model objects
 
+class PriceCache(object):
+    """Memoizes price resolution for the duration of a request or an order recalculation.
+
+    The unexpired `Price` rows of each product are loaded once - for all the
+    products passed to `preload` with a single query - and the resulting
+    `PriceAdjustmentCalc` is remembered per (product, quantity, parent), so
+    the `satchmo_price_query` signal is only sent once for each of them.
+
+    Use `start_price_cache`/`stop_price_cache` (or `PriceCacheMiddleware`) to
+    activate it; `get_product_quantity_adjustments` picks it up automatically.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.clear()
+
+    def clear(self):
+        self._prices = {}
+        self._adjustments = {}
+
+    def invalidate(self, product=None):
+        if product is None:
+            self.clear()
+            return
+
+        pk = getattr(product, 'pk', product)
+        if pk in self._prices:
+            del self._prices[pk]
+        for key in self._adjustments.keys():
+            if pk in (key[0], key[2]):
+                del self._adjustments[key]
+
+    def preload(self, products):
+        """Load the prices of all `products` not yet known, in one query."""
+        from product.models import Price
+
+        pks = [p.pk for p in products if not p.pk in self._prices]
+        if not pks:
+            return
+
+        for pk in pks:
+            self._prices[pk] = []
+        prices = Price.objects.filter(product__in=pks).exclude(
+            expires__isnull=False,
+            expires__lt=datetime.date.today())
+        for price in prices:
+            self._prices[price.product_id].append(price)
+        log.debug('Preloaded prices for %i products', len(pks))
+
+    def prices(self, product):
+        if not product.pk in self._prices:
+            self.preload([product])
+        return self._prices[product.pk]
+
+    def adjustments(self, product, qty=1, parent=None):
+        if parent is None:
+            key = (product.pk, qty, None)
+        else:
+            key = (product.pk, qty, parent.pk)
+
+        try:
+            return self._adjustments[key]
+        except KeyError:
+            pass
+
+        # Same choice as the query in get_product_quantity_adjustments:
+        # order_by('price', '-quantity', 'expires'), with prices that never
+        # expire sorting first, as they do on SQLite and MySQL.
+        candidates = [(p.price, -p.quantity, p.expires is not None, p.expires, p)
+            for p in self.prices(product) if p.quantity <= qty]
+        if candidates:
+            candidates.sort()
+            adjustments = candidates[0][-1].adjustments(product)
+        elif parent:
+            adjustments = self.adjustments(parent, qty=qty)
+        else:
+            adjustments = PriceAdjustmentCalc(None)
+
+        self._adjustments[key] = adjustments
+        return adjustments
+
 class PriceAdjustmentCalc(object):
     """Helper class to handle adding up product pricing adjustments"""
 
@@ -1,61 +1,50 @@
-from keyedcache import cache_get, cache_set, NotCachedError
-from product.models import Product
+from django.contrib.sites.models import Site
+from django.core.cache import cache
+from product.models import Product, ProductSales
 import logging
+import random
 
 log = logging.getLogger('product.queries')
 
-def bestsellers(count):
-    """Look up the bestselling products and return in a list"""        
-    sellers = []
-    cached = False
-    try:
-        pks = cache_get('BESTSELLERS', count=count)
-        if pks:
-            pks = [long(pk) for pk in pks.split(',')]
-            productdict = Product.objects.in_bulk(pks)
-            #log.debug(productdict)
-            for pk in pks:
-                try:
-                    if (int(pk)) in productdict:
-                        key = int(pk)
-                    elif long(pk) in productdict:
-                        key = long(pk)
-                    else:
-                        continue
-                    sellers.append(productdict[key])
-                except ValueError:
-                    pass
-            
-            log.debug('retrieved bestselling products from cache')
-        cached = True    
-    except NotCachedError:
-        pass
-    
-    except ValueError:
-        pass
-
-    if not cached:
-        products = Product.objects.active_by_site()
-        work = []
-        for p in products:
-            ct = p.orderitem_set.count()
-            if ct>0:
-                work.append((ct, p))
-        
-        work.sort()
-        work = work[-count:]
-        work.reverse()
-    
-        sellers = []
-        pks = []
-    
-        for p in work:
-            product = p[1]
-            pks.append("%i" % product.pk)
-            sellers.append(product)
-         
-        pks = ",".join(pks)
-        log.debug('calculated bestselling %i products, set to cache: %s', count, pks)
-        cache_set('BESTSELLERS', count=count, value=pks)
-        
+FEATURED_KEY = 'product-featured-%s'
+FEATURED_TIMEOUT = 60*60*24
+
+def bestsellers(count, days=None, category=None):
+    """Look up the bestselling products and return in a list.
+
+    The products are ranked by the number of orders they were sold in, over
+    the last `days` days if given, and only within `category` and its child
+    categories if given.  See `ProductSalesManager.top`.
+    """
+    pks = ProductSales.objects.top(count, days=days, category=category)
+    productdict = Product.objects.in_bulk(pks)
+    sellers = [productdict[pk] for pk in pks if pk in productdict]
+    log.debug('found %i bestselling products', len(sellers))
     return sellers
+
+def featured_pks(site=None):
+    """Return the ids of the active featured products of `site`, which are
+    cached until a product is saved or deleted."""
+    if not site:
+        site = Site.objects.get_current()
+    key = FEATURED_KEY % site.id
+    pks = cache.get(key)
+    if pks is None:
+        pks = list(Product.objects.featured_by_site(site=site).order_by('pk').values_list('pk', flat=True))
+        cache.set(key, pks, FEATURED_TIMEOUT)
+    return pks
+
+def featured_changed(site_id):
+    """Forget the cached featured products of a site."""
+    cache.delete(FEATURED_KEY % site_id)
+
+def random_featured(count, site=None, seed=None):
+    """Return `count` featured products of `site` picked at random.
+
+    The same `seed` picks the same products in the same order, as long as
+    the featured products don't change.
+    """
+    pks = featured_pks(site=site)
+    pks = random.Random(seed).sample(pks, min(count, len(pks)))
+    productdict = Product.objects.in_bulk(pks)
+    return [productdict[pk] for pk in pks if pk in productdict]
@@ -0,0 +1,440 @@
+"""
+An inverted index of the product and category text for the shop search.
+
+The default search listener filters with `icontains` on several columns for
+every keyword, which scans the product and category tables on each search.
+With the `PRODUCT.SEARCH_INDEX` setting on, it asks the `SearchIndex` instead:
+the name, descriptions and meta text of the active products and categories,
+and of their translations, are split into lowercase words, and each word
+maps to the objects which contain it.  A keyword matches the words it is a
+prefix of, or a product SKU exactly, and the results are ranked by where
+and how well each keyword matched.
+
+Each process keeps its own index.  It is built from the database the first
+time it is needed, or loaded from the `SEARCH_INDEX_FILE` in `SATCHMO_SETTINGS`
+when that is set, a file which `satchmo_rebuild_search` writes.  Saving or
+deleting a product, a category or one of their translations updates the
+index of the current process and records the change in the cache, and the
+other processes apply the recorded changes before their next search.  When
+they have missed too many changes, they rebuild.  Changes are not recorded
+while the setting is off, so switching it rebuilds every index.
+"""
+from bisect import bisect_left
+from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.utils.encoding import force_unicode
+from django.utils.html import strip_tags
+from livesettings import config_value_safe
+from satchmo_store.shop import get_satchmo_setting
+import cPickle as pickle
+import logging
+import os
+import re
+import threading
+import time
+
+log = logging.getLogger('product.search')
+
+SEQ_KEY = 'product-search-seq'
+CHANGE_KEY = 'product-search-change-%i'
+CHANGE_TIMEOUT = 60*60*24
+SEQ_TIMEOUT = 60*60*24*365
+JOURNAL_SIZE = 500
+
+# field weights, a word in a name counts more than one in a description
+NAME_WEIGHT = 4
+SHORT_DESCRIPTION_WEIGHT = 2
+DESCRIPTION_WEIGHT = 1
+META_WEIGHT = 1
+SKU_WEIGHT = 8
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+STEM_SUFFIXES = ('ies', 'ing', 'es', 'ed', 's')
+
+def stem(word):
+    """A light English stemmer, which strips a few common suffixes."""
+    if len(word) > 4:
+        for suffix in STEM_SUFFIXES:
+            if word.endswith(suffix):
+                word = word[:-len(suffix)]
+                if suffix == 'ies':
+                    word += 'y'
+                break
+    return word
+
+def tokenize(text, stemmed=False):
+    """Return the lowercase words of `text`, without any HTML tags."""
+    if not text:
+        return []
+    words = WORD_RE.findall(strip_tags(force_unicode(text)).lower())
+    if stemmed:
+        words = [stem(word) for word in words]
+    return words
+
+class InvertedIndex(object):
+    """Maps words to the documents which contain them, with a weight.
+
+    Documents are identified by their primary key, and belong to a site.
+    `exact` values, such as SKUs, only match a whole keyword.
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.exact = {}
+        self.docs = {}
+        self._vocabulary = None
+
+    def __len__(self):
+        return len(self.docs)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_vocabulary'] = None
+        return state
+
+    def add(self, pk, site, fields, exact=(), stemmed=False):
+        """Index document `pk` of `site`.  `fields` is a list of (text, weight)."""
+        self.remove(pk)
+        weights = {}
+        for text, weight in fields:
+            for word in tokenize(text, stemmed=stemmed):
+                weights[word] = weights.get(word, 0) + weight
+
+        exact = [force_unicode(value).lower() for value in exact if value]
+        for word, weight in weights.items():
+            self.postings.setdefault(word, {})[pk] = weight
+        for value in exact:
+            self.exact.setdefault(value, {})[pk] = SKU_WEIGHT
+        self.docs[pk] = (site, weights.keys(), exact)
+        self._vocabulary = None
+
+    def remove(self, pk):
+        doc = self.docs.pop(pk, None)
+        if doc is None:
+            return
+        site, words, exact = doc
+        for table, keys in ((self.postings, words), (self.exact, exact)):
+            for key in keys:
+                posting = table.get(key, None)
+                if posting is not None:
+                    posting.pop(pk, None)
+                    if not posting:
+                        del table[key]
+        self._vocabulary = None
+
+    def _get_vocabulary(self):
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self.postings.keys())
+        return self._vocabulary
+
+    vocabulary = property(_get_vocabulary)
+
+    def match(self, keyword, stemmed=False):
+        """Return {pk: score} of the documents matching all words of `keyword`,
+        or None if the keyword has no words to match."""
+        found = None
+        words = tokenize(keyword, stemmed=stemmed)
+        for word in words:
+            scores = {}
+            vocabulary = self.vocabulary
+            i = bisect_left(vocabulary, word)
+            while i < len(vocabulary) and vocabulary[i].startswith(word):
+                # whole words count double
+                factor = vocabulary[i] == word and 2 or 1
+                for pk, weight in self.postings[vocabulary[i]].items():
+                    scores[pk] = scores.get(pk, 0) + weight * factor
+                i += 1
+            found = _intersect(found, scores)
+
+        sku = self.exact.get(force_unicode(keyword).strip().lower(), None)
+        if sku:
+            if found is None:
+                found = {}
+            for pk, weight in sku.items():
+                found[pk] = found.get(pk, 0) + weight
+        return found
+
+    def search(self, keywords, site=None, stemmed=False):
+        """Return the pks of the documents of `site` matching all `keywords`,
+        best match first."""
+        found = None
+        for keyword in keywords:
+            scores = self.match(keyword, stemmed=stemmed)
+            if scores is not None:
+                found = _intersect(found, scores)
+        if not found:
+            return []
+
+        ranked = [(-score, pk) for pk, score in found.items()
+            if site is None or self.docs[pk][0] == site]
+        ranked.sort()
+        return [pk for score, pk in ranked]
+
+def _intersect(found, scores):
+    if found is None:
+        return scores
+    work = {}
+    for pk, score in scores.items():
+        if pk in found:
+            work[pk] = found[pk] + score
+    return work
+
+class SearchResults(object):
+    """A page of search results, `pks` in rank order, out of `total` hits."""
+
+    def __init__(self, pks, total, offset=0):
+        self.pks = pks
+        self.total = total
+        self.offset = offset
+
+    def __iter__(self):
+        return iter(self.pks)
+
+    def __len__(self):
+        return len(self.pks)
+
+class SearchIndex(object):
+    """The product and category `InvertedIndex`es of this process."""
+
+    def __init__(self, stemmed=False):
+        self.stemmed = stemmed
+        self.seq = 0
+        self.products = InvertedIndex()
+        self.categories = InvertedIndex()
+
+    def rebuild(self):
+        from product.models import Category, CategoryTranslation, Product, ProductTranslation
+
+        start = time.time()
+        self.seq = _current_seq()
+        self.products = InvertedIndex()
+        self.categories = InvertedIndex()
+
+        translations = {}
+        for pk, name, short_description, description in ProductTranslation.objects.filter(
+            active=True, product__active=True).values_list(
+            'product', 'name', 'short_description', 'description').iterator():
+            translations.setdefault(pk, []).extend(_product_fields(name, short_description, description))
+        for row in Product.objects.filter(active=True).values_list(*PRODUCT_VALUES).iterator():
+            self._add_product(row, translations.get(row[0], []))
+
+        translations = {}
+        for pk, name, description in CategoryTranslation.objects.filter(
+            active=True, category__is_active=True).values_list(
+            'category', 'name', 'description').iterator():
+            translations.setdefault(pk, []).extend(_category_fields(name, None, description))
+        for row in Category.objects.filter(is_active=True).values_list(*CATEGORY_VALUES).iterator():
+            self._add_category(row, translations.get(row[0], []))
+
+        log.debug('Indexed %i products and %i categories in %.2f seconds',
+            len(self.products), len(self.categories), time.time() - start)
+
+    def _add_product(self, row, translated):
+        pk, site, name, short_description, description, meta, sku = row
+        fields = _product_fields(name, short_description, description, meta) + translated
+        self.products.add(pk, site, fields, exact=(sku,), stemmed=self.stemmed)
+
+    def _add_category(self, row, translated):
+        pk, site, name, meta, description = row
+        fields = _category_fields(name, meta, description) + translated
+        self.categories.add(pk, site, fields, stemmed=self.stemmed)
+
+    def reindex(self, kind, pk):
+        """Reload product or category `pk` from the database."""
+        from product.models import Category, CategoryTranslation, Product, ProductTranslation
+
+        if kind == 'product':
+            self.products.remove(pk)
+            rows = Product.objects.filter(pk=pk, active=True).values_list(*PRODUCT_VALUES)
+            if rows:
+                translated = []
+                for name, short_description, description in ProductTranslation.objects.filter(
+                    product=pk, active=True).values_list('name', 'short_description', 'description'):
+                    translated.extend(_product_fields(name, short_description, description))
+                self._add_product(rows[0], translated)
+        else:
+            self.categories.remove(pk)
+            rows = Category.objects.filter(pk=pk, is_active=True).values_list(*CATEGORY_VALUES)
+            if rows:
+                translated = []
+                for name, description in CategoryTranslation.objects.filter(
+                    category=pk, active=True).values_list('name', 'description'):
+                    translated.extend(_category_fields(name, None, description))
+                self._add_category(rows[0], translated)
+
+    def search(self, kind, keywords, site=None, offset=0, limit=None):
+        if kind == 'product':
+            index = self.products
+        else:
+            index = self.categories
+        pks = index.search(keywords, site=site, stemmed=self.stemmed)
+        if limit is None:
+            page = pks[offset:]
+        else:
+            page = pks[offset:offset+limit]
+        return SearchResults(page, len(pks), offset=offset)
+
+    def save(self, path):
+        """Write the index to `path`, replacing it at once."""
+        work = '%s.%i.tmp' % (path, os.getpid())
+        f = open(work, 'wb')
+        try:
+            pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        os.rename(work, path)
+
+PRODUCT_VALUES = ('id', 'site', 'name', 'short_description', 'description', 'meta', 'sku')
+CATEGORY_VALUES = ('id', 'site', 'name', 'meta', 'description')
+
+def _product_fields(name, short_description, description, meta=None):
+    return [(name, NAME_WEIGHT), (short_description, SHORT_DESCRIPTION_WEIGHT),
+        (description, DESCRIPTION_WEIGHT), (meta, META_WEIGHT)]
+
+def _category_fields(name, meta, description):
+    return [(name, NAME_WEIGHT), (meta, META_WEIGHT), (description, DESCRIPTION_WEIGHT)]
+
+def _current_seq():
+    seq = cache.get(SEQ_KEY)
+    if seq is None:
+        cache.add(SEQ_KEY, 0, SEQ_TIMEOUT)
+        seq = cache.get(SEQ_KEY) or 0
+    return seq
+
+_INDEX = None
+_LOCK = threading.RLock()
+
+def _load_index(stemmed):
+    path = get_satchmo_setting('SEARCH_INDEX_FILE')
+    if path and os.path.isfile(path):
+        try:
+            f = open(path, 'rb')
+            try:
+                index = pickle.load(f)
+            finally:
+                f.close()
+            if index.stemmed == stemmed:
+                log.debug('Loaded the search index from %s', path)
+                return index
+        except Exception, e:
+            log.warn('Could not load the search index from %s: %s', path, e)
+    return None
+
+def _build_index(stemmed):
+    index = SearchIndex(stemmed=stemmed)
+    index.rebuild()
+    path = get_satchmo_setting('SEARCH_INDEX_FILE')
+    if path:
+        try:
+            index.save(path)
+        except (IOError, OSError), e:
+            log.warn('Could not save the search index to %s: %s', path, e)
+    return index
+
+def _sync(index):
+    """Apply the changes other processes recorded, or return False if some
+    are missing."""
+    seq = _current_seq()
+    if seq == index.seq:
+        return True
+    if seq < index.seq or seq - index.seq > JOURNAL_SIZE:
+        return False
+
+    keys = [CHANGE_KEY % n for n in range(index.seq + 1, seq + 1)]
+    changes = cache.get_many(keys)
+    if len(changes) < len(keys):
+        return False
+
+    done = set()
+    for key in keys:
+        change = changes[key]
+        if not change in done:
+            index.reindex(*change)
+            done.add(change)
+    index.seq = seq
+    return True
+
+def get_search_index():
+    """Return the `SearchIndex` of this process, up to date with the changes
+    recorded by the others."""
+    global _INDEX
+    stemmed = config_value_safe('PRODUCT', 'SEARCH_STEMMING', False)
+    _LOCK.acquire()
+    try:
+        index = _INDEX
+        if index is None or index.stemmed != stemmed:
+            index = _load_index(stemmed)
+        if index is None or not _sync(index):
+            index = _build_index(stemmed)
+        _INDEX = index
+        return index
+    finally:
+        _LOCK.release()
+
+def rebuild_search_index():
+    """Rebuild the index of this process from the database, and save it to
+    the `SEARCH_INDEX_FILE` if there is one."""
+    global _INDEX
+    _LOCK.acquire()
+    try:
+        _INDEX = _build_index(config_value_safe('PRODUCT', 'SEARCH_STEMMING', False))
+        return _INDEX
+    finally:
+        _LOCK.release()
+
+def search_products(keywords, site=None, offset=0, limit=None):
+    """Return the `SearchResults` of the active products of `site` (default
+    the current site) which match all `keywords`."""
+    if site is None:
+        site = Site.objects.get_current()
+    _LOCK.acquire()
+    try:
+        return get_search_index().search('product', keywords, site=site.id, offset=offset, limit=limit)
+    finally:
+        _LOCK.release()
+
+def search_categories(keywords, site=None, offset=0, limit=None):
+    """Return the `SearchResults` of the active categories of `site`
+    (default the current site) which match all `keywords`."""
+    if site is None:
+        site = Site.objects.get_current()
+    _LOCK.acquire()
+    try:
+        return get_search_index().search('category', keywords, site=site.id, offset=offset, limit=limit)
+    finally:
+        _LOCK.release()
+
+def _next_seq():
+    try:
+        return cache.incr(SEQ_KEY)
+    except ValueError:
+        cache.add(SEQ_KEY, 0, SEQ_TIMEOUT)
+        return cache.incr(SEQ_KEY)
+
+def search_index_changed(kind, pk, update=True):
+    """Record that product or category `pk` changed, and reindex it in this
+    process if `update`."""
+    seq = _next_seq()
+    cache.set(CHANGE_KEY % seq, (kind, pk), CHANGE_TIMEOUT)
+
+    _LOCK.acquire()
+    try:
+        index = _INDEX
+        if index is not None and update:
+            index.reindex(kind, pk)
+            if index.seq == seq - 1:
+                index.seq = seq
+    finally:
+        _LOCK.release()
+
+def search_index_reset():
+    """Make every process rebuild its index before the next search.  The
+    changes made while the `PRODUCT.SEARCH_INDEX` setting was off were not
+    recorded, so a change is skipped, which the processes can't apply."""
+    global _INDEX
+    _next_seq()
+    _LOCK.acquire()
+    try:
+        _INDEX = None
+    finally:
+        _LOCK.release()
@@ -17,6 +17,16 @@ def best_selling_products_list(count):
 
     return bestsellers(ct)
 
+@register.filter
+def category_bestsellers(category, count):
+    """Get a list of the best selling products in a category and its children"""
+    try:
+        ct = int(count)
+    except ValueError:
+        ct = config_value('PRODUCT','NUM_PAGINATED')
+
+    return bestsellers(ct, category=category)
+
 @register.filter
 def recent_products_list(count):
     """Get a list of recent products"""
@@ -1,23 +1,39 @@
 from decimal import Decimal
 from django.contrib.sites.models import Site
 from django.core import urlresolvers
+from django.core.cache import cache
 from django.forms.util import ValidationError
 from django.http import HttpResponse
 from django.test import TestCase
+from l10n.utils import prefetch_translations
+from livesettings import config_get
 from product.forms import ProductExportForm
 from product.models import (
     Category,
+    CategoryTranslation,
     Discount,
     Option,
     OptionGroup,
     Product,
     Price,
+    ProductPriceLookup,
+    ProductPriceLookupQueue,
+    ProductSales,
+    ProductSalesRank,
+    ProductTranslation,
 )
+from product.listeners import parse_priceband
 from product.prices import (
     get_product_quantity_adjustments,
     PriceAdjustment,
     PriceAdjustmentCalc,
+    start_price_cache,
+    stop_price_cache,
 )
+from product.queries import bestsellers, featured_changed, featured_pks, random_featured
+from product.search import rebuild_search_index, search_categories, search_products, SEQ_KEY
+from product.tree import category_tree_changed, VERSION_KEY
+from product.utils import LOOKUP_FIELDS, PriceLookupBuilder
 import datetime
 import keyedcache
 import signals
@@ -79,6 +95,7 @@ class CategoryTest(TestCase):
 
     def tearDown(self):
         keyedcache.cache_delete()
+        category_tree_changed()
 
     def test_hierarchy_validation(self):
         #
@@ -103,6 +120,61 @@ class CategoryTest(TestCase):
         })
         self.assertEqual(self.womens_jewelry.get_absolute_url(), exp_url)
 
+    def test_tree(self):
+        self.pet_jewelry.parent = self.womens_jewelry
+        self.pet_jewelry.save()
+        collars = Category.objects.create(slug="collars", name="Collars",
+            parent=self.pet_jewelry, site=self.site)
+
+        self.assertEqual(collars.parents(), [self.womens_jewelry, self.pet_jewelry])
+        self.assertEqual(unicode(collars), u"Women's Jewelry :: Pet Jewelry :: Collars")
+        exp_url = urlresolvers.reverse('satchmo_category', kwargs={
+            'parent_slugs': 'womens-jewelry/pet-jewelry/', 'slug': 'collars'
+        })
+        self.assertEqual(collars.get_absolute_url(), exp_url)
+        self.assertEqual(self.womens_jewelry.get_all_children(include_self=True),
+            [self.womens_jewelry, self.pet_jewelry, collars])
+
+        # only the categories with active products, and the ones above them
+        self.assertEqual(self.womens_jewelry.get_active_children(), [])
+        product = Product.objects.create(slug="tag", name="Tag", site=self.site)
+        product.category.add(collars)
+        self.assertEqual(self.womens_jewelry.get_active_children(), [])
+        product.category.add(self.pet_jewelry)
+        self.assertEqual(self.womens_jewelry.get_active_children(),
+            [self.pet_jewelry, collars])
+
+        # saving a product only reloads the trees when it is (de)activated
+        version = cache.get(VERSION_KEY)
+        product.items_in_stock = 5
+        product.save()
+        self.assertEqual(cache.get(VERSION_KEY), version)
+        product.active = False
+        product.save()
+        self.assertNotEqual(cache.get(VERSION_KEY), version)
+        self.assertEqual(self.womens_jewelry.get_active_children(), [])
+        product.active = True
+        product.save()
+        self.assertEqual(self.womens_jewelry.get_active_children(),
+            [self.pet_jewelry, collars])
+
+        # an update() sends no signals, but the trees are reloaded once the
+        # version key has been evicted
+        Category.objects.filter(pk=self.pet_jewelry.pk).update(name="Pet Tags")
+        self.assertEqual(unicode(collars), u"Women's Jewelry :: Pet Jewelry :: Collars")
+        cache.delete(VERSION_KEY)
+        self.assertEqual(unicode(collars), u"Women's Jewelry :: Pet Tags :: Collars")
+
+        collars.parent = None
+        collars.save()
+        self.assertEqual(self.womens_jewelry.get_all_children(), [self.pet_jewelry])
+        self.assertEqual(Category.objects.get(slug="collars").parents(), [])
+
+        self.womens_jewelry.parent = collars
+        self.womens_jewelry.save()
+        collars.parent = self.pet_jewelry
+        self.assertRaises(ValidationError, collars.save)
+
 #    def test_infinite_loop(self):
 #        """Check that Category methods still work on a Category whose parents list contains an infinite loop."""
 #        # Create two Categories that are each other's parents. First make sure that
@@ -425,6 +497,27 @@ class ProductTest(TestCase):
         self.assertEqual(p.smart_attr('height'), None)
         self.assertEqual(sb.smart_attr('height'), None)
 
+    def test_cached_subtypes(self):
+        from product.modules.configurable.models import ConfigurableProduct
+        from product.utils import load_subtypes
+
+        product = Product.objects.create(slug='mug', name='Mug', site=Site.objects.get_current())
+        self.assertEqual(product.get_subtypes(), ())
+        self.assertEqual(Product.objects.get(pk=product.pk).get_subtypes(), ())
+
+        configurable = ConfigurableProduct.objects.create(product=product)
+        self.assertEqual(Product.objects.get(pk=product.pk).get_subtypes(), ('ConfigurableProduct',))
+        configurable.delete()
+        self.assertEqual(Product.objects.get(pk=product.pk).get_subtypes(), ())
+        configurable = ConfigurableProduct.objects.create(product=product)
+
+        expected = {'mug' : ('ConfigurableProduct',), 'dj-rocks-s-b' : ('ProductVariation',), 'PY-Rocks' : ()}
+        # the second time round, from the cached names
+        for i in range(2):
+            products = list(Product.objects.filter(slug__in=expected.keys()))
+            load_subtypes(products)
+            self.assertEqual(dict([(p.slug, p._sub_types) for p in products]), expected)
+
 class PriceAdjustmentTest(TestCase):
     fixtures = ['products.yaml']
 
@@ -457,6 +550,325 @@ class PriceAdjustmentTest(TestCase):
         self.assertEqual(a.amount, Decimal(5))
         signals.satchmo_price_query.disconnect(five_off)
 
+class PriceLookupBuilderTest(TestCase):
+    fixtures = ['l10n-data.yaml','sample-store-data.yaml', 'products.yaml', 'test-config.yaml']
+
+    def setUp(self):
+        self.site = Site.objects.get_current()
+
+    def tearDown(self):
+        keyedcache.cache_delete()
+
+    def _lookup_rows(self):
+        return sorted(ProductPriceLookup.objects.filter(siteid=self.site.id).values_list(*LOOKUP_FIELDS))
+
+    def test_matches_per_product_build(self):
+        """The bulk builder must produce the same rows as smart_create_for_product"""
+        ProductPriceLookup.objects.filter(siteid=self.site.id).delete()
+        for product in Product.objects.active_by_site(site=self.site, variations=False):
+            ProductPriceLookup.objects.smart_create_for_product(product)
+        expected = self._lookup_rows()
+        self.assert_(len(expected) > 0)
+
+        builder = PriceLookupBuilder(site=self.site, batch_size=3, chunk_size=7)
+        builder.rebuild()
+        self.assertEqual(self._lookup_rows(), expected)
+        self.assertEqual(builder.pricect, len(expected))
+        self.assertEqual(builder.productct,
+            Product.objects.active_by_site(site=self.site, variations=False).count())
+
+    def test_rebuild_all(self):
+        ProductPriceLookup.objects.filter(siteid=self.site.id).delete()
+        ct = ProductPriceLookup.objects.rebuild_all(site=self.site)
+        self.assertEqual(ct, ProductPriceLookup.objects.filter(siteid=self.site.id).count())
+        product = Product.objects.get(slug='PY-Rocks')
+        lookup = ProductPriceLookup.objects.get(productslug=product.slug, quantity=1)
+        self.assertEqual(lookup.price, Decimal("19.50"))
+
+class PriceLookupTrackingTest(TestCase):
+    fixtures = ['l10n-data.yaml','sample-store-data.yaml', 'products.yaml', 'test-config.yaml']
+
+    def setUp(self):
+        self.product = Product.objects.get(slug='PY-Rocks')
+
+    def tearDown(self):
+        config_get('PRODUCT', 'DEFERRED_PRICE_LOOKUP').update(False)
+        keyedcache.cache_delete()
+
+    def _qty_lookups(self, qty):
+        return ProductPriceLookup.objects.filter(productslug=self.product.slug, quantity=qty)
+
+    def test_price_save_and_delete(self):
+        price = Price.objects.create(product=self.product, quantity=Decimal('10'), price=Decimal("10.00"))
+        self.assertEqual(self._qty_lookups(10)[0].price, Decimal("10.00"))
+
+        price.delete()
+        self.assertEqual(self._qty_lookups(10).count(), 0)
+        self.assertEqual(self._qty_lookups(1).count(), 1)
+
+    def test_deferred(self):
+        config_get('PRODUCT', 'DEFERRED_PRICE_LOOKUP').update(True)
+        Price.objects.create(product=self.product, quantity=Decimal('10'), price=Decimal("10.00"))
+        self.assertEqual(self._qty_lookups(10).count(), 0)
+        self.assertEqual(ProductPriceLookupQueue.objects.filter(productid=self.product.id).count(), 1)
+
+        builder = ProductPriceLookupQueue.objects.process()
+        self.assertEqual(builder.productct, 1)
+        self.assertEqual(self._qty_lookups(10)[0].price, Decimal("10.00"))
+        self.assertEqual(ProductPriceLookupQueue.objects.count(), 0)
+
+    def test_product_delete(self):
+        ProductPriceLookup.objects.rebuild_all()
+        self.assertEqual(self._qty_lookups(1).count(), 1)
+        self.product.delete()
+        self.assertEqual(self._qty_lookups(1).count(), 0)
+
+class PriceCacheTest(TestCase):
+    fixtures = ['products.yaml']
+
+    def setUp(self):
+        self.product = Product.objects.get(slug="dj-rocks")
+
+    def tearDown(self):
+        stop_price_cache(force=True)
+        keyedcache.cache_delete()
+
+    def test_memoized(self):
+        start_price_cache()
+        adj = get_product_quantity_adjustments(self.product, qty=1)
+        self.assertEqual(adj.final_price(), Decimal('20.00'))
+        self.assert_(get_product_quantity_adjustments(self.product, qty=1) is adj)
+
+    def test_invalidated_on_save(self):
+        start_price_cache()
+        self.assertEqual(self.product.get_qty_price(Decimal('10')), Decimal('20.00'))
+        Price.objects.create(product=self.product, quantity=Decimal('10'), price=Decimal("10.00"))
+        self.assertEqual(self.product.get_qty_price(Decimal('10')), Decimal('10.00'))
+
+    def test_same_as_uncached(self):
+        products = list(Product.objects.all())
+        expected = [(p.get_qty_price(Decimal('1')), p.get_qty_price(Decimal('5'), include_discount=False))
+            for p in products]
+
+        cache = start_price_cache()
+        cache.preload(products)
+        found = [(p.get_qty_price(Decimal('1')), p.get_qty_price(Decimal('5'), include_discount=False))
+            for p in products]
+        self.assertEqual(found, expected)
+
+class PriceBandTest(TestCase):
+    fixtures = ['l10n-data.yaml','sample-store-data.yaml', 'products.yaml', 'test-config.yaml']
+
+    def setUp(self):
+        ProductPriceLookup.objects.rebuild_all()
+
+    def tearDown(self):
+        keyedcache.cache_delete()
+
+    def test_in_price_band(self):
+        products = Product.objects.active().filter(productvariation__parent__isnull=True)
+        for low, high in ((Decimal('0'), Decimal('20')), (Decimal('19'), None), (Decimal('20'), Decimal('25'))):
+            lookups = ProductPriceLookup.objects.in_price_band(low, high)
+            found = set(products.filter(slug__in=lookups.values('productslug')).values_list('slug', flat=True))
+            expected = set([p.slug for p in products
+                if p.unit_price > low and (high is None or p.unit_price <= high)])
+            self.assertEqual(found, expected)
+
+            counts = ProductPriceLookup.objects.price_band_counts([(low, high)], products=products)
+            self.assertEqual(counts, [(low, high, len(expected))])
+            counts = ProductPriceLookup.objects.price_band_counts([(low, high)], products=list(products))
+            self.assertEqual(counts, [(low, high, len(expected))])
+
+    def test_counted_once(self):
+        """Test that a product with several prices in a band is counted once."""
+        product = Product.objects.active().filter(productvariation__parent__isnull=True, price__isnull=False)[0]
+        Price.objects.create(product=product, price=product.unit_price * Decimal('0.9'), quantity=1,
+            expires=datetime.date.today() + datetime.timedelta(days=30))
+        ProductPriceLookup.objects.rebuild_all()
+        self.assertEqual(ProductPriceLookup.objects.filter(productslug=product.slug, quantity=1,
+            parentid__isnull=True).count(), 2)
+
+        products = Product.objects.filter(pk=product.pk)
+        self.assertEqual(ProductPriceLookup.objects.price_band_counts([(None, None)], products=products),
+            [(None, None, 1)])
+        self.assertEqual(ProductPriceLookup.objects.price_band_counts([(None, None)], products=list(products)),
+            [(None, None, 1)])
+
+    def test_sale_price(self):
+        """Test that a product with a sale price is only in the band of its sale price."""
+        product = Product.objects.active().filter(productvariation__parent__isnull=True, price__isnull=False)[0]
+        regular = product.unit_price
+        sale = regular / 2
+        Price.objects.create(product=product, price=sale, quantity=1,
+            expires=datetime.date.today() + datetime.timedelta(days=30))
+        ProductPriceLookup.objects.rebuild_all()
+
+        products = Product.objects.filter(pk=product.pk)
+        for low, high, count in ((sale - 1, sale, 1), (sale, regular, 0), (None, None, 1)):
+            lookups = ProductPriceLookup.objects.in_price_band(low, high)
+            self.assertEqual(products.filter(slug__in=lookups.values('productslug')).count(), count)
+            self.assertEqual(ProductPriceLookup.objects.price_band_counts([(low, high)], products=products),
+                [(low, high, count)])
+            self.assertEqual(ProductPriceLookup.objects.price_band_counts([(low, high)], products=list(products)),
+                [(low, high, count)])
+
+    def test_parse_priceband(self):
+        self.assertEqual(parse_priceband('10-20'), (Decimal('10'), Decimal('20')))
+        self.assertEqual(parse_priceband('10'), (Decimal('10'), None))
+        self.assertEqual(parse_priceband('ten'), None)
+
+class SearchIndexTest(TestCase):
+    fixtures = ['l10n-data.yaml','sample-store-data.yaml', 'products.yaml', 'test-config.yaml']
+
+    def setUp(self):
+        self.use_index = config_get('PRODUCT', 'SEARCH_INDEX')
+        self.use_index.update(True)
+        rebuild_search_index()
+
+    def tearDown(self):
+        self.use_index.update(False)
+        keyedcache.cache_delete()
+
+    def _slugs(self, *keywords):
+        return [Product.objects.get(pk=pk).slug for pk in search_products(keywords)]
+
+    def test_search(self):
+        self.assertEqual(self._slugs('python'), ['PY-Rocks'])
+        self.assertEqual(self._slugs('pyth', 'ROCKS'), ['PY-Rocks'])
+        self.assertEqual(self._slugs('python', 'book'), [])
+        # an exact SKU
+        self.assertEqual(self._slugs('satch-1'), ['satchmo-computer'])
+
+        # names count most, so the shirts come first
+        slugs = self._slugs('shirt')
+        self.assert_('dj-rocks' in slugs[:2])
+        self.assert_('PY-Rocks' in slugs[:2])
+
+        results = search_products(['shirt'], offset=1, limit=2)
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results.total, len(slugs))
+
+        cats = [Category.objects.get(pk=pk).slug for pk in search_categories(['fiction'])]
+        self.assertEqual(cats, ['fiction', 'scifi', 'nonfiction'])
+
+    def test_updated_on_save(self):
+        product = Product.objects.get(slug='PY-Rocks')
+        product.name = 'Pythonic mug'
+        product.save()
+        self.assertEqual(self._slugs('mug'), ['PY-Rocks'])
+        self.assertEqual(self._slugs('python', 'rocks'), [])
+
+        trans = ProductTranslation.objects.create(product=product, languagecode='de', name='Becher')
+        self.assertEqual(self._slugs('becher'), ['PY-Rocks'])
+        trans.delete()
+        self.assertEqual(self._slugs('becher'), [])
+
+        category = Category.objects.get(slug='computer')
+        CategoryTranslation.objects.create(category=category, languagecode='de', name='Rechner')
+        self.assertEqual(list(search_categories(['rechner'])), [category.pk])
+
+        product.active = False
+        product.save()
+        self.assertEqual(self._slugs('mug'), [])
+
+    def test_disabled(self):
+        """Test that changes aren't recorded while the index is off, and that
+        switching it on rebuilds it."""
+        self.use_index.update(False)
+        seq = cache.get(SEQ_KEY)
+        product = Product.objects.get(slug='PY-Rocks')
+        product.name = 'Pythonic mug'
+        product.save()
+        self.assertEqual(cache.get(SEQ_KEY), seq)
+
+        self.use_index.update(True)
+        self.assertEqual(self._slugs('mug'), ['PY-Rocks'])
+
+class BestsellerTest(TestCase):
+    fixtures = ['l10n-data.yaml','sample-store-data.yaml', 'products.yaml', 'test-config.yaml']
+
+    def setUp(self):
+        self.site = Site.objects.get_current()
+        self.python = Product.objects.get(slug='PY-Rocks')
+        self.django = Product.objects.get(slug='dj-rocks')
+        self.computer = Product.objects.get(slug='satchmo-computer')
+
+    def tearDown(self):
+        keyedcache.cache_delete()
+        category_tree_changed()
+
+    def test_ranking(self):
+        self.assertEqual(bestsellers(5), [])
+        ProductSales.objects.record([(self.python.id, Decimal('1')),
+            (self.django.id, Decimal('3')), (self.python.id, Decimal('2'))])
+        self.assertEqual(bestsellers(5), [self.python, self.django])
+        self.assertEqual(bestsellers(1), [self.python])
+
+        earlier = datetime.date.today() - datetime.timedelta(days=40)
+        ProductSales.objects.record([(self.django.id, Decimal('1'))] * 2, day=earlier)
+        self.assertEqual(bestsellers(5), [self.django, self.python])
+        self.assertEqual(bestsellers(5, days=30), [self.python, self.django])
+        self.assertEqual(bestsellers(5, days=90), [self.django, self.python])
+
+        rank = ProductSalesRank.objects.get(product=self.python)
+        self.assertEqual(rank.items, 2)
+        self.assertEqual(rank.quantity, Decimal('3'))
+
+        category = Category.objects.create(slug='mugs', name='Mugs', site=self.site)
+        self.django.category.add(category)
+        self.assertEqual(bestsellers(5, category=category), [self.django])
+
+        self.django.active = False
+        self.django.save()
+        self.assertEqual(bestsellers(5), [self.python])
+
+class FeaturedTest(TestCase):
+    fixtures = ['l10n-data.yaml','sample-store-data.yaml', 'products.yaml', 'test-config.yaml']
+
+    def setUp(self):
+        self.site = Site.objects.get_current()
+        featured_changed(self.site.id)
+
+    def tearDown(self):
+        keyedcache.cache_delete()
+        featured_changed(self.site.id)
+
+    def test_random_featured(self):
+        featured = set(Product.objects.featured_by_site().values_list('pk', flat=True))
+        picked = random_featured(3, seed=42)
+        self.assertEqual(len(picked), 3)
+        self.assert_(set([p.pk for p in picked]) <= featured)
+        self.assertEqual(random_featured(3, seed=42), picked)
+        self.assertEqual(len(random_featured(100)), len(featured))
+
+        product = picked[0]
+        product.featured = False
+        product.save()
+        self.assertEqual(len(random_featured(100)), len(featured) - 1)
+        self.assert_(not product.pk in featured_pks())
+
+class TranslationPrefetchTest(TestCase):
+    fixtures = ['l10n-data.yaml','sample-store-data.yaml', 'products.yaml', 'test-config.yaml']
+
+    def tearDown(self):
+        keyedcache.cache_delete()
+
+    def test_prefetch(self):
+        python = Product.objects.get(slug='PY-Rocks')
+        django = Product.objects.get(slug='dj-rocks')
+        computer = Product.objects.get(slug='satchmo-computer')
+        ProductTranslation.objects.create(product=python, languagecode='fr-ca', name='Tasse v1', version=1)
+        ProductTranslation.objects.create(product=python, languagecode='fr-ca', name='Tasse', version=2)
+        ProductTranslation.objects.create(product=django, languagecode='fr', name='Chemise')
+        computer_name = computer.name
+
+        products = [Product.objects.get(pk=p.pk) for p in (python, django, computer)]
+        prefetch_translations(products, 'fr-ca')
+        # the translations come from the cache now
+        ProductTranslation.objects.all().delete()
+        self.assertEqual([p.translated_name('fr-ca') for p in products],
+            ['Tasse', 'Chemise', computer_name])
+
 def five_off(sender, adjustment=None, **kwargs):
     adjustment += PriceAdjustment('half', 'Half', amount=Decimal(5))
 
@@ -0,0 +1,143 @@
+"""
+A process wide snapshot of the category tree of each site.
+
+`Category.parents`, `get_all_children` and everything built on them used to
+walk the tree with a query per category, and `get_active_children` counted
+the active products of every child on top of that.  `CategoryTree` loads
+all the categories of a site and the number of active products in each of
+them with two queries, and keeps the materialized path of every category,
+so the ancestors, descendants, URL slugs and breadcrumbs are read from
+memory.
+
+Saving or deleting a category, deleting, activating or deactivating a product
+or moving it to another site, or changing the categories of a product, calls
+`category_tree_changed`, which bumps a `VersionKey` so that every process
+reloads its trees on the next lookup.
+"""
+from satchmo_utils.versionkey import VersionKey
+import copy
+import logging
+import threading
+import time
+
+log = logging.getLogger('product.tree')
+
+VERSION_KEY = 'product-category-tree-version'
+_VERSION = VersionKey(VERSION_KEY)
+
+class CategoryTree(object):
+    """The categories of a site, with the path from the root to each of them.
+
+    `paths` holds the ids from the root down to each category, or None when
+    the chain of parents leaves the site or loops.  `children` only lists the
+    active children, in the `Category` ordering, as `Category.child.active()`
+    would.
+    """
+
+    def __init__(self, site_id):
+        self.site_id = site_id
+        self.version = None
+        self.nodes = {}
+        self.children = {}
+        self.paths = {}
+        self.slugs = {}
+        self.counts = {}
+
+    def load(self):
+        from django.db.models import Count
+        from product.models import Category, Product
+
+        start = time.time()
+        self.version = _VERSION.current()
+
+        for cat in Category.objects.filter(site__id=self.site_id):
+            self.nodes[cat.id] = cat
+            self.children.setdefault(cat.id, [])
+            if cat.parent_id and cat.is_active:
+                self.children.setdefault(cat.parent_id, []).append(cat.id)
+
+        for pk in self.nodes:
+            self.paths[pk] = self._find_path(pk)
+            if self.paths[pk] is not None:
+                self.slugs[pk] = "/".join([self.nodes[node].slug for node in self.paths[pk]])
+
+        through = Product.category.through
+        counts = through.objects.filter(category__site__id=self.site_id,
+            product__site__id=self.site_id, product__active=True).order_by().values(
+            'category').annotate(count=Count('product'))
+        for row in counts:
+            self.counts[row['category']] = row['count']
+
+        log.debug('Loaded %i categories of site %s in %.2f seconds',
+            len(self.nodes), self.site_id, time.time() - start)
+
+    def _find_path(self, pk):
+        path = [pk]
+        parent = self.nodes[pk].parent_id
+        while parent:
+            if parent in path or not parent in self.nodes:
+                return None
+            path.append(parent)
+            parent = self.nodes[parent].parent_id
+        path.reverse()
+        return tuple(path)
+
+    def is_current(self):
+        return _VERSION.is_current(self.version)
+
+    def categories(self, ids):
+        """Return copies of the categories with `ids`, in the same order."""
+        return [copy.copy(self.nodes[pk]) for pk in ids]
+
+    def path(self, pk):
+        """Return the ids from the root down to category `pk`, or None."""
+        return self.paths.get(pk, None)
+
+    def slug_path(self, pk):
+        """Return the slugs from the root down to category `pk`, joined by
+        slashes, or None."""
+        return self.slugs.get(pk, None)
+
+    def product_count(self, pk):
+        """Return the number of active products directly in category `pk`."""
+        return self.counts.get(pk, 0)
+
+    def descendants(self, pk, only_active=False):
+        """Return the ids below category `pk`, depth first, or None if it
+        isn't in the tree.  With `only_active`, children without active
+        products are left out, together with everything below them."""
+        if not pk in self.nodes:
+            return None
+        found = []
+        seen = set([pk])
+        stack = list(reversed(self.children[pk]))
+        while stack:
+            child = stack.pop()
+            if child in seen or (only_active and not self.counts.get(child, 0)):
+                continue
+            seen.add(child)
+            found.append(child)
+            stack.extend(reversed(self.children[child]))
+        return found
+
+_TREES = {}
+_LOCK = threading.Lock()
+
+def get_category_tree(site_id):
+    """Return the process wide `CategoryTree` of the site, (re)loading it if needed."""
+    tree = _TREES.get(site_id, None)
+    if tree is None or not tree.is_current():
+        _LOCK.acquire()
+        try:
+            tree = CategoryTree(site_id)
+            tree.load()
+            _TREES[site_id] = tree
+        finally:
+            _LOCK.release()
+    return tree
+
+def category_tree_changed():
+    """Make all processes reload their category trees, call after changing
+    the categories or the products in them."""
+    _VERSION.changed()
+    _TREES.clear()
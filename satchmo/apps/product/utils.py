@@ -1,17 +1,27 @@
 from decimal import Decimal
 from django.contrib.sites.models import Site
+from django.db import connection, models, transaction
 from django.db.models import Q
-from livesettings import config_value
-from l10n.utils import moneyfmt
-from product.models import Option, ProductPriceLookup, OptionGroup, Discount, Product, split_option_unique_id
+from django.utils.encoding import smart_str
+from livesettings import config_value, SettingNotSet
+from l10n.utils import moneyfmt, prefetch_translations
+from product import active_product_types
+from product.models import Option, ProductPriceLookup, OptionGroup, Discount, Price, Product, split_option_unique_id, \
+    SUBTYPES_CACHE_KEY
+from satchmo_utils.db import bulk_insert, chunked, DEFAULT_CHUNK_SIZE
 from satchmo_utils.numbers import round_decimal
 import datetime
+import keyedcache
 import logging
+import time
 import types
 import string
 
 log = logging.getLogger('product.utils')
 
+LOOKUP_FIELDS = ('productslug', 'parentid', 'siteid', 'active', 'price', 'quantity', 'key',
+    'discountable', 'items_in_stock')
+
 def calc_discounted_by_percentage(price, percentage):
     if not percentage:
         return price
@@ -119,20 +129,229 @@ def productvariation_details(product, include_tax, user, create=False):
     return details
 
 def rebuild_pricing():
-    site = Site.objects.get_current()
-    for lookup in ProductPriceLookup.objects.filter(siteid=site.id):
-        lookup.delete()
+    builder = PriceLookupBuilder()
+    builder.rebuild()
+    return builder.productct, builder.pricect
+
+class PriceLookupBuilder(object):
+    """Set-based builder for the `ProductPriceLookup` table.
 
-    products = Product.objects.active_by_site(site=site, variations=False)
+    Builds exactly the same rows as calling
+    `ProductPriceLookup.objects.smart_create_for_product` on every active
+    product, but instead of several queries per product it:
 
-    productct = products.count()
-    pricect = 0
+     - deletes the old lookup rows for the site with a single statement,
+     - preloads products, subtypes, prices and variation options for a batch of
+       products with one query per model,
+     - writes the new rows with multi-row inserts of `chunk_size` rows.
 
-    for product in products:
-        prices = ProductPriceLookup.objects.smart_create_for_product(product)
-        pricect += len(prices)
+    `refresh(pks)` does the same for just a set of changed products.
 
-    return productct, pricect
+    After `rebuild()` or `refresh()`, `productct`, `pricect` and `elapsed`
+    hold the throughput numbers for the run.
+    """
+
+    def __init__(self, site=None, batch_size=500, chunk_size=DEFAULT_CHUNK_SIZE):
+        if not site:
+            site = Site.objects.get_current()
+        self.site = site
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.productct = 0
+        self.pricect = 0
+        self.elapsed = 0.0
+
+    def _rate(self):
+        if self.elapsed:
+            return self.productct / self.elapsed
+        return 0.0
+    rate = property(_rate)
+
+    def _rebuild(self):
+        """Delete and recreate every lookup row for the site."""
+        start = time.time()
+        cursor = connection.cursor()
+        cursor.execute("DELETE FROM %s WHERE siteid = %%s" % connection.ops.quote_name(ProductPriceLookup._meta.db_table),
+            [self.site.id])
+
+        pks = list(Product.objects.active_by_site(site=self.site, variations=False).order_by('id').values_list('id', flat=True))
+        for batch in chunked(pks, self.batch_size):
+            self._build(batch)
+
+        self.elapsed = time.time() - start
+        log.info('ProductPriceLookup built %i prices for %i products in %.2fs (%.1f products/s)',
+            self.pricect, self.productct, self.elapsed, self.rate)
+
+    rebuild = transaction.commit_on_success(_rebuild)
+
+    def refresh(self, pks):
+        """Recreate the lookup rows of just the products in `pks`, exactly as
+        `smart_create_for_product` would for each of them.  Ids of products
+        which no longer exist are ignored."""
+        start = time.time()
+        for batch in chunked(list(pks), self.batch_size):
+            products = self._load_products(batch)
+            roots = [p for p in products if not 'ProductVariation' in p.get_subtypes()]
+            variations = self._load_variations(roots)
+
+            # variations refreshed on their own still need their parent's prices
+            lone = [p.productvariation for p in products if 'ProductVariation' in p.get_subtypes()]
+            rootids = set([p.id for p in roots])
+            parents = Product.objects.in_bulk([pv.parent_id for pv in lone if pv.parent_id not in rootids])
+            load_subtypes(parents.values())
+            for pv in lone:
+                siblings = variations.setdefault(pv.parent_id, [])
+                if not pv.product_id in [sib.product_id for sib in siblings]:
+                    siblings.append(pv)
+
+            varproducts = [pv.product for pvs in variations.values() for pv in pvs]
+            slugs = {}
+            for p in roots + varproducts:
+                slugs.setdefault(p.site_id, []).append(p.slug)
+            for siteid, siteslugs in slugs.items():
+                for chunk in chunked(siteslugs, self.batch_size):
+                    ProductPriceLookup.objects.filter(siteid=siteid, productslug__in=chunk).delete()
+
+            self._write(roots + parents.values(), variations, roots + parents.values() + varproducts,
+                skip=parents.keys())
+            self.productct += len(products)
+
+        self.elapsed += time.time() - start
+
+    def _build(self, pks):
+        products = self._load_products(pks)
+        variations = self._load_variations(products)
+        allproducts = products + [pv.product for pvs in variations.values() for pv in pvs]
+        self._write(products, variations, allproducts)
+        self.productct += len(products)
+
+    def _load_products(self, pks):
+        products = Product.objects.in_bulk(pks)
+        products = [products[pk] for pk in pks if pk in products]
+        load_subtypes(products)
+        return products
+
+    def _write(self, products, variations, allproducts, skip=()):
+        """Write the lookup rows for `products` and their `variations`.  The
+        products with ids in `skip` only supply prices to their variations."""
+        prices = self._load_prices(allproducts)
+        options = self._load_options(variations)
+
+        rows = []
+        for product in products:
+            pricelist = self._price_list(product, prices)
+            if not product.id in skip:
+                rows.extend(self._rows(product, pricelist))
+            for pv in variations.get(product.id, []):
+                if pv.product_id in prices:
+                    varlist = self._price_list(pv.product, prices)
+                else:
+                    delta = options.get(pv.product_id, ('', Decimal('0.00')))[1]
+                    varlist = [(qty, price+delta) for qty, price in pricelist]
+                key = options.get(pv.product_id, ('', None))[0]
+                rows.extend(self._rows(pv.product, varlist, parent=product, key=key))
+
+        self.pricect += bulk_insert(ProductPriceLookup, LOOKUP_FIELDS, rows, chunk_size=self.chunk_size)
+
+    def _load_variations(self, products):
+        """Map configurable product ids to their active `ProductVariation` objects."""
+        work = {}
+        parents = [p.id for p in products if 'ConfigurableProduct' in p.get_subtypes()]
+        ProductVariation = models.get_model('configurable', 'ProductVariation')
+        if not parents or ProductVariation is None:
+            return work
+
+        pvs = ProductVariation.objects.filter(parent__in=parents, product__active='1').select_related('product')
+        for pv in pvs:
+            work.setdefault(pv.parent_id, []).append(pv)
+        load_subtypes([pv.product for pvs in work.values() for pv in pvs])
+        return work
+
+    def _load_prices(self, products):
+        """Map product ids to their unexpired `Price` objects, in `Price` default order."""
+        work = {}
+        prices = Price.objects.filter(product__in=[p.id for p in products]).exclude(
+            expires__isnull=False,
+            expires__lt=datetime.date.today())
+        for price in prices:
+            work.setdefault(price.product_id, []).append(price)
+        return work
+
+    def _load_options(self, variations):
+        """Map variation ids to their (optionkey, price_delta)."""
+        work = {}
+        pks = [pv.product_id for pvs in variations.values() for pv in pvs]
+        if not pks:
+            return work
+
+        through = models.get_model('configurable', 'ProductVariation')._meta.get_field('options').rel.through
+        options = through.objects.filter(productvariation__in=pks).order_by(
+            'productvariation', 'option__option_group__id').values_list(
+            'productvariation', 'option__value', 'option__price_change')
+        for pk, value, price_change in options:
+            keys, delta = work.get(pk, ([], Decimal('0.00')))
+            keys.append(smart_str(value))
+            if price_change:
+                delta += Decimal(price_change)
+            work[pk] = (keys, delta)
+
+        for pk, (keys, delta) in work.items():
+            work[pk] = ("::".join(keys), delta)
+        return work
+
+    def _price_list(self, product, prices):
+        return [(price.quantity, price.adjustments(product).final_price())
+            for price in prices.get(product.id, [])]
+
+    def _rows(self, product, pricelist, parent=None, key=None):
+        if parent is None:
+            parentid = None
+        else:
+            parentid = parent.pk
+        discountable = product.is_discountable
+        return [(product.slug, parentid, product.site_id, product.active, price, qty, key,
+            discountable, product.items_in_stock) for qty, price in pricelist]
+
+def load_subtypes(products):
+    """Resolve `get_subtypes()` for a list of products with one query per
+    product module, and cache the subtype objects on each product.
+
+    When the subtype names of all the products are in the cache, only the
+    modules of those subtypes are queried.
+    """
+    work = dict([(p.id, []) for p in products])
+    byid = dict([(p.id, p) for p in products])
+
+    names = set()
+    for pk in byid.keys():
+        try:
+            names.update(keyedcache.cache_get(SUBTYPES_CACHE_KEY, pk))
+        except keyedcache.NotCachedError:
+            names = None
+            break
+
+    try:
+        for module, subtype in active_product_types():
+            if names is not None and not subtype in names:
+                continue
+            model = models.get_model(module.split('.')[-1], subtype)
+            if model is None:
+                continue
+            for obj in model._default_manager.filter(pk__in=byid.keys()):
+                product = byid[obj.pk]
+                setattr(product, subtype.lower(), obj)
+                obj.product = product
+                name = obj._get_subtype()
+                if not name in work[obj.pk]:
+                    work[obj.pk].append(name)
+    except SettingNotSet:
+        log.warn("Error getting subtypes, OK if in SyncDB")
+        names = ()
+
+    for pk, types in work.items():
+        byid[pk]._sub_types = tuple(types)
+        if names is None:
+            keyedcache.cache_set(SUBTYPES_CACHE_KEY, pk, value=byid[pk]._sub_types)
 
 def serialize_options(product, selected_options=()):
     """
@@ -182,11 +401,20 @@ def serialize_options(product, selected_options=()):
                     groups[k] = False
                     opts[option] = None
 
-        for option in Option.objects.filter(option_group__id__in = groups.keys(), value__in = vals.keys()):
+        for option in Option.objects.filter(option_group__id__in = groups.keys(),
+            value__in = vals.keys()).select_related('option_group'):
             uid = option.unique_id
             if opts.has_key(uid):
                 opts[uid] = option
 
+        # one instance per group, and the translations of all of them at once
+        groupdict = {}
+        for option in opts.values():
+            if option is not None:
+                option.option_group = groupdict.setdefault(option.option_group_id, option.option_group)
+        prefetch_translations([option for option in opts.values() if option is not None])
+        prefetch_translations(groupdict.values())
+
         # now we have all the objects in our "opts" dictionary, so build the serialization dict
 
         for option in opts.values():
@@ -6,10 +6,11 @@ from django.shortcuts import get_object_or_404, render_to_response
 from django.template import RequestContext
 from django.template.loader import select_template
 from django.utils.translation import ugettext as _
-from l10n.utils import moneyfmt
+from l10n.utils import moneyfmt, prefetch_translations
 from livesettings import config_value
 from product.models import Category, Product
 from product.modules.configurable.models import ConfigurableProduct, sorted_tuple
+from product.queries import random_featured
 from product.signals import index_prerender
 from product.utils import find_best_auto_discount
 from satchmo_utils.json import json_encode
@@ -69,6 +70,8 @@ def category_view(request, slug, parent_slugs='', template='product/category.htm
         return bad_or_missing(request, _('The category you have requested does not exist.'))
 
     child_categories = category.get_all_children()
+    prefetch_translations([category] + list(child_categories))
+    prefetch_translations(products)
 
     ctx = {
         'category': category,
@@ -80,21 +83,22 @@ def category_view(request, slug, parent_slugs='', template='product/category.htm
     return render_to_response(template, context_instance=RequestContext(request, ctx))
 
 
-def display_featured(num_to_display=None, random_display=None):
+def display_featured(num_to_display=None, random_display=None, seed=None):
     """
     Used by the index generic view to choose how the featured products are displayed.
-    Items can be displayed randomly or all in order
+    Items can be displayed randomly or all in order.  Random picks with the
+    same `seed` come out the same, so they can be paginated.
     """
     if num_to_display is None:
         num_to_display = config_value('PRODUCT','NUM_DISPLAY')
     if random_display is None:
         random_display = config_value('PRODUCT','RANDOM_FEATURED')
 
-    q = Product.objects.featured_by_site()
     if not random_display:
+        q = Product.objects.featured_by_site()
         return q[:num_to_display]
     else:
-        return q.order_by('?')[:num_to_display]
+        return random_featured(num_to_display, seed=seed)
 
 def get_configurable_product_options(request, id):
     """Used by admin views"""
@@ -9,13 +9,14 @@ import logging
         
 log = logging.getLogger('product.views.filters')
     
-def display_bestsellers(request, count=0, template='product/best_sellers.html'):
-    """Display a list of the products which have sold the most"""
+def display_bestsellers(request, count=0, days=None, template='product/best_sellers.html'):
+    """Display a list of the products which have sold the most, in the last
+    `days` days if given"""
     if count == 0:
         count = config_value('PRODUCT','NUM_PAGINATED')
     
     ctx = RequestContext(request, {
-        'products' : bestsellers(count),
+        'products' : bestsellers(count, days=days),
     })
     return render_to_response(template, context_instance=ctx)
         
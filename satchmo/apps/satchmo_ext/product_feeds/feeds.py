@@ -0,0 +1,198 @@
+"""
+Streamed product feeds.
+
+A feed template such as ``product_feeds/googlebase_atom.xml`` is split into
+``googlebase_atom_header.xml``, ``googlebase_atom_entry.xml`` and
+``googlebase_atom_footer.xml``.  `ProductFeed` renders the header, then one
+entry per product, then the footer, and yields them one at a time, so a view
+can stream the feed and `satchmo_build_feeds` can write it to a file without
+the whole catalog in memory.  Products are loaded in chunks ordered by pk,
+with their subtypes, images and attributes loaded for the whole chunk at
+once.
+
+`write_feed` keeps the rendered entries next to the gzipped feed file, so
+the next build only needs to render the products which changed.
+
+A site which overrides the complete template, instead of the three parts,
+still gets it rendered in one piece.
+"""
+from django.core import urlresolvers
+from django.template import Context, TemplateDoesNotExist
+from django.template.loader import get_template
+from django.utils.encoding import smart_str
+from payment.config import credit_choices
+from product.models import Product, ProductAttribute, ProductImage
+from product.utils import load_subtypes
+from satchmo_store.shop.models import Config
+import datetime
+import gzip
+import logging
+import os
+import shelve
+
+log = logging.getLogger('product_feeds.feeds')
+
+CHUNK_SIZE = 200
+
+# the feeds satchmo_build_feeds writes, and their file names
+FEEDS = {
+    'googlebase' : ('product_feeds/googlebase_atom.xml', 'googlebase.xml'),
+    'csv' : ('product_feeds/product_feed.csv', 'products.csv'),
+}
+
+def template_parts(template):
+    """Return the names of the header, entry and footer templates of `template`."""
+    base, ext = os.path.splitext(template)
+    return ['%s_%s%s' % (base, part, ext) for part in ('header', 'entry', 'footer')]
+
+def feed_product_query(category=None, site=None):
+    """The products listed in a feed: the active products, or the active
+    products in `category`, which aren't configurable products."""
+    if category:
+        products = category.active_products()
+    else:
+        products = Product.objects.active_by_site(site=site)
+    return products.filter(configurableproduct__isnull=True)
+
+class ProductFeed(object):
+    """Renders a feed of the products of `category`, or of all products.
+
+    Iterating over a feed yields its rendered text a piece at a time.
+    """
+
+    def __init__(self, template, category=None, site=None, chunk_size=CHUNK_SIZE):
+        self.template = template
+        self.category = category
+        self.site = site
+        self.chunk_size = chunk_size
+        self.header, self.entry, self.footer = [get_template(name) for name in template_parts(template)]
+        self.context = self._context()
+
+    def _context(self):
+        shop_config = Config.objects.get_current()
+        params = {}
+        view = 'satchmo_atom_feed'
+        if self.category:
+            params['category'] = self.category.slug
+            view = 'satchmo_atom_category_feed'
+
+        return {
+            'category' : self.category,
+            'url' : shop_config.base_url + urlresolvers.reverse(view, None, params),
+            'shop' : shop_config,
+            'payments' : [c[1] for c in credit_choices(None, True)],
+            'date' : datetime.datetime.now(),
+        }
+
+    def pks(self):
+        """Return the ids of the products in the feed, in order."""
+        return list(feed_product_query(category=self.category, site=self.site
+            ).order_by('pk').values_list('pk', flat=True))
+
+    def products(self, pks=None):
+        """Yield the products in the feed, or the ones with `pks`, in pk order,
+        with their `feed_images` and `feed_attributes` lists set."""
+        if pks is None:
+            pks = self.pks()
+        else:
+            pks = sorted(pks)
+
+        for start in range(0, len(pks), self.chunk_size):
+            chunk = pks[start:start + self.chunk_size]
+            productdict = Product.objects.in_bulk(chunk)
+            load_subtypes(productdict.values())
+            images = {}
+            for image in ProductImage.objects.filter(product__in=chunk):
+                images.setdefault(image.product_id, []).append(image)
+            attributes = {}
+            for attribute in ProductAttribute.objects.filter(product__in=chunk).select_related('option'):
+                attributes.setdefault(attribute.product_id, []).append(attribute)
+
+            for pk in chunk:
+                product = productdict.get(pk, None)
+                if product is None:
+                    continue
+                product.feed_images = images.get(pk, [])
+                product.feed_attributes = attributes.get(pk, [])
+                yield product
+
+    def render_header(self):
+        return self.header.render(Context(self.context))
+
+    def render_entry(self, product):
+        context = Context(self.context)
+        context.update({
+            'product' : product,
+            'images' : product.feed_images,
+            'attributes' : product.feed_attributes,
+        })
+        return self.entry.render(context)
+
+    def render_footer(self):
+        return self.footer.render(Context(self.context))
+
+    def entries(self, pks=None):
+        """Yield the pk and the rendered entry of each product."""
+        for product in self.products(pks=pks):
+            yield product.pk, self.render_entry(product)
+
+    def __iter__(self):
+        yield self.render_header()
+        for pk, entry in self.entries():
+            yield entry
+        yield self.render_footer()
+
+def get_feed(template, category=None, site=None, chunk_size=CHUNK_SIZE):
+    """Return a `ProductFeed` for `template`, or None if there are no header,
+    entry and footer templates for it, or the complete template is overridden."""
+    try:
+        get_template(template)
+        return None
+    except TemplateDoesNotExist:
+        pass
+    try:
+        return ProductFeed(template, category=category, site=site, chunk_size=chunk_size)
+    except TemplateDoesNotExist:
+        return None
+
+def write_feed(feed, path, changed=None):
+    """Write `feed` gzipped to `path`.
+
+    The rendered entries are kept in a shelf at `path` + ".entries".  With
+    `changed`, a list of product ids, only those products and the ones
+    missing from the shelf are rendered, the others are copied from it.
+    Without, every entry is rendered again.
+
+    Returns the number of products in the feed and the number rendered.
+    """
+    if changed is None:
+        store = shelve.open(path + '.entries', flag='n')
+    else:
+        store = shelve.open(path + '.entries', flag='c')
+    try:
+        for pk in changed or []:
+            if str(pk) in store:
+                del store[str(pk)]
+
+        pks = feed.pks()
+        missing = [pk for pk in pks if not str(pk) in store]
+        for pk, entry in feed.entries(pks=missing):
+            store[str(pk)] = smart_str(entry)
+
+        tmp = path + '.tmp'
+        out = gzip.open(tmp, 'wb')
+        try:
+            out.write(smart_str(feed.render_header()))
+            for pk in pks:
+                entry = store.get(str(pk), None)
+                if entry is not None:
+                    out.write(entry)
+            out.write(smart_str(feed.render_footer()))
+        finally:
+            out.close()
+        os.rename(tmp, path)
+    finally:
+        store.close()
+
+    log.debug('Wrote %i products to %s, rendered %i', len(pks), path, len(missing))
+    return len(pks), len(missing)
@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+from satchmo_ext.product_feeds.feeds import CHUNK_SIZE, FEEDS, get_feed, write_feed
+from satchmo_ext.product_feeds.models import ProductFeedChange
+from satchmo_store.shop import get_satchmo_setting
+import os
+import time
+
+class Command(BaseCommand):
+    help = ("Writes gzipped product feeds to the PRODUCT_FEED_DIR in SATCHMO_SETTINGS. "
+            "Feeds: %s, default all." % ", ".join(sorted(FEEDS.keys())))
+    args = ['feed...']
+
+    option_list = BaseCommand.option_list + (
+        make_option('--incremental', dest='incremental', action='store_true', default=False,
+            help='Only render the products which changed since the last build.'),
+        make_option('--chunk-size', dest='chunk_size', type='int', default=CHUNK_SIZE,
+            help='Number of products loaded per batch of queries.'),
+    )
+
+    requires_model_validation = True
+
+    def handle(self, *names, **options):
+        verbosity = int(options.get('verbosity', 1))
+        incremental = options.get('incremental', False)
+        chunk_size = options.get('chunk_size') or CHUNK_SIZE
+
+        directory = get_satchmo_setting('PRODUCT_FEED_DIR')
+        if not directory:
+            raise CommandError("Set PRODUCT_FEED_DIR in SATCHMO_SETTINGS to build the product feeds")
+        # the changes are only used up when every feed is built
+        allfeeds = not names
+        if allfeeds:
+            names = sorted(FEEDS.keys())
+
+        changes = list(ProductFeedChange.objects.order_by('id').values_list('id', 'productid'))
+        changed = set([pk for changeid, pk in changes])
+
+        for name in names:
+            if not name in FEEDS:
+                print "Warning: Unknown feed '%s'" % name
+                continue
+            template, filename = FEEDS[name]
+            feed = get_feed(template, chunk_size=chunk_size)
+            if feed is None:
+                print "Warning: The template for feed '%s' is overridden as a whole, it can't be built" % name
+                continue
+
+            path = os.path.join(directory, filename) + '.gz'
+            start = time.time()
+            if incremental and os.path.exists(path):
+                ct, rendered = write_feed(feed, path, changed=changed)
+            else:
+                ct, rendered = write_feed(feed, path)
+
+            if verbosity > 0:
+                print "Wrote %i products to %s, rendered %i, in %.2fs" % (ct, path, rendered, time.time() - start)
+
+        if allfeeds and changes:
+            # changes recorded while we were working have higher ids and stay
+            ProductFeedChange.objects.filter(id__lte=changes[-1][0]).delete()
@@ -1,5 +1,35 @@
+from django.db import models
+from django.db.models.signals import post_delete, post_save
+from product.models import Price, Product, ProductAttribute, ProductImage
 from signals_ahoy.signals import collect_urls
 from satchmo_store import shop
+from satchmo_store.shop import get_satchmo_setting
 from urls import add_feed_urls
 
+class ProductFeedChange(models.Model):
+    """
+    A product whose feed entries are out of date.  Recorded while a
+    `PRODUCT_FEED_DIR` is set, so that `satchmo_build_feeds --incremental`
+    only renders the products which changed since the last build.  A product
+    may be recorded more than once.
+    """
+    productid = models.IntegerField()
+    marked = models.DateTimeField(auto_now_add=True)
+
+def feed_change_listener(sender, instance=None, **kwargs):
+    """Records a changed product, connected to post_save and post_delete for
+    `Product` and the models it is rendered from."""
+    if not get_satchmo_setting('PRODUCT_FEED_DIR'):
+        return
+    if isinstance(instance, Product):
+        pk = instance.pk
+    else:
+        pk = instance.product_id
+    if pk:
+        ProductFeedChange.objects.create(productid=pk)
+
+for model in (Product, Price, ProductAttribute, ProductImage):
+    post_save.connect(feed_change_listener, sender=model)
+    post_delete.connect(feed_change_listener, sender=model)
+
 collect_urls.connect(add_feed_urls, sender=shop)
@@ -2,7 +2,12 @@ from django.conf import settings
 from django.core import urlresolvers
 from django.test import TestCase
 from product.models import Product
+from satchmo_ext.product_feeds.feeds import FEEDS, get_feed, write_feed
+import gzip
 import keyedcache
+import os
+import shutil
+import tempfile
 
 domain = 'http://example.com'
 
@@ -24,3 +29,25 @@ class GoogleBaseTest(TestCase):
         producturl = product.get_absolute_url()
         self.assertContains(response,
             "<link href=\"%s%s\" />" % (domain, producturl), count=1, status_code=200)
+
+    def test_write_feed(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'googlebase.xml.gz')
+            feed = get_feed(FEEDS['googlebase'][0], chunk_size=2)
+            ct, rendered = write_feed(feed, path)
+            self.assertEqual(ct, rendered)
+            content = gzip.open(path).read()
+            self.assertEqual(content.count("<entry>"), ct)
+            self.assert_("<title>Robots Attack! (Hard cover)</title>" in content)
+
+            product = Product.objects.get(slug='robot-attack-hard')
+            product.name = 'Robots Retreat'
+            product.save()
+            ct, rendered = write_feed(feed, path, changed=[product.pk])
+            self.assertEqual(rendered, 1)
+            content = gzip.open(path).read()
+            self.assertEqual(content.count("<entry>"), ct)
+            self.assert_("<title>Robots Retreat</title>" in content)
+        finally:
+            shutil.rmtree(directory)
@@ -1,10 +1,11 @@
 import datetime
 from django.contrib.auth.decorators import user_passes_test
 from django.core import urlresolvers
-from django.http import Http404
+from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404, render_to_response
 from payment.config import credit_choices
 from product.models import Product, Category
+from satchmo_ext.product_feeds.feeds import feed_product_query, get_feed
 from satchmo_store.shop.models import Config
 from django.utils.translation import ugettext_lazy as _
 
@@ -16,20 +17,24 @@ def admin_product_feed(request, category=None, template="product_feeds/product_f
 
 def product_feed(request, category=None, template="product_feeds/googlebase_atom.xml", mimetype="application/atom+xml"):
     """Build a feed of all active products.
+
+    The feed is streamed an entry at a time, see `satchmo_ext.product_feeds.feeds`.
     """
 
     shop_config = Config.objects.get_current()
     if category:
         try:
             cat = Category.objects.active().get(slug=category)
-            products = cat.active_products()
         except Category.DoesNotExist:
             raise Http404, _("Bad Category: %s" % category)
     else:
         cat = None
-        products = Product.objects.active_by_site()
-        
-    products = filter(lambda product:"ConfigurableProduct" not in product.get_subtypes(), products)
+
+    feed = get_feed(template, category=cat)
+    if feed is not None:
+        return HttpResponse(iter(feed), mimetype=mimetype)
+
+    products = feed_product_query(category=cat)
     
     params = {}
     view = 'satchmo_atom_feed'
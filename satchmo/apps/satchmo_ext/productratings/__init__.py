@@ -1,7 +1,15 @@
 from django.contrib.comments.models import Comment
 from django.contrib.comments.signals import comment_will_be_posted, comment_was_posted
+from django.db.models.signals import post_delete, post_save, post_syncdb
 from listeners import *
+import models
 
 comment_was_posted.connect(save_rating, sender=Comment)
 comment_was_posted.connect(one_rating_per_product, sender=Comment)
 comment_was_posted.connect(check_with_akismet, sender=Comment)
+
+for model in (Comment, ProductRating):
+    post_save.connect(update_rating_summary, sender=model)
+    post_delete.connect(update_rating_summary, sender=model)
+
+post_syncdb.connect(create_rating_summaries, sender=models)
@@ -15,3 +15,10 @@ AKISMET = config_register(
         description= _("Akismet API Key"),
         requires=ENABLE_AKISMET,
         default=""))
+
+RATING_PRIOR_WEIGHT = config_register(
+    IntegerValue(PRODUCT_GROUP,
+        'RATING_PRIOR_WEIGHT',
+        description= _("Rating prior weight"),
+        help_text= _("When ranking the highest rated products, count this many extra ratings at the store's average rating for every product, so that products with only a few ratings don't rank first.  0 ranks by the plain average.  Takes effect with the next rating, or after running satchmo_rebuild_ratings."),
+        default=0))
@@ -4,7 +4,7 @@ from django.contrib.sites.models import Site
 from django.core import urlresolvers
 from django.utils.encoding import smart_str
 from livesettings import config_value
-from models import ProductRating
+from models import ProductRating, ProductRatingSummary
 from product.models import Product
 from satchmo_utils import url_join
 import logging
@@ -45,6 +45,38 @@ def save_rating(comment=None, request=None, **kwargs):
     else:
         log.debug('Not saving rating for comment on a %s object', comment.content_type.model)
     
+def update_rating_summary(sender, instance=None, **kwargs):
+    """Recount the ratings of the product a comment or a rating belongs to.
+
+    Connected to post_save and post_delete for `Comment` and `ProductRating`.
+    """
+    if isinstance(instance, ProductRating):
+        try:
+            instance = instance.comment
+        except Comment.DoesNotExist:
+            return
+
+    if instance.content_type.app_label == "product" and instance.content_type.model == "product":
+        try:
+            product_id = int(instance.object_pk)
+        except ValueError:
+            return
+        ProductRatingSummary.objects.update_product(product_id, instance.site_id)
+
+def create_rating_summaries(sender, verbosity=1, **kwargs):
+    """Summarize the ratings of a store which already had ratings when
+    `ProductRatingSummary` was added.
+
+    Connected to post_syncdb, so the syncdb which creates the table fills
+    it.  Afterwards the table is kept up to date by `update_rating_summary`,
+    and `satchmo_rebuild_ratings` rebuilds it.
+    """
+    if ProductRatingSummary.objects.count() or not ProductRating.objects.filter(rating__gt=0).count():
+        return
+    ct = ProductRatingSummary.objects.rebuild()
+    if verbosity > 0:
+        print "Summarized the ratings of %i products" % ct
+
 def one_rating_per_product(comment=None, request=None, **kwargs):
     site = Site.objects.get_current()
     comments = Comment.objects.filter(object_pk__exact=comment.object_pk,
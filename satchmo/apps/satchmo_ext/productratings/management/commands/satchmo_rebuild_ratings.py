@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from optparse import make_option
+from satchmo_ext.productratings.models import ProductRatingSummary
+from satchmo_utils.db import DEFAULT_CHUNK_SIZE
+import time
+
+class Command(BaseCommand):
+    help = "Rebuilds the product rating summaries from the rated comments."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk-size', dest='chunk_size', type='int', default=DEFAULT_CHUNK_SIZE,
+            help='Number of summary rows written per INSERT statement.'),
+    )
+
+    requires_model_validation = True
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get('verbosity', 1))
+        chunk_size = options.get('chunk_size') or DEFAULT_CHUNK_SIZE
+        start = time.time()
+        ct = ProductRatingSummary.objects.rebuild(chunk_size=chunk_size)
+
+        if verbosity > 0:
+            print "Summarized the ratings of %i products in %.2fs" % (ct, time.time() - start)
@@ -1,6 +1,11 @@
 from django.contrib.comments.models import Comment
-from django.db import models
+from django.contrib.sites.models import Site
+from django.db import models, transaction
+from django.db.models import Count, F, Sum
 from django.utils.translation import ugettext, ugettext_lazy as _
+from livesettings import config_value_safe
+from product.models import Product
+from satchmo_utils.db import bulk_insert, DEFAULT_CHUNK_SIZE
 from signals_ahoy.signals import collect_urls
 import product
 import satchmo_store
@@ -10,6 +15,101 @@ class ProductRating(models.Model):
     comment = models.OneToOneField(Comment, verbose_name="Rating", primary_key=True)
     rating = models.IntegerField(_("Rating"))
 
+def _rated_comments(**kwargs):
+    """The ratings of the public comments on products, above zero."""
+    return ProductRating.objects.filter(comment__content_type__app_label__exact='product',
+        comment__content_type__model__exact='product', comment__is_public__exact=True,
+        rating__gt=0, **kwargs)
+
+class ProductRatingSummaryManager(models.Manager):
+
+    def update_product(self, product_id, site_id):
+        """Recount the ratings of a product on a site, and rescore the site."""
+        totals = _rated_comments(comment__object_pk=str(product_id),
+            comment__site__id__exact=site_id).aggregate(count=Count('rating'), total=Sum('rating'))
+        count = totals['count'] or 0
+        total = totals['total'] or 0
+
+        if count:
+            average = float(total) / count
+            updated = self.filter(product__id=product_id, site__id=site_id).update(
+                count=count, total=total, average=average)
+            if not updated:
+                self.create(product_id=product_id, site_id=site_id,
+                    count=count, total=total, average=average, score=average)
+        else:
+            self.filter(product__id=product_id, site__id=site_id).delete()
+        self.update_scores(site_id)
+
+    def update_scores(self, site_id):
+        """Set the Bayesian score of every rated product of a site.
+
+        The score is the average of the product's ratings after adding
+        `PRODUCT.RATING_PRIOR_WEIGHT` ratings at the site's mean rating, so a
+        product with a couple of high ratings doesn't outrank one with many
+        good ratings.  With a weight of 0 it is the plain average.
+        """
+        qs = self.filter(site__id=site_id)
+        weight = config_value_safe('PRODUCT', 'RATING_PRIOR_WEIGHT', 0)
+        if weight > 0:
+            totals = qs.aggregate(count=Sum('count'), total=Sum('total'))
+            if totals['count']:
+                mean = float(totals['total']) / totals['count']
+                qs.update(score=(F('total') + weight * mean) / (F('count') + float(weight)))
+                return
+        qs.update(score=F('average'))
+
+    def _rebuild(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Recount the ratings of all products with a single aggregate query.
+        Returns the number of rated products."""
+        products = set(Product.objects.values_list('pk', flat=True))
+        rows = []
+        for row in _rated_comments().values('comment__object_pk', 'comment__site').annotate(
+            count=Count('rating'), total=Sum('rating')).order_by():
+            try:
+                pk = int(row['comment__object_pk'])
+            except ValueError:
+                continue
+            if not pk in products:
+                continue
+            average = float(row['total']) / row['count']
+            rows.append((pk, row['comment__site'], row['count'], row['total'], average, average))
+
+        self.all().delete()
+        bulk_insert(ProductRatingSummary, ('product', 'site', 'count', 'total', 'average', 'score'),
+            rows, chunk_size=chunk_size)
+        for site_id in set([row[1] for row in rows]):
+            self.update_scores(site_id)
+        return len(rows)
+
+    rebuild = transaction.commit_on_success(_rebuild)
+
+    def top(self, count, site=None):
+        """Return the ids of the `count` active products of `site` with the
+        best score, best first."""
+        if site is None:
+            site = Site.objects.get_current()
+        qs = self.filter(site=site, product__active=True).order_by('-score', '-product')
+        return list(qs.values_list('product', flat=True)[:count])
+
+class ProductRatingSummary(models.Model):
+    """
+    The count, sum and average of the public ratings of a product on a site,
+    and its Bayesian score.  Kept up to date by `update_rating_summary`, and
+    rebuilt by `satchmo_rebuild_ratings`.
+    """
+    product = models.ForeignKey(Product)
+    site = models.ForeignKey(Site)
+    count = models.IntegerField(default=0)
+    total = models.IntegerField(default=0)
+    average = models.FloatField(default=0)
+    score = models.FloatField(default=0, db_index=True)
+
+    objects = ProductRatingSummaryManager()
+
+    class Meta:
+        unique_together = ('product', 'site')
+
 import config
 from urls import add_product_urls, add_comment_urls
 collect_urls.connect(add_product_urls, sender=product)
@@ -1,6 +1,7 @@
 from django import template
 from django.template.loader import render_to_string
 from livesettings import config_value
+from satchmo_ext.productratings.queries import sort_by_rating
 from satchmo_ext.productratings.utils import get_product_rating_string, get_product_rating
 import logging
 
@@ -40,3 +41,15 @@ def product_rating_average(product):
     return get_product_rating(product)
 
 register.filter("product_rating_average", product_rating_average)
+
+def product_sort_by_rating(products):
+    """
+    Sort a product list by rating, best first
+
+    Example::
+
+        {% for product in products|product_sort_by_rating %}
+    """
+    return sort_by_rating(products)
+
+register.filter("product_sort_by_rating", product_sort_by_rating)
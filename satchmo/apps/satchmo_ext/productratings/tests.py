@@ -0,0 +1,119 @@
+from django.contrib.comments.models import Comment
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sites.models import Site
+from django.test import TestCase
+from keyedcache import cache_delete
+from livesettings import config_get
+from product.models import Product
+from satchmo_ext.productratings.listeners import create_rating_summaries
+from satchmo_ext.productratings.models import ProductRating, ProductRatingSummary
+from satchmo_ext.productratings.queries import highest_rated
+from satchmo_ext.productratings.templatetags.satchmo_ratings import product_sort_by_rating
+from satchmo_ext.productratings.utils import get_product_rating, get_product_rating_string
+
+class RatingSummaryTest(TestCase):
+    fixtures = ['l10n-data.yaml', 'sample-store-data.yaml', 'products.yaml', 'test-config.yaml']
+
+    def setUp(self):
+        self.site = Site.objects.get_current()
+        self.products = list(Product.objects.filter(active=True).order_by('id')[:4])
+        self.assertEqual(len(self.products), 4)
+
+    def tearDown(self):
+        cache_delete()
+
+    def _rate(self, product, rating, is_public=True):
+        comment = Comment.objects.create(content_type=ContentType.objects.get_for_model(Product),
+            object_pk=str(product.pk), site=self.site, user_name='Tester', comment='Rated',
+            is_public=is_public)
+        ProductRating.objects.create(comment=comment, rating=rating)
+        return comment
+
+    def _summary(self, product):
+        return ProductRatingSummary.objects.get(product=product, site=self.site)
+
+    def _rate_all(self):
+        first, second, third, unrated = self.products
+        self._rate(first, 5)
+        for rating in (5, 5, 4, 4):
+            self._rate(second, rating)
+        for rating in (1, 1):
+            self._rate(third, rating)
+
+    def test_listener(self):
+        product = self.products[0]
+        self.assertEqual(get_product_rating(product), None)
+        self.assertEqual(get_product_rating_string(product), 'Not Rated')
+
+        first = self._rate(product, 4)
+        self._rate(product, 2)
+        summary = self._summary(product)
+        self.assertEqual((summary.count, summary.total, summary.average), (2, 6, 3.0))
+        self.assertEqual(get_product_rating(product), 3.0)
+        self.assertEqual(get_product_rating_string(product), '3/5')
+
+        # ratings of 0 and private comments are left out
+        self._rate(product, 0)
+        self._rate(product, 5, is_public=False)
+        self.assertEqual(self._summary(product).count, 2)
+
+        first.is_public = False
+        first.save()
+        self.assertEqual(get_product_rating(product), 2.0)
+
+        Comment.objects.filter(object_pk=str(product.pk), is_public=True).delete()
+        self.assertEqual(get_product_rating(product), None)
+        self.assertEqual(ProductRatingSummary.objects.filter(product=product).count(), 0)
+
+    def test_scores(self):
+        first, second, third, unrated = self.products
+        self._rate_all()
+        self.assertEqual(highest_rated(), [first, second, third])
+        self.assertEqual(highest_rated(count=1), [first])
+
+        # a prior weight ranks the many good ratings above the single best one
+        weight = config_get('PRODUCT', 'RATING_PRIOR_WEIGHT')
+        weight.update(2)
+        try:
+            ProductRatingSummary.objects.update_scores(self.site.id)
+            self.assertEqual(highest_rated(), [second, first, third])
+            mean = 25.0 / 7
+            self.assertAlmostEqual(self._summary(first).score, (5 + 2 * mean) / 3)
+            self.assertEqual(self._summary(first).average, 5.0)
+        finally:
+            weight.update(0)
+
+        ProductRatingSummary.objects.update_scores(self.site.id)
+        self.assertEqual(highest_rated(), [first, second, third])
+
+        # inactive products aren't ranked
+        Product.objects.filter(pk=first.pk).update(active=False)
+        self.assertEqual(highest_rated(), [second, third])
+
+    def test_rebuild(self):
+        self._rate_all()
+        self._rate(self.products[3], 0)
+        expected = list(ProductRatingSummary.objects.order_by('product').values_list(
+            'product', 'count', 'total', 'average', 'score'))
+        self.assertEqual(len(expected), 3)
+
+        ProductRatingSummary.objects.all().delete()
+        self.assertEqual(ProductRatingSummary.objects.rebuild(), 3)
+        self.assertEqual(list(ProductRatingSummary.objects.order_by('product').values_list(
+            'product', 'count', 'total', 'average', 'score')), expected)
+
+        # the syncdb creating the table fills it, but leaves a filled one alone
+        ProductRatingSummary.objects.all().delete()
+        create_rating_summaries(None, verbosity=0)
+        self.assertEqual(ProductRatingSummary.objects.count(), 3)
+        ProductRatingSummary.objects.filter(product=self.products[0]).update(count=10)
+        create_rating_summaries(None, verbosity=0)
+        self.assertEqual(self._summary(self.products[0]).count, 10)
+
+    def test_sort_filter(self):
+        first, second, third, unrated = self.products
+        self._rate_all()
+        self.assertEqual(product_sort_by_rating([unrated, third, second, first]),
+            [first, second, third, unrated])
+        self.assertEqual(product_sort_by_rating([third, unrated]), [third, unrated])
+        self.assertEqual(product_sort_by_rating([]), [])
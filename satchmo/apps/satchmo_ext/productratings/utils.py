@@ -1,9 +1,7 @@
 from django.conf import settings
-from django.contrib.comments.models import Comment
 from django.contrib.sites.models import Site
-from django.db.models import Avg
 from django.utils.translation import ugettext_lazy as _
-from satchmo_ext.productratings.models import ProductRating
+from satchmo_ext.productratings.models import ProductRatingSummary
 import logging
 import operator
 
@@ -20,19 +18,16 @@ def average(ratings):
     return None
 
 def get_product_rating(product, site=None):
-    """Get the average product rating"""
+    """Get the average of the public ratings of a product, or None if it
+    has none.  Ratings of 0 are not ratings, and are left out, as they are
+    by `highest_rated`."""
     if site is None:
         site = Site.objects.get_current()
     
-    site = site.id
-    manager = Comment.objects
-    comment_pks = manager.filter(object_pk__exact=str(product.id),
-                               content_type__app_label__exact='product',
-                               content_type__model__exact='product',
-                               site__id__exact=site,
-                               is_public__exact=True).values_list('pk', flat=True)
-    rating = ProductRating.objects.filter(comment__in=comment_pks
-        ).aggregate(average=Avg('rating'))['average']
+    try:
+        rating = ProductRatingSummary.objects.get(product__id=product.id, site__id=site.id).average
+    except ProductRatingSummary.DoesNotExist:
+        rating = None
     log.debug("Rating: %s", rating)
     return rating
 
@@ -1,8 +1,10 @@
 from decimal import Decimal
 from django.contrib.auth.models import Group
 from django.db import models
+from django.db.models.signals import post_delete, post_save
 from django.utils.translation import ugettext_lazy as _
 from product import signals
+from product.listeners import price_lookup_listener
 from product.models import Product
 from product.prices import PriceAdjustment, PriceAdjustmentCalc
 from satchmo_utils.fields import CurrencyField
@@ -162,3 +164,5 @@ def tiered_price_listener(signal, adjustment=None, **kwargs):
                 pass
 
 signals.satchmo_price_query.connect(tiered_price_listener)
+post_save.connect(price_lookup_listener, sender=TieredPrice)
+post_delete.connect(price_lookup_listener, sender=TieredPrice)
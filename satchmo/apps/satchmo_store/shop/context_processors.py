@@ -25,12 +25,16 @@ def settings(request):
     except Discount.DoesNotExist:
         sale = None
 
+    # For a real cart this computes its CartSummary, which the templates
+    # then reuse for cart.total and the line items.
+    cart_count = cart.numItems
+
     ctx = {
         'shop_base': get_satchmo_setting('SHOP_BASE'),
         'shop' : shop_config,
         'shop_name': shop_config.store_name,
         'media_url': current_media_url(request),
-        'cart_count': cart.numItems,
+        'cart_count': cart_count,
         'cart': cart,
         'categories': all_categories,
         'is_secure' : request_is_secure(request),
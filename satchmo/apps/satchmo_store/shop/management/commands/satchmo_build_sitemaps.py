@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+from satchmo_store.shop.sitemap_files import SitemapBuilder, sitemap_dir
+import time
+
+class Command(BaseCommand):
+    help = ("Writes the sitemap index and the sitemap files of the current site "
+            "to the SITEMAP_DIR in SATCHMO_SETTINGS.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--shard-size', dest='shard_size', type='int', default=None,
+            help='Number of URLs per sitemap file, at most 50000.'),
+    )
+
+    requires_model_validation = True
+
+    def handle(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        directory = sitemap_dir()
+        if not directory:
+            raise CommandError("Set SITEMAP_DIR in SATCHMO_SETTINGS to build the sitemap files")
+
+        start = time.time()
+        builder = SitemapBuilder(directory=directory, shard_size=options.get('shard_size'))
+        names = builder.build()
+
+        if verbosity > 0:
+            print "Wrote %i of %i sitemap files with %i urls to %s, in %.2fs" % (
+                builder.written, len(names), builder.urls, directory, time.time() - start)
@@ -16,7 +16,8 @@ from l10n.utils import moneyfmt
 from livesettings import ConfigurationSettings, config_value
 from payment.fields import PaymentChoiceCharField
 from product.models import Discount, Product, Price, get_product_quantity_adjustments
-from product.prices import PriceAdjustmentCalc, PriceAdjustment
+from product.prices import PriceAdjustmentCalc, PriceAdjustment, start_price_cache, stop_price_cache
+from product.utils import load_subtypes
 from satchmo_store.contact.models import Contact
 from satchmo_utils.fields import CurrencyField
 from satchmo_utils.numbers import trunc_decimal
@@ -281,26 +282,34 @@ class Cart(models.Model):
 
     objects = CartManager()
 
+    def _get_summary(self):
+        """The `CartSummary` of this cart, kept until the cart is changed."""
+        summary = getattr(self, '_summary', None)
+        if summary is None:
+            summary = CartSummary(self)
+            self._summary = summary
+        return summary
+
+    summary = property(_get_summary)
+
+    def clear_summary(self):
+        """Forget the cached `CartSummary`, so totals are recomputed."""
+        self._summary = None
+
     def _get_count(self):
-        itemCount = 0
-        for item in self.cartitem_set.all():
-            itemCount += item.quantity
-        return (itemCount)
+        return self.summary.numItems
     numItems = property(_get_count)
 
     def _get_discount(self):
-        return self.undiscounted_total - self.total
+        return self.summary.discount
 
     discount = property(_get_discount)
 
     def _get_total(self, include_discount=True):
-        total = Decimal("0")
-        for item in self.cartitem_set.all():
-            if include_discount:
-                total += item.line_total
-            else:
-                total += item.undiscounted_line_total
-        return(total)
+        if include_discount:
+            return self.summary.total
+        else:
+            return self.summary.undiscounted_total
     total = property(_get_total)
 
     def _get_undiscounted_total(self):
@@ -309,9 +318,12 @@ class Cart(models.Model):
     undiscounted_total = property(_get_undiscounted_total)
 
     def __iter__(self):
-        return iter(self.cartitem_set.all())
+        return iter(self.summary.items)
 
     def __len__(self):
+        summary = getattr(self, '_summary', None)
+        if summary is not None:
+            return len(summary.items)
         return self.cartitem_set.count()
 
     def __nonzero__(self):
@@ -327,7 +339,7 @@ class Cart(models.Model):
         return True
 
     def _is_empty(self):
-        return self.cartitem_set.count() == 0
+        return len(self) == 0
     is_empty = property(_is_empty)
 
     def __unicode__(self):
@@ -375,6 +387,7 @@ class Cart(models.Model):
             for data in details:
                 item_to_modify.add_detail(data)
 
+        self.clear_summary()
         return item_to_modify
 
     def remove_item(self, chosen_item_id, number_removed):
@@ -408,6 +421,7 @@ class Cart(models.Model):
             site = self.site
         except Site.DoesNotExist:
             self.site = Site.objects.get_current()
+        self.clear_summary()
         super(Cart, self).save(**kwargs)
 
     def _get_shippable(self):
@@ -430,10 +444,79 @@ class Cart(models.Model):
                     items.append(p)
         return items
 
+    def get_shipment_lines(self):
+        """Return a list of (product, quantity) pairs of the shippable products,
+        each product once.  See `shipping.packing`."""
+        lines = []
+        byproduct = {}
+        for cartitem in self.cartitem_set.select_related('product'):
+            if cartitem.is_shippable:
+                q = int(cartitem.quantity.quantize(Decimal('0'), ROUND_CEILING))
+                if cartitem.product_id in byproduct:
+                    lines[byproduct[cartitem.product_id]][1] += q
+                else:
+                    byproduct[cartitem.product_id] = len(lines)
+                    lines.append([cartitem.product, q])
+        return [tuple(line) for line in lines]
+
     class Meta:
         verbose_name = _("Shopping Cart")
         verbose_name_plural = _("Shopping Carts")
 
+class CartSummary(object):
+    """Totals of a `Cart`, computed in a single pass over its items.
+
+    The items are loaded together with their products, product subtypes and
+    details, and prices are resolved through a `PriceCache`, so the number
+    of queries doesn't grow with the number of lines in the cart.  Use
+    `Cart.summary`, which keeps the summary until the cart is changed.
+    """
+
+    def __init__(self, cart):
+        self.cart = cart
+        self.items = self._load_items()
+
+        self.numItems = 0
+        for item in self.items:
+            self.numItems += item.quantity
+
+        self.total = Decimal("0")
+        self.undiscounted_total = Decimal("0")
+        cache = start_price_cache()
+        try:
+            cache.preload([item.product for item in self.items])
+            for item in self.items:
+                unit = item._get_line_unitprice(cart_qty=self.numItems)
+                undiscounted = item._get_line_unitprice(include_discount=False, cart_qty=self.numItems)
+                self.total += unit * item.quantity
+                self.undiscounted_total += undiscounted * item.quantity
+        finally:
+            stop_price_cache()
+
+        self.discount = self.undiscounted_total - self.total
+
+    def _load_items(self):
+        items = list(self.cart.cartitem_set.select_related('product'))
+        if not items:
+            return items
+
+        # share one instance per product, so subtypes are only loaded once
+        products = {}
+        for item in items:
+            item.cart = self.cart
+            product = products.setdefault(item.product_id, item.product)
+            if product is not item.product:
+                item.product = product
+        load_subtypes(products.values())
+
+        details = dict([(item.id, []) for item in items])
+        for detail in CartItemDetails.objects.filter(cartitem__in=details.keys()):
+            details[detail.cartitem_id].append(detail)
+        for item in items:
+            item._details = details[item.id]
+
+        return items
+
 class NullCartItem(object):
     def __init__(self, itemid):
         self.id = itemid
@@ -448,11 +531,13 @@ class CartItem(models.Model):
     product = models.ForeignKey(Product, verbose_name=_('Product'))
     quantity = models.DecimalField(_("Quantity"),  max_digits=18,  decimal_places=6)
 
-    def _get_line_unitprice(self, include_discount=True):
+    def _get_line_unitprice(self, include_discount=True, cart_qty=None):
         # Get the qty discount price as the unit price for the line.
 
         if config_value('SHOP','CART_QTY'):
-            qty = self.cart.numItems
+            if cart_qty is None:
+                cart_qty = self.cart.numItems
+            qty = cart_qty
         else:
             qty = self.quantity
 
@@ -481,7 +566,7 @@ class CartItem(models.Model):
         """Get the delta price based on detail modifications"""
         delta = Decimal("0")
         if self.has_details:
-            for detail in self.details.all():
+            for detail in self._get_details():
                 if detail.price_change and detail.value:
                     delta += detail.price_change
         return delta
@@ -519,14 +604,37 @@ class CartItem(models.Model):
         detl.save()
         #self.details.add(detl)
 
+    def _get_details(self):
+        """The details of this item, preloaded by `CartSummary` if possible."""
+        if hasattr(self, '_details'):
+            return self._details
+        return self.details.all()
+
     def _has_details(self):
         """
         Determine if this specific item has more detail
         """
+        if hasattr(self, '_details'):
+            return len(self._details) > 0
         return (self.details.count() > 0)
 
     has_details = property(_has_details)
 
+    def _clear_cart_summary(self):
+        # Only the cart instance this item is attached to can be reached
+        # without a query, other instances are cleared when they are saved.
+        cart = getattr(self, '_cart_cache', None)
+        if cart is not None:
+            cart.clear_summary()
+
+    def save(self, **kwargs):
+        self._clear_cart_summary()
+        super(CartItem, self).save(**kwargs)
+
+    def delete(self, *args, **kwargs):
+        self._clear_cart_summary()
+        super(CartItem, self).delete(*args, **kwargs)
+
     def __unicode__(self):
         money_format = force_unicode(moneyfmt(self.line_total))
         return u'%s - %s %s' % (self.quantity, self.product.name,
@@ -880,6 +988,13 @@ class Order(models.Model):
 
     def force_recalculate_total(self, save=True):
         """Calculates sub_total, taxes and total."""
+        cache = start_price_cache()
+        try:
+            self._recalculate_total(cache, save=save)
+        finally:
+            stop_price_cache()
+
+    def _recalculate_total(self, cache, save=True):
         zero = Decimal("0.0000000000")
         total_discount = Decimal("0.0000000000")
 
@@ -894,7 +1009,10 @@ class Order(models.Model):
         if qty_override:
             itemct = self.numItems
 
-        for lineitem in self.orderitem_set.all():
+        lineitems = list(self.orderitem_set.select_related('product'))
+        cache.preload([lineitem.product for lineitem in lineitems])
+
+        for lineitem in lineitems:
             lid = lineitem.id
             if lid in discounts:
                 lineitem.discount = discounts[lid]
@@ -1110,7 +1228,7 @@ class OrderItem(models.Model):
         max_digits=18, decimal_places=10)
     tax = CurrencyField(_("Line item tax"), default=Decimal('0.00'),
         max_digits=18, decimal_places=10)
-    expire_date = models.DateField(_("Subscription End"), help_text=_("Subscription expiration date."), blank=True, null=True)
+    expire_date = models.DateField(_("Subscription End"), help_text=_("Subscription expiration date."), blank=True, null=True, db_index=True)
     completed = models.BooleanField(_("Completed"), default=False)
     discount = CurrencyField(_("Line item discount"),
         max_digits=18, decimal_places=10, blank=True, null=True)
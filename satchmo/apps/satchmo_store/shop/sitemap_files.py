@@ -0,0 +1,190 @@
+"""
+Sitemap files for large catalogs.
+
+The `sitemap.xml` view builds the whole sitemap on every request, and a
+sitemap file may hold at most 50,000 URLs.  `SitemapBuilder` writes the
+sitemap of the current site to the `SITEMAP_DIR` in `SATCHMO_SETTINGS`
+instead, as an index file and sitemap files of at most `SITEMAP_SHARD_SIZE`
+URLs.  The products and categories are read with `values_list` and the
+category URLs come from the category tree, so no model instances are made.
+
+The products go into files by ranges of their ids, so that a new product
+only changes the file its id falls into.  A file is only rewritten when its
+content changed, and its modification time is the `lastmod` in the index.
+
+`satchmo_build_sitemaps` runs the builder.  The files can be served by the
+web server from `SITEMAP_DIR`, or by the `sitemap.xml` and `sitemap-<name>.xml`
+views, which fall back to the dynamic sitemap until the files are built.
+"""
+from django.contrib.sites.models import Site
+from django.core import urlresolvers
+from django.utils.encoding import iri_to_uri, smart_str
+from django.utils.hashcompat import md5_constructor
+from django.utils.html import escape
+from product.models import Product
+from product.tree import get_category_tree
+from satchmo_store.shop import get_satchmo_setting
+import datetime
+import logging
+import os
+import re
+
+log = logging.getLogger('satchmo_store.shop.sitemap_files')
+
+INDEX_NAME = 'sitemap.xml'
+FILE_NAME = 'sitemap-%s.xml'
+FILE_RE = re.compile(r'^sitemap-[-\w]+\.xml$')
+MAX_URLS = 50000
+
+URLSET_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+URLSET_FOOTER = '</urlset>\n'
+INDEX_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+INDEX_FOOTER = '</sitemapindex>\n'
+
+def sitemap_dir():
+    """The directory the sitemap files are written to, or None."""
+    return get_satchmo_setting('SITEMAP_DIR')
+
+def _url_pattern(name, slugarg, **kwargs):
+    """Reverse `name` with a placeholder for the `slugarg` argument, and
+    return the parts before and after it."""
+    kwargs[slugarg] = 'SITEMAPSLUG'
+    return urlresolvers.reverse(name, kwargs=kwargs).split('SITEMAPSLUG', 1)
+
+def url_entry(location, changefreq=None, priority=None):
+    parts = ['<url><loc>%s</loc>' % escape(iri_to_uri(location))]
+    if changefreq:
+        parts.append('<changefreq>%s</changefreq>' % changefreq)
+    if priority:
+        parts.append('<priority>%s</priority>' % priority)
+    parts.append('</url>\n')
+    return smart_str(''.join(parts))
+
+class SitemapBuilder(object):
+    """Writes the sitemap files of `site`, by default the current site."""
+
+    def __init__(self, directory=None, site=None, shard_size=None):
+        if directory is None:
+            directory = sitemap_dir()
+        if site is None:
+            site = Site.objects.get_current()
+        if shard_size is None:
+            shard_size = get_satchmo_setting('SITEMAP_SHARD_SIZE', MAX_URLS)
+
+        self.directory = directory
+        self.site = site
+        self.shard_size = max(1, min(int(shard_size), MAX_URLS))
+        self.base = 'http://%s' % site.domain
+        self.written = 0
+        self.unchanged = 0
+        self.urls = 0
+
+    def main_urls(self):
+        """The URLs of `satchmo_main`, the home page, cart, login and so on."""
+        from satchmo_store.shop.views.sitemaps import satchmo_main
+        sitemap = satchmo_main()
+        for url in sitemap.items():
+            yield url_entry(self.base + url['location'], url['changefreq'], url['priority'])
+
+    def category_urls(self):
+        """The URLs of the active categories, with their paths from the
+        category tree."""
+        tree = get_category_tree(self.site.id)
+        before, after = _url_pattern('satchmo_category', 'slug', parent_slugs='')
+        for pk in sorted(tree.nodes.keys()):
+            cat = tree.nodes[pk]
+            if not cat.is_active:
+                continue
+            path = tree.slug_path(pk)
+            if path is None:
+                location = cat.get_absolute_url()
+            else:
+                location = before + path + after
+            yield url_entry(self.base + location, 'daily', '0.6')
+
+    def product_shards(self):
+        """Yield the shard number and the URLs of the active products, which
+        aren't variations, in ranges of `shard_size` ids."""
+        before, after = _url_pattern('satchmo_product', 'product_slug')
+        rows = Product.objects.active_by_site(site=self.site, variations=False).order_by(
+            'pk').values_list('pk', 'slug')
+        shard = None
+        urls = []
+        for pk, slug in rows.iterator():
+            if pk / self.shard_size != shard:
+                if urls:
+                    yield shard, urls
+                shard = pk / self.shard_size
+                urls = []
+            urls.append(url_entry(self.base + before + slug + after, 'weekly'))
+        if urls:
+            yield shard, urls
+
+    def sections(self):
+        """Yield the name and the URLs of each sitemap file."""
+        yield 'main', list(self.main_urls())
+
+        urls = list(self.category_urls())
+        for start in range(0, len(urls), self.shard_size):
+            yield 'categories-%i' % (start / self.shard_size), urls[start:start + self.shard_size]
+
+        for shard, urls in self.product_shards():
+            yield 'products-%i' % shard, urls
+
+    def write_file(self, name, urls):
+        """Write a sitemap file, unless it holds these URLs already."""
+        content = URLSET_HEADER + ''.join(urls) + URLSET_FOOTER
+        path = os.path.join(self.directory, FILE_NAME % name)
+        if os.path.exists(path):
+            existing = open(path, 'rb')
+            try:
+                same = md5_constructor(existing.read()).digest() == md5_constructor(content).digest()
+            finally:
+                existing.close()
+            if same:
+                self.unchanged += 1
+                return path
+
+        self._write(path, content)
+        self.written += 1
+        return path
+
+    def _write(self, path, content):
+        tmp = path + '.tmp'
+        out = open(tmp, 'wb')
+        try:
+            out.write(content)
+        finally:
+            out.close()
+        os.rename(tmp, path)
+
+    def build(self):
+        """Write the sitemap files and the index, and remove the files which
+        are no longer listed.  Returns the list of file names."""
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        names = []
+        entries = []
+        for name, urls in self.sections():
+            path = self.write_file(name, urls)
+            self.urls += len(urls)
+            filename = os.path.basename(path)
+            names.append(filename)
+            lastmod = datetime.datetime.utcfromtimestamp(os.path.getmtime(path))
+            location = self.base + urlresolvers.reverse('satchmo_sitemap_file', kwargs={'name' : name})
+            entries.append(smart_str('<sitemap><loc>%s</loc><lastmod>%s</lastmod></sitemap>\n' % (
+                escape(iri_to_uri(location)), lastmod.strftime('%Y-%m-%dT%H:%M:%S+00:00'))))
+
+        self._write(os.path.join(self.directory, INDEX_NAME),
+            INDEX_HEADER + ''.join(entries) + INDEX_FOOTER)
+
+        for filename in os.listdir(self.directory):
+            if FILE_RE.match(filename) and not filename in names:
+                os.remove(os.path.join(self.directory, filename))
+
+        log.debug('Wrote %i of %i sitemap files with %i urls to %s',
+            self.written, len(names), self.urls, self.directory)
+        return names
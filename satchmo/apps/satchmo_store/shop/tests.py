@@ -1,4 +1,5 @@
 from decimal import Decimal
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.sites.models import Site
 from django.core import mail
@@ -23,6 +24,9 @@ from satchmo_store.shop.models import *
 from satchmo_utils.templatetags import get_filter_args
 
 import keyedcache
+import os
+import shutil
+import tempfile
 
 domain = 'http://example.com'
 prefix = get_satchmo_setting('SHOP_BASE')
@@ -85,6 +89,28 @@ class ShopTest(TestCase):
         self.assertContains(response, '<div class = "productImage">',
                             count=4, status_code=200)
 
+    def test_random_featured_seed(self):
+        """Random featured products only keep their seed in the session when paginated."""
+        random_featured = config_get('PRODUCT', 'RANDOM_FEATURED')
+        paginated = config_get('PRODUCT', 'NUM_PAGINATED')
+        per_page = paginated.value
+        random_featured.update(True)
+        try:
+            response = self.client.get(prefix+'/')
+            self.assertContains(response, '<div class = "productImage">',
+                                count=4, status_code=200)
+            self.assert_(not 'featured_seed' in self.client.session)
+
+            paginated.update(2)
+            self.client.get(prefix+'/')
+            seed = self.client.session['featured_seed']
+            response = self.client.get(prefix+'/?page=2')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.client.session['featured_seed'], seed)
+        finally:
+            random_featured.update(False)
+            paginated.update(per_page)
+
     def test_contact_form(self):
         """
         Validate the contact form works
@@ -211,6 +237,50 @@ class ShopTest(TestCase):
         self.assertContains(response, 'Orphaned Product')
         self.assertContains(response, 'Software')
 
+    def test_sitemap_files(self):
+        """
+        Build the sitemap files into a directory and serve them.
+        """
+        from satchmo_store.shop import sitemap_files
+        directory = tempfile.mkdtemp()
+        try:
+            builder = sitemap_files.SitemapBuilder(directory=directory, shard_size=5)
+            names = builder.build()
+            self.assert_('sitemap-main.xml' in names)
+            self.assert_('sitemap-products-0.xml' in names)
+            self.assertEqual(builder.written, len(names))
+
+            index = open(os.path.join(directory, 'sitemap.xml')).read()
+            for name in names:
+                self.assert_(name in index)
+            products = Product.objects.active_by_site(variations=False).count()
+            self.assert_(builder.urls > products)
+
+            product = Product.objects.active_by_site(variations=False)[0]
+            shard = 'sitemap-products-%i.xml' % (product.pk / 5)
+            content = open(os.path.join(directory, shard)).read()
+            self.assert_(product.get_absolute_url() in content)
+
+            # nothing changed, nothing is written
+            builder = sitemap_files.SitemapBuilder(directory=directory, shard_size=5)
+            self.assertEqual(builder.build(), names)
+            self.assertEqual(builder.written, 0)
+            self.assertEqual(builder.unchanged, len(names))
+
+            satchmo_settings = getattr(settings, 'SATCHMO_SETTINGS', {})
+            settings.SATCHMO_SETTINGS = dict(satchmo_settings, SITEMAP_DIR=directory)
+            try:
+                response = self.client.get(prefix + '/sitemap.xml')
+                self.assertContains(response, 'sitemap-main.xml')
+                response = self.client.get(prefix + '/sitemap-main.xml')
+                self.assertContains(response, '<urlset')
+                response = self.client.get(prefix + '/sitemap-missing.xml')
+                self.assertEqual(response.status_code, 404)
+            finally:
+                settings.SATCHMO_SETTINGS = satchmo_settings
+        finally:
+            shutil.rmtree(directory)
+
     def test_get_price(self):
         """
         Get the price and productname of a ProductVariation.
@@ -539,6 +609,36 @@ class CartTest(TestCase):
         self.assertEqual(item2.unit_price, Decimal("23.00"))
         self.assertEqual(cart.total, Decimal("43.00"))
 
+    def test_summary(self):
+        py = Product.objects.get(slug__iexact='PY-Rocks')
+        sb = Product.objects.get(slug__iexact='dj-rocks-s-b')
+
+        cart = Cart(site=Site.objects.get_current())
+        cart.save()
+        cart.add_item(py, 2)
+        cart.add_item(sb, 1)
+
+        summary = cart.summary
+        self.assertEqual(summary.numItems, 3)
+        self.assertEqual(summary.total, Decimal("59.00"))
+        self.assertEqual(summary.undiscounted_total, Decimal("59.00"))
+        self.assertEqual(summary.discount, Decimal("0"))
+        self.assertEqual(len(summary.items), 2)
+
+        # the summary is kept until the cart changes
+        self.assert_(cart.summary is summary)
+        self.assertEqual(cart.total, summary.total)
+
+        item = list(cart)[0]
+        cart.remove_item(item.id, 2)
+        self.assert_(cart.summary is not summary)
+        self.assertEqual(cart.numItems, 1)
+        self.assertEqual(cart.total, Decimal("20.00"))
+
+        cart.empty()
+        self.assertEqual(cart.numItems, 0)
+        self.assert_(cart.is_empty)
+
 class ConfigTest(TestCase):
     fixtures = ['l10n-data.yaml', 'sample-store-data.yaml', 'test-config.yaml']
 
@@ -1,7 +1,6 @@
 from django.conf.urls.defaults import patterns, include
 from product.urls import urlpatterns as productpatterns
 from satchmo_store import shop
-from satchmo_store.shop.views.sitemaps import sitemaps
 from signals_ahoy.signals import collect_urls
 
 urlpatterns = shop.get_satchmo_setting('SHOP_URLS')
@@ -31,9 +30,8 @@ urlpatterns += productpatterns
 urlpatterns += patterns('',
     (r'^contact/thankyou/$','django.views.generic.simple.direct_to_template',
         {'template':'shop/contact_thanks.html'},'satchmo_contact_thanks'),
-    (r'^sitemap\.xml$', 'django.contrib.sitemaps.views.sitemap',
-        {'sitemaps': sitemaps},
-        'satchmo_sitemap_xml'),
+    (r'^sitemap\.xml$', 'satchmo_store.shop.views.sitemaps.sitemap_index', {}, 'satchmo_sitemap_xml'),
+    (r'^sitemap-(?P<name>[-\w]+)\.xml$', 'satchmo_store.shop.views.sitemaps.sitemap_file', {}, 'satchmo_sitemap_file'),
 
 )
 
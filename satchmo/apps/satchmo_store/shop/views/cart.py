@@ -9,6 +9,7 @@ from django.utils.safestring import mark_safe
 from django.utils import simplejson
 from django.utils.translation import ugettext as _
 from django.views.decorators.cache import never_cache
+from l10n.utils import prefetch_translations
 from livesettings import config_value
 from product.models import Product, OptionManager
 from product.utils import find_best_auto_discount
@@ -116,7 +117,8 @@ def display(request, cart=None, error_message='', default_view_tax=None):
         cart = Cart.objects.from_request(request)
 
     if cart.numItems > 0:
-        products = [item.product for item in cart.cartitem_set.all()]
+        products = [item.product for item in cart]
+        prefetch_translations(products)
         sale = find_best_auto_discount(products)
     else:
         sale = None
@@ -5,6 +5,8 @@ from django.utils.translation import ugettext as _
 from livesettings import config_value
 from product.views import display_featured
 from satchmo_utils.views import bad_or_missing
+import random
+import sys
 
 def home(request, template="shop/index.html"):
     # Display the category, its child categories, and its products.
@@ -13,8 +15,19 @@ def home(request, template="shop/index.html"):
         currpage = request.GET.get('page', 1)
     else:
         currpage = 1
-        
-    featured = display_featured()
+
+    # Keep the random featured products in the same order while paging
+    # through them, and pick new ones when the home page is visited again.
+    # The seed is only saved in the session when there are pages to keep.
+    seed = None
+    new_seed = False
+    if config_value('PRODUCT','RANDOM_FEATURED'):
+        seed = request.session.get('featured_seed', None)
+        if seed is None or not 'page' in request.GET:
+            seed = random.randint(0, sys.maxint)
+            new_seed = True
+
+    featured = display_featured(seed=seed)
     
     count = config_value('PRODUCT','NUM_PAGINATED')
     
@@ -30,6 +43,9 @@ def home(request, template="shop/index.html"):
             
     is_paged = paginator.num_pages > 1
     page = paginator.page(currpage)
+
+    if new_seed and is_paged:
+        request.session['featured_seed'] = seed
         
     ctx = RequestContext(request, {
         'all_products_list' : page.object_list,        
@@ -1,8 +1,13 @@
 from django.conf import settings
 from django.contrib.sitemaps import Sitemap
+from django.contrib.sitemaps.views import sitemap as dynamic_sitemap
 from django.core import urlresolvers
+from django.core.servers.basehttp import FileWrapper
+from django.http import Http404, HttpResponse
 from product.models import Category, Product
 from satchmo_store.shop import get_satchmo_setting
+from satchmo_store.shop.sitemap_files import FILE_NAME, INDEX_NAME, sitemap_dir
+import os
 
 
 class CategorySitemap(Sitemap):
@@ -19,7 +24,9 @@ class ProductSitemap(Sitemap):
         return Product.objects.active_by_site(variations=False)
 
 class MainSitemap(Sitemap):
-    urls = []
+
+    def __init__(self):
+        self.urls = []
 
     def items(self):
         return self.urls
@@ -61,3 +68,26 @@ sitemaps = {
     'category': CategorySitemap,
     'products': ProductSitemap,
 }
+
+def _sitemap_file(filename):
+    directory = sitemap_dir()
+    if directory:
+        path = os.path.join(directory, filename)
+        if os.path.exists(path):
+            return HttpResponse(FileWrapper(open(path, 'rb')), mimetype='application/xml')
+    return None
+
+def sitemap_index(request):
+    """Serve the sitemap index written by `satchmo_build_sitemaps`, or the
+    dynamic sitemap if it hasn't been built."""
+    response = _sitemap_file(INDEX_NAME)
+    if response is None:
+        response = dynamic_sitemap(request, sitemaps)
+    return response
+
+def sitemap_file(request, name):
+    """Serve a sitemap file written by `satchmo_build_sitemaps`."""
+    response = _sitemap_file(FILE_NAME % name)
+    if response is None:
+        raise Http404
+    return response
@@ -0,0 +1,71 @@
+"""Low level database helpers for bulk maintenance jobs.
+
+Django doesn't give us a multi-row insert, so jobs which need to write
+tens of thousands of denormalized rows use `bulk_insert` instead of calling
+`save()` on every object.
+"""
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+import logging
+
+log = logging.getLogger('satchmo_utils.db')
+
+DEFAULT_CHUNK_SIZE = 500
+
+def chunked(iterable, size):
+    """Yield lists of at most `size` items from `iterable`."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def bulk_insert(model, fieldnames, rows, chunk_size=DEFAULT_CHUNK_SIZE, using=DEFAULT_DB_ALIAS, table=None):
+    """Insert `rows` into the table for `model` with multi-row INSERT statements.
+
+    `fieldnames` are model field names, `rows` is an iterable of tuples in
+    the same order.  Values are converted with each field's
+    `get_db_prep_save`, so Decimals, dates and booleans are written exactly as
+    `Model.save()` would write them.  No signals are sent and no primary keys
+    are returned.
+
+    `table` lets callers load a staging copy of the model's table.
+
+    Returns the number of rows written.
+    """
+    connection = connections[using]
+    opts = model._meta
+    fields = [opts.get_field(name) for name in fieldnames]
+    if table is None:
+        table = opts.db_table
+
+    qn = connection.ops.quote_name
+    columns = ", ".join([qn(f.column) for f in fields])
+    placeholder = "(%s)" % ", ".join(["%s"] * len(fields))
+    sql = "INSERT INTO %s (%s) VALUES " % (qn(table), columns)
+
+    # Older SQLite releases can't parse multi-row VALUES lists, fall back
+    # to executemany there - it is still a single prepared statement.
+    multirow = not connection.settings_dict['ENGINE'].endswith('sqlite3')
+
+    cursor = connection.cursor()
+    ct = 0
+    for chunk in chunked(rows, chunk_size):
+        params = []
+        for row in chunk:
+            params.append([f.get_db_prep_save(val, connection=connection) for f, val in zip(fields, row)])
+
+        if multirow:
+            flat = []
+            for p in params:
+                flat.extend(p)
+            cursor.execute(sql + ", ".join([placeholder] * len(params)), flat)
+        else:
+            cursor.executemany(sql + placeholder, params)
+        ct += len(params)
+
+    transaction.commit_unless_managed(using=using)
+    log.debug('bulk_insert: wrote %i rows to %s', ct, table)
+    return ct
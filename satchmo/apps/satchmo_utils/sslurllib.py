@@ -1,4 +1,10 @@
-"""Adds a new HTTPS handler to urllib2, which uses the SSL library from Python 2.6."""
+"""Adds a new HTTPS handler to urllib2, which uses the SSL library from Python 2.6.
+
+Also keeps pools of kept-alive connections, so that the payment modules don't
+open a new connection, with a new SSL handshake, for every request.  Servers
+close idle connections after a while, so a connection is only reused within
+`KEEPALIVE` seconds of its last request, and when the server hasn't closed it.
+"""
 
 import logging
 log = logging.getLogger('sslurllib')
@@ -59,3 +65,187 @@ if _sane and not runningPython26:
     # this will make our new subclassed HTTPSHandler be used for all HTTPSConnections
     urllib2.install_opener(opener)
     
+
+
+# --- Keep-alive connection pools ---
+
+import httplib
+import select
+import socket
+import threading
+import time
+import urllib2
+import urlparse
+
+# seconds an idle connection is reused for, below the keep-alive timeouts of
+# the gateways
+KEEPALIVE = 5
+
+def connection_class(scheme):
+    """The connection class for `scheme`, with the SSLv2 connection for HTTPS
+    on Python versions < 2.6."""
+    if scheme == 'https':
+        if _sane and not runningPython26:
+            return HTTPSv2Connection
+        return httplib.HTTPSConnection
+    return httplib.HTTPConnection
+
+class ConnectionPool(object):
+    """Keeps the idle connections to one host open for the next request, and
+    allows at most `maxsize` requests to it at the same time.  `timeout` is
+    the socket timeout in seconds, not supported on Python versions < 2.6.
+    Connections idle for more than `keepalive` seconds are closed instead of
+    reused."""
+
+    def __init__(self, scheme, host, port=None, maxsize=4, timeout=None, keepalive=KEEPALIVE):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.keepalive = keepalive
+        self.idle = []
+        self.created = 0
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxsize)
+
+    def _new(self):
+        self._lock.acquire()
+        try:
+            self.created += 1
+        finally:
+            self._lock.release()
+        log.debug('Opening connection to %s://%s:%s', self.scheme, self.host, self.port)
+        kwargs = {}
+        if self.timeout and runningPython26:
+            kwargs['timeout'] = self.timeout
+        return connection_class(self.scheme)(self.host, self.port, **kwargs)
+
+    def _alive(self, conn):
+        """Whether the server hasn't closed the idle connection `conn`.  An
+        idle connection has nothing to read, until the server closes it."""
+        if conn.sock is None:
+            return False
+        try:
+            readable = select.select([conn.sock], [], [], 0)[0]
+        except (select.error, socket.error, ValueError):
+            return False
+        return not readable
+
+    def _get(self):
+        """Return an idle connection, or a new one, and whether it was idle.
+        The idle connections which are too old, or which the server closed,
+        are closed."""
+        expired = time.time() - self.keepalive
+        conn = None
+        stale = []
+        self._lock.acquire()
+        try:
+            while self.idle:
+                candidate, since = self.idle.pop()
+                if since >= expired and self._alive(candidate):
+                    conn = candidate
+                    break
+                stale.append(candidate)
+        finally:
+            self._lock.release()
+        for candidate in stale:
+            candidate.close()
+        if conn is not None:
+            return conn, True
+        return self._new(), False
+
+    def _put(self, conn):
+        self._lock.acquire()
+        try:
+            self.idle.append((conn, time.time()))
+        finally:
+            self._lock.release()
+
+    def _send(self, conn, method, path, body, headers):
+        conn.request(method, path, body, headers)
+        response = conn.getresponse()
+        return response, response.read()
+
+    def request(self, method, path, body=None, headers={}, idempotent=False):
+        """Send a request, and return the response and its body.
+
+        A kept-alive connection is checked before it is reused, but the server
+        may still close it as the request is sent.  An `idempotent` request
+        which fails on one is sent again once, on a new connection, unless it
+        timed out.  Other requests are never sent twice, since the server may
+        have acted on them before the connection broke.  Errors are raised as `urllib2.URLError`, like
+        `urllib2.urlopen` does.
+        """
+        self._slots.acquire()
+        try:
+            conn, reused = self._get()
+            try:
+                try:
+                    response, data = self._send(conn, method, path, body, headers)
+                except (httplib.HTTPException, socket.error), e:
+                    conn.close()
+                    if not (reused and idempotent) or isinstance(e, socket.timeout):
+                        raise
+                    conn = self._new()
+                    response, data = self._send(conn, method, path, body, headers)
+            except (httplib.HTTPException, socket.error), e:
+                conn.close()
+                raise urllib2.URLError(e)
+
+            if response.will_close:
+                conn.close()
+            else:
+                self._put(conn)
+            return response, data
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """Close the idle connections."""
+        self._lock.acquire()
+        try:
+            for conn, since in self.idle:
+                conn.close()
+            self.idle = []
+        finally:
+            self._lock.release()
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+def get_pool(url, maxsize=4, timeout=None):
+    """Return the process wide `ConnectionPool` for the host of `url`.  The
+    size and timeout are set by the first call for a host."""
+    parts = urlparse.urlsplit(url)
+    key = (parts.scheme, parts.hostname, parts.port)
+    _POOLS_LOCK.acquire()
+    try:
+        pool = _POOLS.get(key, None)
+        if pool is None:
+            pool = ConnectionPool(parts.scheme, parts.hostname, parts.port,
+                maxsize=maxsize, timeout=timeout)
+            _POOLS[key] = pool
+        return pool
+    finally:
+        _POOLS_LOCK.release()
+
+def request_path(url):
+    """The path and query of `url`, as sent in the request line."""
+    parts = urlparse.urlsplit(url)
+    path = parts.path or '/'
+    if parts.query:
+        path = '%s?%s' % (path, parts.query)
+    return path
+
+def post(url, data, headers={}, maxsize=4, timeout=None, idempotent=False):
+    """POST `data` to `url` over a pooled connection, and return the body
+    of the response.  See `ConnectionPool.request` for `idempotent`."""
+    pool = get_pool(url, maxsize=maxsize, timeout=timeout)
+    response, body = pool.request('POST', request_path(url), data, headers,
+        idempotent=idempotent)
+    return body
+
+def is_timeout(error):
+    """Whether the `urllib2.URLError` `error` is for a timed out request."""
+    return isinstance(getattr(error, 'reason', None), socket.timeout)
@@ -1,6 +1,8 @@
 from decimal import Decimal
+from django.core.cache import cache
 from django.test import TestCase
 from satchmo_utils.numbers import round_decimal, trunc_decimal
+from satchmo_utils.versionkey import VersionKey
 
 class TestRoundedDecimals(TestCase):
 
@@ -61,3 +63,24 @@ class TestRoundedDecimals(TestCase):
 
         val = trunc_decimal("2.1223E+1", places=2)
         self.assertEqual(val, Decimal('21.23'))
+
+class VersionKeyTest(TestCase):
+
+    def tearDown(self):
+        cache.delete('test-version')
+
+    def testVersions(self):
+        key = VersionKey('test-version')
+        version = key.current()
+        self.assertNotEqual(version, None)
+        self.assertEqual(key.current(), version)
+        self.assert_(key.is_current(version))
+
+        key.changed()
+        self.assert_(not key.is_current(version))
+
+        # an evicted key makes loaded data stale, and is seeded again
+        version = key.current()
+        cache.delete('test-version')
+        self.assert_(not key.is_current(version))
+        self.assertNotEqual(key.current(), None)
@@ -0,0 +1,43 @@
+"""Version keys for the data a process keeps in memory.
+
+Tables such as the area tax rates or the category trees are loaded from the
+database once per process, and then read from memory.  A `VersionKey` holds
+the time of the last change in the cache: a process notes the version when
+it loads its data, and reloads once the version in the cache differs, which
+`changed` makes it do in every process.
+
+If the key is evicted from the cache, a change may have been lost with it,
+so data loaded before no longer counts as current, and the next load seeds
+the key again.
+"""
+from django.core.cache import cache
+import time
+
+VERSION_TIMEOUT = 60*60*24*365
+
+class VersionKey(object):
+    """The version of the data kept in memory, under the cache key `key`."""
+
+    def __init__(self, key, timeout=VERSION_TIMEOUT):
+        self.key = key
+        self.timeout = timeout
+
+    def current(self):
+        """Return the version in the cache, seeding the key if it was
+        evicted.  Call it before loading the data."""
+        version = cache.get(self.key)
+        if version is None:
+            cache.add(self.key, time.time(), self.timeout)
+            version = cache.get(self.key)
+        return version
+
+    def is_current(self, version):
+        """Whether data loaded at `version` is up to date."""
+        latest = cache.get(self.key)
+        if latest is None:
+            return version is None
+        return latest == version
+
+    def changed(self):
+        """Make every process reload its data."""
+        cache.set(self.key, time.time(), self.timeout)
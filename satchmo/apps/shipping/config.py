@@ -1,8 +1,14 @@
 from django.conf import settings
 from django.utils.translation import ugettext_lazy as _
 from livesettings import *
+from livesettings.signals import configuration_value_changed
 from satchmo_store.shop import get_satchmo_setting
 from satchmo_utils import is_string_like, load_module
+import copy
+import logging
+import threading
+
+log = logging.getLogger('shipping.config')
 
 SHIPPING_GROUP = ConfigurationGroup('SHIPPING', _('Shipping Settings'))
 
@@ -36,6 +42,51 @@ config_register(
         ordering=15
         ))
 
+config_register(
+    PositiveIntegerValue(SHIPPING_GROUP,
+        'QUOTE_WORKERS',
+        description = _("Concurrent shipping quotes"),
+        help_text = _("How many shipping modules may calculate a quote at the same time. Use 1 to calculate them one after the other."),
+        default=4,
+        ordering=20
+        ))
+
+config_register(
+    PositiveIntegerValue(SHIPPING_GROUP,
+        'QUOTE_TIMEOUT',
+        description = _("Shipping quote timeout"),
+        help_text = _("Seconds to wait for a shipping module's quote before leaving it out of the shipping choices."),
+        default=15,
+        ordering=25
+        ))
+
+config_register(
+    PositiveIntegerValue(SHIPPING_GROUP,
+        'QUOTE_CACHE_TTL',
+        description = _("Shipping quote cache time"),
+        help_text = _("Seconds to keep a carrier's quote for the same shipment and destination. Use 0 to turn the cache off."),
+        default=600,
+        ordering=30
+        ))
+
+config_register(
+    PositiveIntegerValue(SHIPPING_GROUP,
+        'QUOTE_CACHE_SIZE',
+        description = _("Shipping quote cache size"),
+        help_text = _("The most carrier quotes to keep, the least recently used ones are dropped first."),
+        default=1000,
+        ordering=35
+        ))
+
+config_register(
+    LongStringValue(SHIPPING_GROUP,
+        'BOX_TYPES',
+        description = _("Shipping boxes"),
+        help_text = _("The boxes the carrier modules pack the products in, one per line as: name, length, width, height, maximum weight. Use the units of your products, and leave a size or the weight empty if it doesn't matter. Without boxes, every product ships in its own package."),
+        default="",
+        ordering=40
+        ))
+
 
 # --- Load default shipping modules.  Ignore import errors, user may have deleted them. ---
 # DO NOT ADD 'tiered' or 'no' to this list.  
@@ -60,23 +111,92 @@ for extra in extra_shipping:
         log.warn('Could not load shipping module configuration: %s' % extra)
 
 class ShippingModuleNotFound(Exception):
-    def __init__(key):
+    def __init__(self, key):
         self.key = key
 
+class ShippingMethodRegistry(object):
+    """Keeps the methods of the active shipping modules.
+
+    The modules' `get_methods` are called once, and again only after the
+    shipping settings change or `clear` is called.  Every caller gets its own
+    copies of the methods, since `calculate` stores the cart and the results
+    on the method.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self._state = None
+
+    def _load(self):
+        modules = tuple(config_value('SHIPPING', 'MODULES'))
+        state = self._state
+        if state is None or state[0] != modules:
+            self._lock.acquire()
+            try:
+                state = self._state
+                if state is None or state[0] != modules:
+                    log.debug('Loading shipping methods: %s', modules)
+                    methods = []
+                    for m in modules:
+                        module = load_module(m)
+                        methods.extend(module.get_methods())
+                    byid = {}
+                    for method in methods:
+                        if not method.id in byid:
+                            byid[method.id] = method
+                    state = (modules, methods, byid)
+                    self._state = state
+            finally:
+                self._lock.release()
+        return state
+
+    def _get_modules(self):
+        state = self._state
+        if state is None:
+            return ()
+        return state[0]
+
+    modules = property(_get_modules)
+
+    def methods(self):
+        return [copy.copy(method) for method in self._load()[1]]
+
+    def get(self, key):
+        """Return a copy of the method with id `key`, or None."""
+        method = self._load()[2].get(key, None)
+        if method is not None:
+            method = copy.copy(method)
+        return method
+
+    def choices(self):
+        return [(method.id, method.description()) for method in self._load()[1]]
+
+shipping_registry = ShippingMethodRegistry()
+
+def clear_shipping_methods(sender=None, **kwargs):
+    """Listener which makes the registry reload the shipping methods."""
+    shipping_registry.clear()
+
+def shipping_settings_listener(sender, setting=None, **kwargs):
+    """Clear the registry when a setting of the SHIPPING group or of an active
+    shipping module is saved."""
+    if setting is None:
+        setting = sender
+    group = setting.group.key
+    if group == 'SHIPPING' or group in shipping_registry.modules:
+        shipping_registry.clear()
+
+configuration_value_changed.connect(shipping_settings_listener)
+
 def shipping_methods():
-    methods = []
-    modules = config_value('SHIPPING', 'MODULES')
-    log.debug('Getting shipping methods: %s', modules)
-    for m in modules:
-        module = load_module(m)
-        methods.extend(module.get_methods())
-    return methods
-    
+    return shipping_registry.methods()
+
 def shipping_method_by_key(key):
     if key and key != "NoShipping":
-        for method in shipping_methods():
-            if method.id == key:
-                return method
+        method = shipping_registry.get(key)
     else:
         import shipping.modules.no.shipper as noship
         method = noship.Shipper()
@@ -88,10 +208,4 @@ def shipping_method_by_key(key):
         
 
 def shipping_choices():
-    choices = []
-    keys = []
-    for method in shipping_methods():
-        key = method.id
-        label = method.description()
-        choices.append((key, label))
-    return choices
+    return shipping_registry.choices()
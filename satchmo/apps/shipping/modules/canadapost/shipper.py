@@ -5,12 +5,13 @@ v0.1.1
 
 # Note, make sure you use decimal math everywhere!
 from decimal import Decimal
-from django.core.cache import cache
 from django.template import loader, Context
 from django.utils.safestring import mark_safe 
 from django.utils.translation import ugettext as _
 from livesettings import config_get_group, config_value
 from shipping.modules.base import BaseShipper
+from shipping.packing import shipment_packages
+from shipping.quotes import get_quote_cache, shipment_signature
 import datetime
 import logging
 import urllib2
@@ -143,39 +144,46 @@ class Shipper(BaseShipper):
             'ship_type': self.service_type_code,
             'shop_details':shop_details,
         }
-        c = Context({
-                'config': configuration,
-                'cart': cart,
-                'contact': contact
-            })
-        
-        t = loader.get_template('shipping/canadapost/request.xml')
-        request = t.render(c)
         self.is_valid = False
-        
-        cache_key_response = "canadapost-cart-%s-response" % int(cart.id)
-        cache_key_request = "canadapost-cart-%s-request" % int(cart.id)
-        last_request = cache.get(cache_key_request)
-        tree = cache.get(cache_key_response)
-        
-        if (last_request != request) or tree is None:
-            self.verbose_log("Requesting from Canada Post [%s]\n%s", cache_key_request, request)
-            cache.set(cache_key_request, request, 60)
+
+        # The response lists every Canada Post service.
+        packages = shipment_packages(cart)
+        signature = shipment_signature('canadapost', shop_details, contact.shipping_address,
+            packages,
+            extra=(connection, settings.CPCID.value, settings.TURN_AROUND_TIME.value, cart.total))
+        quotes = get_quote_cache()
+        raw = quotes.get(signature)
+
+        if raw is None:
+            c = Context({
+                    'config': configuration,
+                    'cart': cart,
+                    'contact': contact,
+                    'packages': packages,
+                })
+
+            t = loader.get_template('shipping/canadapost/request.xml')
+            request = t.render(c)
+            self.verbose_log("Requesting from Canada Post [%s]\n%s", signature, request)
             tree = self._process_request(connection, request)
-            self.verbose_log("Got from Canada Post [%s]:\n%s", cache_key_response, self.raw)
+            self.verbose_log("Got from Canada Post [%s]:\n%s", signature, self.raw)
             needs_cache = True
         else:
+            self.raw = raw
+            tree = fromstring(raw)
             needs_cache = False
             
         try:
             status_code = tree.getiterator('statusCode')
             status_val = status_code[0].text
-            self.verbose_log("Canada Post Status Code for cart #%s = %s", int(cart.id), status_val)
+            self.verbose_log("Canada Post Status Code for %s = %s", signature, status_val)
         except AttributeError:
             status_val = "-1"
             
 
         if status_val == '1':
+            if needs_cache:
+                quotes.set(signature, self.raw)
             self.is_valid = False
             self._calculated = False
             all_rates = tree.getiterator('product')
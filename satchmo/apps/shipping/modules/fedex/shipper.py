@@ -14,6 +14,8 @@ from django.template import loader, Context
 from django.core.cache import cache
 
 from shipping.modules.base import BaseShipper
+from shipping.packing import shipment_packages, shipment_value, shipment_weight
+from shipping.quotes import get_quote_cache, shipment_signature
 from shipping import signals
 from livesettings import config_get_group
 
@@ -133,6 +135,24 @@ class Shipper(BaseShipper):
         all_results = f.read()
         self.raw_response = all_results
         return(minidom.parseString(all_results))
+
+    def _cached_request(self, signature, connection, render):
+        '''
+          Return the response for the shipment `signature` from the
+          quote cache, or post the request built by `render()`
+        '''
+        quotes = get_quote_cache()
+        raw = quotes.get(signature)
+        if raw is not None:
+            self.raw_response = raw
+            return minidom.parseString(raw)
+
+        request = render()
+        log.debug("Fedex request: %s", request)
+        response = self._process_request(connection, request)
+        if not response.getElementsByTagName('Error'):
+            quotes.set(signature, self.raw_response)
+        return response
     
     def calculate(self, cart, contact):
         '''
@@ -197,20 +217,16 @@ class Shipper(BaseShipper):
         # They also require that the weight be one decimal point. 
         # e.g., 1.0, 2.3, 10.4
         
+        packages = shipment_packages(cart)
+
         if settings.SINGLE_BOX.value:
             if verbose:
                 log.debug("Using single-box method for fedex calculations.")
                 
-            box_price = Decimal("0.00")
-            box_weight = Decimal("0.00")
-            for product in cart.get_shipment_list():
-                box_price += product.unit_price
-                if product.weight is None:
-                    log.warn("No weight on product (skipping for ship calculations): %s", product)
-                else:
-                    box_weight += product.weight
-                if product.weight_units and product.weight_units != "":
-                    box_weight_units = product.weight_units
+            box_price = shipment_value(packages)
+            box_weight, weight_units = shipment_weight(packages)
+            if weight_units:
+                box_weight_units = weight_units
             
             if box_weight < Decimal("0.1"):
                 log.debug("Total box weight too small, defaulting to 0.1")
@@ -228,16 +244,20 @@ class Shipper(BaseShipper):
             }
             signals.shipping_data_query.send(Shipper, shipper=self, cart=cart, shippingdata=shippingdata)
 
-            c = Context(shippingdata)
-            t = loader.get_template('shipping/fedex/request.xml')
-            request = t.render(c)
+            def render():
+                c = Context(shippingdata)
+                t = loader.get_template('shipping/fedex/request.xml')
+                return t.render(c)
+
+            signature = shipment_signature('fedex', shop_details, contact.shipping_address,
+                packages, service=self.service_type_code,
+                extra=(connection, settings.ACCOUNT.value, self.packaging, box_price))
 
             try:
-                response = self._process_request(connection, request)
+                response = self._cached_request(signature, connection, render)
                 error = self._check_for_error(response)
             
                 if verbose:
-                    log.debug("Fedex request: %s", request)
                     log.debug("Fedex response: %s", self.raw_response)
 
                 if not error:
@@ -261,25 +281,29 @@ class Shipper(BaseShipper):
             # is, a separate POST to their server.
             #
             # So, to simulate this functionality, and return a total 
-            # price, we have to loop through all of our items, and 
-            # pray the customer isn't ordering a thousand boxes of bagels.
-            for product in cart.get_shipment_list():
+            # price, we loop through the packages, and quote identical
+            # boxes once.
+            for package in packages:
                 c = Context({
                   'config': configuration,
-                  'box_weight' : '%.1f' % (product.weight or 0.0),
-                  'box_weight_units' : product.weight_units and product.weight_units.upper() or 'LB',
-                  'box_price' : '%.2f' % product.unit_price,
+                  'box_weight' : '%.1f' % (package.weight or 0.0),
+                  'box_weight_units' : package.weight_units and package.weight_units.upper() or 'LB',
+                  'box_price' : '%.2f' % package.value,
                   'contact': contact,
                 })
     
-                t = loader.get_template('shipping/fedex/request.xml')
-                request = t.render(c)
+                def render():
+                    t = loader.get_template('shipping/fedex/request.xml')
+                    return t.render(c)
 
-                response = self._process_request(connection, request)
+                signature = shipment_signature('fedex', shop_details, contact.shipping_address,
+                    [package], service=self.service_type_code,
+                    extra=(connection, settings.ACCOUNT.value, self.packaging, package.value))
+
+                response = self._cached_request(signature, connection, render)
                 error = self._check_for_error(response)
                 
                 if verbose:
-                    log.debug("Fedex request: %s", request)
                     log.debug("Fedex response: %s", self.raw_response)
 
                 if not error:
@@ -288,7 +312,7 @@ class Shipper(BaseShipper):
                     self.delivery_days = response.documentElement.getElementsByTagName('TimeInTransit')[0].firstChild.nodeValue
 
                     total_cost = this_charge + this_discount
-                    self.charges += total_cost
+                    self.charges += total_cost * package.count
                     
                 else:
                     break
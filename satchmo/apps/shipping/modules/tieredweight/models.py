@@ -290,4 +290,10 @@ class WeightTier(models.Model):
     cost = property(cost)
 
 
+from django.db.models.signals import post_delete, post_save
+from shipping.config import clear_shipping_methods
+
+post_save.connect(clear_shipping_methods, sender=Carrier)
+post_delete.connect(clear_shipping_methods, sender=Carrier)
+
 import config
@@ -13,12 +13,13 @@ unique needs.
 """
 
 from decimal import Decimal
-from django.core.cache import cache
 from django.template import Context, loader
 from django.utils.translation import ugettext as _
 from livesettings import config_get_group, config_value
 from shipping import signals
 from shipping.modules.base import BaseShipper
+from shipping.packing import expand_packages, shipment_packages, shipment_weight
+from shipping.quotes import get_quote_cache, shipment_signature
 import logging
 import urllib2
 
@@ -128,11 +129,13 @@ class Shipper(BaseShipper):
             'shop_details':shop_details,
         }
         
+        packages = shipment_packages(cart)
         shippingdata = {
             'single_box': False,
             'config': configuration,
             'contact': contact,
             'cart': cart,
+            'packages': expand_packages(packages),
             'shipping_address' : shop_details,
             'shipping_phone' : shop_details.phone,
             'shipping_country_code' : shop_details.country.iso2_code
@@ -141,16 +144,10 @@ class Shipper(BaseShipper):
         if settings.SINGLE_BOX.value:
             log.debug("Using single-box method for ups calculations.")
 
-            box_weight = Decimal("0.00")
-            for product in cart.get_shipment_list():
-                if product.smart_attr('weight') is None:
-                    log.warn("No weight on product (skipping for ship calculations): %s", product)
-                else:
-                    box_weight += product.smart_attr('weight')
-                if product.smart_attr('weight_units') and product.smart_attr('weight_units') != "":
-                    box_weight_units = product.smart_attr('weight_units')
-                else:
-                    log.warn("No weight units for product")
+            box_weight, box_weight_units = shipment_weight(packages)
+            if not box_weight_units:
+                log.warn("No weight units for products")
+                box_weight_units = "LB"
 
             if box_weight < Decimal("0.1"):
                 log.debug("Total box weight too small, defaulting to 0.1")
@@ -161,36 +158,44 @@ class Shipper(BaseShipper):
             shippingdata['box_weight_units'] = box_weight_units.upper()
 
         signals.shipping_data_query.send(Shipper, shipper=self, cart=cart, shippingdata=shippingdata)
-        c = Context(shippingdata)
-        t = loader.get_template('shipping/ups/request.xml')
-        request = t.render(c)
         self.is_valid = False
         if settings.LIVE.value:
             connection = settings.CONNECTION.value
         else:
             connection = settings.CONNECTION_TEST.value
-        cache_key_response = "ups-cart-%s-response" % int(cart.id)
-        cache_key_request = "ups-cart-%s-request" % int(cart.id)
-        last_request = cache.get(cache_key_request)
-        tree = cache.get(cache_key_response)
-
-        if (last_request != request) or tree is None:
-            self.verbose_log("Requesting from UPS [%s]\n%s", cache_key_request, request)
-            cache.set(cache_key_request, request, 60)
+
+        # The response lists the rates of every UPS service, so all of them
+        # share one quote.
+        signature = shipment_signature('ups', shop_details, contact.shipping_address,
+            packages,
+            extra=(connection, configuration['account'], container,
+                configuration['pickup'], settings.SINGLE_BOX.value))
+        quotes = get_quote_cache()
+        raw = quotes.get(signature)
+
+        if raw is None:
+            c = Context(shippingdata)
+            t = loader.get_template('shipping/ups/request.xml')
+            request = t.render(c)
+            self.verbose_log("Requesting from UPS [%s]\n%s", signature, request)
             tree = self._process_request(connection, request)
-            self.verbose_log("Got from UPS [%s]:\n%s", cache_key_response, self.raw)
+            self.verbose_log("Got from UPS [%s]:\n%s", signature, self.raw)
             needs_cache = True
         else:
+            self.raw = raw
+            tree = fromstring(raw)
             needs_cache = False
 
         try:
             status_code = tree.getiterator('ResponseStatusCode')
             status_val = status_code[0].text
-            self.verbose_log("UPS Status Code for cart #%s = %s", int(cart.id), status_val)
+            self.verbose_log("UPS Status Code for %s = %s", signature, status_val)
         except AttributeError:
             status_val = "-1"
         
         if status_val == '1':
+            if needs_cache:
+                quotes.set(signature, self.raw)
             self.is_valid = False
             self._calculated = False
             all_rates = tree.getiterator('RatedShipment')
@@ -201,9 +206,7 @@ class Shipper(BaseShipper):
                         self.delivery_days = response.find('.//GuaranteedDaysToDelivery').text
                     self.is_valid = True
                     self._calculated = True
-                    if needs_cache:
-                        cache.set(cache_key_response, tree, 60)
-                        
+
             if not self.is_valid:
                 self.verbose_log("UPS Cannot find rate for code: %s [%s]", self.service_type_code, self.service_type_text)
         
@@ -14,12 +14,13 @@ unique needs.
 
 # Note, make sure you use decimal math everywhere!
 from decimal import Decimal
-from django.core.cache import cache
 from django.template import Context, loader
 from django.utils.translation import ugettext as _
 from l10n.models import Country
 from livesettings import config_get_group, config_value
 from shipping.modules.base import BaseShipper
+from shipping.packing import shipment_packages, shipment_weight
+from shipping.quotes import get_quote_cache, shipment_signature
 import logging
 import urllib2
 try:
@@ -181,33 +182,35 @@ class Shipper(BaseShipper):
         conn = urllib2.Request(url=connection, data=data)
         f = urllib2.urlopen(conn)
         all_results = f.read()
+        self.raw = all_results
 
         log.error(all_results)
 
         return (fromstring(all_results))
 
-    def render_template(self, template, cart=None, contact=None):
-        from satchmo_store.shop.models import Config
-        shop_details = Config.objects.get_current()
-        settings =  config_get_group('shipping.modules.usps')
-
+    def _get_mail_type(self):
+        """Return the USPS mail type, and set the delivery API to use for it."""
         if not self.is_intl:
             mail_type = CODES[self.service_type_code]
-            if mail_type == 'INTL': return ''
-        
-            if mail_type == 'FIRST CLASS':
+            if mail_type == 'FIRST CLASS' or mail_type == 'INTL':
                 self.api = None
             else:
                 self.api = APIS[mail_type]
         else:
             mail_type = None
             self.api = None
-        
+        return mail_type
+
+    def render_template(self, template, cart=None, contact=None):
+        from satchmo_store.shop.models import Config
+        shop_details = Config.objects.get_current()
+        settings =  config_get_group('shipping.modules.usps')
+
+        mail_type = self._get_mail_type()
+        if mail_type == 'INTL': return ''
+
         # calculate the weight of the entire order
-        weight = Decimal('0.0')
-        for item in cart.cartitem_set.all():
-            if item.product.smart_attr('weight'):
-                weight += item.product.smart_attr('weight') * item.quantity
+        weight = shipment_weight(shipment_packages(cart))[0]
         self.verbose_log('WEIGHT: %s' % weight)
 
         # I don't know why USPS made this one API different this way...
@@ -256,7 +259,6 @@ class Shipper(BaseShipper):
             template = 'shipping/usps/request.xml'
         else:
             template = 'shipping/usps/request_intl.xml'
-        request = self.render_template(template, cart, contact)
         self.is_valid = False
 
         if settings.LIVE.value:
@@ -264,25 +266,33 @@ class Shipper(BaseShipper):
         else:
             connection = settings.CONNECTION_TEST.value
 
-        cache_key_response = "usps-cart-%s-response" % int(cart.id)
-        cache_key_request = "usps-cart-%s-request" % int(cart.id)
-        last_request = cache.get(cache_key_request)
-
-        tree = cache.get(cache_key_response)
-
-        if (last_request != request) or tree is None:
-            self.verbose_log("Requesting from USPS [%s]\n%s", cache_key_request, request)
-            cache.set(cache_key_request, request, 60)
+        # Domestic requests are made per mail type, international ones list
+        # every service, and declare the value of the cart.
+        extra = (connection, settings.USER_ID.value, settings.SHIPPING_CONTAINER.value)
+        if self.is_intl:
+            extra += (cart.total,)
+        signature = shipment_signature('usps', shop_details, contact.shipping_address,
+            shipment_packages(cart), service=self._get_mail_type(), extra=extra)
+        quotes = get_quote_cache()
+        raw = quotes.get(signature)
+
+        if raw is None:
+            request = self.render_template(template, cart, contact)
+            self.verbose_log("Requesting from USPS [%s]\n%s", signature, request)
             tree = self._process_request(connection, request)
-            self.verbose_log("Got from USPS [%s]:\n%s", cache_key_response, self.raw)
+            self.verbose_log("Got from USPS [%s]:\n%s", signature, self.raw)
             needs_cache = True
         else:
+            self.raw = raw
+            tree = fromstring(raw)
             needs_cache = False
 
         errors = tree.getiterator('Error')
 
         # if USPS returned no error, return the prices
         if errors == None or len(errors) == 0:
+            if needs_cache:
+                quotes.set(signature, self.raw)
             # check for domestic results first
             all_packages = tree.getiterator('RateV3Response')
 
@@ -302,8 +312,6 @@ class Shipper(BaseShipper):
                             self._calculated = True
                             self.exact_date = True
 
-                            #if needs_cache:
-                            #    cache.set(cache_key_response, tree, 60)
             else:
                 for package in all_packages:
                     for postage in package.getiterator('Postage'):
@@ -313,8 +321,16 @@ class Shipper(BaseShipper):
 
                             # Now try to figure out how long it would take for this delivery
                             if self.api:
-                                delivery = self.render_template('shipping/usps/delivery.xml', cart, contact)
-                                del_tree = self._process_request(connection, delivery, self.api)
+                                del_signature = "%s-%s" % (signature, self.api)
+                                del_raw = quotes.get(del_signature)
+                                if del_raw is None:
+                                    delivery = self.render_template('shipping/usps/delivery.xml', cart, contact)
+                                    del_tree = self._process_request(connection, delivery, self.api)
+                                    del_errors = del_tree.getiterator('Error')
+                                    if del_errors == None or len(del_errors) == 0:
+                                        quotes.set(del_signature, self.raw)
+                                else:
+                                    del_tree = fromstring(del_raw)
                                 parent = '%sResponse' % self.api
                                 del_iter = del_tree.getiterator(parent)
 
@@ -333,8 +349,6 @@ class Shipper(BaseShipper):
                             self.is_valid = True
                             self._calculated = True
 
-                            #if needs_cache:
-                            #    cache.set(cache_key_response, tree, 60)
         else:
             error = errors[0]
             err_num = error.find('.//Number').text
@@ -0,0 +1,305 @@
+"""Packing a cart into the packages the carriers quote.
+
+`Cart.get_shipment_list` returns the product once for every unit in the
+cart, so the carrier modules read the weight and price of a product again
+for each unit, and FedEx, in its one request per box mode, made a request
+per unit.  The carriers quote `shipment_packages` instead.
+
+`shipment_lines` reads the weight, dimensions and price of each shippable
+product once, with the quantity of the product in the cart.  `ShipmentBuilder`
+packs the lines into the box types of the `SHIPPING.BOX_TYPES` setting, first
+fit decreasing: the heaviest, then bulkiest, products first, each one first
+into the boxes already opened, then into new boxes.  A box holds products up
+to its maximum weight and its volume, and only products which fit its
+dimensions, in any orientation.  Boxes which are filled with a single product
+are counted instead of repeated, so a line of 500 units becomes one `Package`
+with a `count`, and packing takes the same time whatever the quantities.
+
+Products which fit no box type, or all of them when no box types are set,
+ship in their own package, as before.  The box sizes and weights are in the
+units of the products.
+"""
+from decimal import Decimal
+from livesettings import config_value_safe
+import logging
+
+log = logging.getLogger('shipping.packing')
+
+ZERO = Decimal('0')
+
+def _decimal(value):
+    if value is None or value == '':
+        return None
+    try:
+        return Decimal(str(value))
+    except Exception:
+        return None
+
+class ShipmentLine(object):
+    """A shippable product and its quantity, with the attributes the packing
+    needs read once."""
+
+    def __init__(self, product, quantity):
+        self.product = product
+        self.quantity = quantity
+        self.name = product.name
+        self.weight = _decimal(product.smart_attr('weight'))
+        self.weight_units = product.smart_attr('weight_units')
+        self.length_units = product.smart_attr('length_units')
+        self.unit_price = product.unit_price
+        dimensions = [_decimal(product.smart_attr(attr)) for attr in ('length', 'width', 'height')]
+        self.length, self.width, self.height = dimensions
+        if None in dimensions:
+            self.dimensions = None
+            self.volume = None
+        else:
+            self.dimensions = tuple(sorted(dimensions))
+            self.volume = dimensions[0] * dimensions[1] * dimensions[2]
+
+class BoxType(object):
+    """A box the shop ships in, with its inside dimensions and the most
+    weight it holds.  Unknown limits are None."""
+
+    def __init__(self, name, length=None, width=None, height=None, max_weight=None):
+        self.name = name
+        dimensions = [_decimal(value) for value in (length, width, height)]
+        if None in dimensions:
+            self.length = self.width = self.height = None
+            self.dimensions = None
+            self.volume = None
+        else:
+            self.length, self.width, self.height = dimensions
+            self.dimensions = tuple(sorted(dimensions))
+            self.volume = dimensions[0] * dimensions[1] * dimensions[2]
+        self.max_weight = _decimal(max_weight)
+
+    def fits(self, line):
+        """Whether a unit of `line` fits in an empty box."""
+        if self.dimensions and line.dimensions:
+            for inside, outside in zip(self.dimensions, line.dimensions):
+                if outside > inside:
+                    return False
+        if self.max_weight and line.weight and line.weight > self.max_weight:
+            return False
+        return True
+
+    def room(self, line, weight=ZERO, volume=ZERO):
+        """How many units of `line` still go in a box holding `weight` and
+        `volume`, or None for any number."""
+        room = None
+        if self.max_weight and line.weight:
+            room = int((self.max_weight - weight) / line.weight)
+        if self.volume and line.volume:
+            byvolume = int((self.volume - volume) / line.volume)
+            if room is None or byvolume < room:
+                room = byvolume
+        if room is not None and room < 0:
+            room = 0
+        return room
+
+    def __repr__(self):
+        return "<BoxType %s>" % self.name
+
+class Package(object):
+    """`count` identical packages, each a box, or a product shipped on its
+    own, holding the `items`, a list of lines and quantities.
+
+    Packages have the attributes of a product which the carrier modules and
+    `shipment_signature` read, with `smart_attr`.
+    """
+
+    def __init__(self, box=None, count=1):
+        self.box = box
+        self.count = count
+        self.items = []
+        self.weight = ZERO
+        self.volume = ZERO
+        self.value = ZERO
+        self.quantity = 0
+        self.weight_units = None
+        self.length_units = None
+
+    def add(self, line, quantity):
+        self.items.append((line, quantity))
+        if line.weight:
+            self.weight += line.weight * quantity
+        if line.volume:
+            self.volume += line.volume * quantity
+        self.value += line.unit_price * quantity
+        self.quantity += quantity
+        if not self.weight_units and line.weight_units:
+            self.weight_units = line.weight_units
+        if not self.length_units and line.length_units:
+            self.length_units = line.length_units
+
+    def room(self, line):
+        if not self.box.fits(line):
+            return 0
+        return self.box.room(line, self.weight, self.volume)
+
+    def _get_name(self):
+        if self.box is not None:
+            return self.box.name
+        return self.items[0][0].name
+
+    name = property(_get_name)
+
+    def _get_dimensions(self):
+        if self.box is not None:
+            return (self.box.length, self.box.width, self.box.height)
+        line = self.items[0][0]
+        return (line.length, line.width, line.height)
+
+    def _get_length(self):
+        return self._get_dimensions()[0]
+
+    def _get_width(self):
+        return self._get_dimensions()[1]
+
+    def _get_height(self):
+        return self._get_dimensions()[2]
+
+    length = property(_get_length)
+    width = property(_get_width)
+    height = property(_get_height)
+
+    def _has_full_dimensions(self):
+        return None not in self._get_dimensions() and bool(self.length_units)
+
+    has_full_dimensions = property(_has_full_dimensions)
+
+    def _has_full_weight(self):
+        return bool(self.weight) and bool(self.weight_units)
+
+    has_full_weight = property(_has_full_weight)
+
+    def smart_attr(self, attr):
+        if attr in ('width_units', 'height_units'):
+            attr = 'length_units'
+        return getattr(self, attr, None)
+
+    def __repr__(self):
+        return "<Package %s x%i: %s>" % (self.name, self.count,
+            ", ".join(["%s x%i" % (line.name, quantity) for line, quantity in self.items]))
+
+def get_box_types():
+    """The box types of the `SHIPPING.BOX_TYPES` setting, one per line as
+    "name, length, width, height, maximum weight"."""
+    boxes = []
+    for row in (config_value_safe('SHIPPING', 'BOX_TYPES', '') or '').splitlines():
+        row = row.strip()
+        if not row:
+            continue
+        parts = [part.strip() for part in row.split(',')]
+        if len(parts) != 5:
+            log.warn('Ignoring box type, expecting "name, length, width, height, maximum weight": %s', row)
+            continue
+        box = BoxType(*parts)
+        if box.dimensions is None and box.max_weight is None:
+            log.warn('Ignoring box type without dimensions or weight: %s', row)
+            continue
+        boxes.append(box)
+    return boxes
+
+class ShipmentBuilder(object):
+    """Packs shipment lines into `boxes`, by default the box types of the
+    shipping settings."""
+
+    def __init__(self, boxes=None):
+        if boxes is None:
+            boxes = get_box_types()
+        self.boxes = boxes
+
+    def pack(self, lines):
+        """Return the packages of `lines`, heaviest products first."""
+        lines = sorted(lines, key=lambda line: (line.weight or ZERO, line.volume or ZERO), reverse=True)
+        packages = []
+        opened = []
+        for line in lines:
+            remaining = line.quantity
+            boxes = [box for box in self.boxes if box.fits(line)]
+            if not boxes:
+                package = Package(count=remaining)
+                package.add(line, 1)
+                packages.append(package)
+                continue
+
+            # first fit into the boxes opened for the previous products
+            for package in opened:
+                if not remaining:
+                    break
+                room = package.room(line)
+                if room is None or room > remaining:
+                    room = remaining
+                if room:
+                    package.add(line, room)
+                    remaining -= room
+            if not remaining:
+                continue
+
+            # fill the boxes holding the most units, and put the rest into
+            # the smallest box which holds it
+            capacities = [(box.room(line), box) for box in boxes]
+            unlimited = [box for room, box in capacities if room is None]
+            if unlimited:
+                per_box = remaining
+                box = unlimited[0]
+            else:
+                per_box, box = max(capacities, key=lambda pair: pair[0])
+            full, rest = divmod(remaining, per_box)
+            if full:
+                package = Package(box, count=full)
+                package.add(line, per_box)
+                packages.append(package)
+            if rest:
+                holding = [box for room, box in capacities if room is None or room >= rest]
+                box = min(holding, key=lambda box: (box.volume or ZERO, box.max_weight or ZERO))
+                package = Package(box)
+                package.add(line, rest)
+                opened.append(package)
+
+        return packages + opened
+
+def shipment_lines(cart):
+    """The shippable products of `cart`, each once, with their quantities."""
+    if hasattr(cart, 'get_shipment_lines'):
+        pairs = cart.get_shipment_lines()
+    else:
+        # carts which only list every unit
+        pairs = []
+        byid = {}
+        for product in cart.get_shipment_list():
+            if product.id in byid:
+                pairs[byid[product.id]][1] += 1
+            else:
+                byid[product.id] = len(pairs)
+                pairs.append([product, 1])
+    return [ShipmentLine(product, quantity) for product, quantity in pairs]
+
+def shipment_packages(cart, boxes=None):
+    """The packages to ship the products of `cart` in, see `ShipmentBuilder`."""
+    return ShipmentBuilder(boxes=boxes).pack(shipment_lines(cart))
+
+def expand_packages(packages):
+    """List each of the `count` identical packages, for the carriers which
+    want every box in the request."""
+    expanded = []
+    for package in packages:
+        expanded.extend([package] * package.count)
+    return expanded
+
+def shipment_weight(packages):
+    """The weight of `packages` and the weight units of the first of them."""
+    weight = ZERO
+    units = None
+    for package in packages:
+        weight += package.weight * package.count
+        if not units:
+            units = package.weight_units
+    return weight, units
+
+def shipment_value(packages):
+    value = ZERO
+    for package in packages:
+        value += package.value * package.count
+    return value
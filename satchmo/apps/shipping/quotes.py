@@ -0,0 +1,357 @@
+"""Concurrent and cached shipping quotes.
+
+Carrier modules such as UPS, FedEx, USPS and Canada Post make a blocking
+HTTP request in `calculate`.  `quote_methods` runs the `calculate` calls on a
+small pool of worker threads, so quoting takes about as long as the slowest
+carrier instead of the sum of all of them.  Carriers which raise an error or
+don't answer within the timeout are left out.
+
+The carriers keep their responses in a `QuoteCache`, keyed by a
+`shipment_signature` of what the rate depends on, so rendering the shipping
+step again doesn't ask the carrier again.
+"""
+from decimal import Decimal
+from django.db import connection
+from django.utils.encoding import smart_str
+from django.utils.hashcompat import md5_constructor
+from livesettings import config_value_safe
+from threaded_multihost import threadlocals
+import copy
+import Queue
+import logging
+import threading
+import time
+
+log = logging.getLogger('shipping.quotes')
+
+def _shared_database():
+    """False for an in-memory SQLite database, which other threads can't see."""
+    settings_dict = connection.settings_dict
+    return not (settings_dict['ENGINE'].endswith('sqlite3')
+        and settings_dict['NAME'] in ('', ':memory:'))
+
+class QuoteJob(object):
+    """The state of a single shipping method's `calculate` call."""
+
+    def __init__(self, method):
+        self.method = method
+        self.started = None
+        self.finished = False
+        self.timed_out = False
+        self.error = None
+
+    def _ok(self):
+        return self.finished and not self.timed_out and self.error is None
+
+    ok = property(_ok)
+
+class ShippingQuoter(object):
+    """Calculates a list of shipping methods on a bounded pool of threads.
+
+    `workers` and `timeout` (in seconds) default to the `SHIPPING.QUOTE_WORKERS`
+    and `SHIPPING.QUOTE_TIMEOUT` settings.  The timeout of a method starts
+    when a worker picks it up.  A worker which times out is abandoned, not
+    killed, so its method is never used afterwards.
+
+    With a single worker the methods are calculated one after the other in
+    the calling thread, and the timeout isn't enforced.
+    """
+
+    def __init__(self, workers=None, timeout=None):
+        if workers is None:
+            workers = config_value_safe('SHIPPING', 'QUOTE_WORKERS', 4)
+            if not _shared_database():
+                workers = 1
+        if timeout is None:
+            timeout = config_value_safe('SHIPPING', 'QUOTE_TIMEOUT', 15)
+
+        self.workers = max(1, int(workers))
+        self.timeout = float(timeout)
+        self.jobs = []
+
+    def quote(self, methods, cart, contact):
+        """Calculate each method for the cart and contact, and return the
+        ones which succeeded in time, in their original order."""
+        self.jobs = [QuoteJob(method) for method in methods]
+        if self.workers == 1 or len(self.jobs) < 2:
+            for job in self.jobs:
+                self._calculate(job, cart, contact)
+                job.finished = True
+        else:
+            self._quote_threaded(cart, contact)
+
+        for job in self.jobs:
+            if job.timed_out:
+                log.warn('Shipping method %s did not answer within %s seconds, skipping it', job.method.id, self.timeout)
+        return [job.method for job in self.jobs if job.ok]
+
+    def _get_failed(self):
+        return [job.method for job in self.jobs if not job.ok]
+
+    failed = property(_get_failed)
+
+    def _calculate(self, job, cart, contact):
+        job.started = time.time()
+        try:
+            job.method.calculate(cart, contact)
+        except Exception, e:
+            log.error('Error calculating shipping method %s: %s', job.method.id, e)
+            job.error = e
+
+    def _quote_threaded(self, cart, contact):
+        queue = Queue.Queue()
+        for job in self.jobs:
+            queue.put(job)
+
+        condition = threading.Condition()
+        request = threadlocals.get_current_request()
+        poolsize = min(self.workers, len(self.jobs))
+        for i in range(poolsize):
+            worker = threading.Thread(target=self._work,
+                args=(queue, condition, request, cart, contact))
+            worker.setDaemon(True)
+            worker.start()
+
+        # jobs waiting for a free worker give up once every round of workers
+        # could have used its full timeout
+        rounds = (len(self.jobs) + poolsize - 1) / poolsize
+        deadline = time.time() + self.timeout * rounds
+
+        condition.acquire()
+        try:
+            while True:
+                now = time.time()
+                wait = None
+                for job in self.jobs:
+                    if job.finished or job.timed_out:
+                        continue
+                    if job.started is None:
+                        expires = deadline
+                    else:
+                        expires = job.started + self.timeout
+                    if expires <= now:
+                        job.timed_out = True
+                    elif wait is None or expires - now < wait:
+                        wait = expires - now
+                if wait is None:
+                    break
+                condition.wait(wait)
+        finally:
+            condition.release()
+
+    def _work(self, queue, condition, request, cart, contact):
+        # carry the request over, multihost looks up the current site with it
+        threadlocals.set_thread_variable('request', request)
+        try:
+            while True:
+                try:
+                    job = queue.get_nowait()
+                except Queue.Empty:
+                    break
+
+                condition.acquire()
+                try:
+                    if job.timed_out:
+                        continue
+                    job.started = time.time()
+                finally:
+                    condition.release()
+
+                self._calculate(job, cart, contact)
+
+                condition.acquire()
+                try:
+                    job.finished = True
+                    condition.notifyAll()
+                finally:
+                    condition.release()
+        finally:
+            # each thread gets its own database connection, don't leak it
+            connection.close()
+
+def quote_methods(methods, cart, contact, workers=None, timeout=None):
+    """Calculate `methods` concurrently, see `ShippingQuoter`."""
+    return ShippingQuoter(workers=workers, timeout=timeout).quote(methods, cart, contact)
+
+class QuoteCache(object):
+    """A thread safe LRU cache of carrier responses, which expire after `ttl` seconds.
+
+    `hits` and `misses` count the lookups since the cache was created or
+    cleared.
+    """
+
+    def __init__(self, maxsize=1000, ttl=600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._data = {}
+            self._tick = 0
+            self.hits = 0
+            self.misses = 0
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        """Return the cached value for `key`, or None."""
+        self._lock.acquire()
+        try:
+            entry = self._data.get(key, None)
+            if entry is not None:
+                expires, value, used = entry
+                if expires > time.time():
+                    self.hits += 1
+                    self._tick += 1
+                    self._data[key] = (expires, value, self._tick)
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return None
+        finally:
+            self._lock.release()
+
+    def set(self, key, value):
+        if self.maxsize < 1 or self.ttl < 1:
+            return
+        self._lock.acquire()
+        try:
+            if not key in self._data:
+                while len(self._data) >= self.maxsize:
+                    self._evict()
+            self._tick += 1
+            self._data[key] = (time.time() + self.ttl, value, self._tick)
+        finally:
+            self._lock.release()
+
+    def _evict(self):
+        now = time.time()
+        oldest = None
+        for key, (expires, value, used) in self._data.items():
+            if expires <= now:
+                del self._data[key]
+                return
+            if oldest is None or used < oldest[1]:
+                oldest = (key, used)
+        del self._data[oldest[0]]
+
+    def stats(self):
+        return {
+            'hits' : self.hits,
+            'misses' : self.misses,
+            'size' : len(self._data),
+            'maxsize' : self.maxsize,
+            'ttl' : self.ttl,
+        }
+
+_QUOTE_CACHE = None
+
+def get_quote_cache():
+    """Return the process wide `QuoteCache`, sized by the `SHIPPING.QUOTE_CACHE_SIZE`
+    and `SHIPPING.QUOTE_CACHE_TTL` settings."""
+    global _QUOTE_CACHE
+    maxsize = config_value_safe('SHIPPING', 'QUOTE_CACHE_SIZE', 1000)
+    ttl = config_value_safe('SHIPPING', 'QUOTE_CACHE_TTL', 600)
+    cache = _QUOTE_CACHE
+    if cache is None or cache.maxsize != maxsize or cache.ttl != ttl:
+        cache = QuoteCache(maxsize=maxsize, ttl=ttl)
+        _QUOTE_CACHE = cache
+    return cache
+
+def _normalize(value):
+    if value is None:
+        return ''
+    if isinstance(value, (Decimal, float, int, long)):
+        value = Decimal(str(value)).normalize()
+    return smart_str(value).strip().upper()
+
+def _place(address):
+    if address is None:
+        return ('', '')
+    postal_code = ''.join(_normalize(address.postal_code).split())
+    country = getattr(address, 'country', None)
+    if country is not None and not isinstance(country, basestring):
+        country = country.iso2_code
+    return (postal_code, _normalize(country))
+
+def shipment_signature(carrier, origin, destination, products, service=None, extra=()):
+    """Return the quote cache key for shipping `products` from `origin` to `destination`.
+
+    `origin` and `destination` need `postal_code` and `country` attributes, as
+    the shop `Config` and an `AddressBook` entry have.  Each product is a
+    package, described by its weight and dimensions, or a `Package` of
+    `shipping.packing`, which also has a `count`.  `service` is the carrier
+    service code, for carriers which quote a single service per request, and
+    `extra` holds anything else the carrier's rate depends on, such as the
+    account or the packaging type.
+    """
+    packages = []
+    for product in products:
+        packages.append(tuple([_normalize(product.smart_attr(attr)) for attr in
+            ('weight', 'weight_units', 'length', 'width', 'height', 'length_units')])
+            + (getattr(product, 'count', 1),))
+    packages.sort()
+
+    key = (_place(origin), _place(destination), tuple(packages),
+        tuple([_normalize(value) for value in extra]))
+    return "%s-%s-%s" % (carrier, _normalize(service), md5_constructor(repr(key)).hexdigest())
+
+class _WarmupAddress(object):
+    def __init__(self, postal_code, country):
+        self.postal_code = postal_code
+        self.country = country
+        self.street1 = self.street2 = self.city = self.state = ''
+
+class _WarmupContact(object):
+    full_name = ''
+    primary_phone = None
+
+    def __init__(self, address):
+        self.shipping_address = self.billing_address = address
+
+class _WarmupCart(object):
+    """Just enough of a cart for the carrier modules to quote."""
+    id = None
+    is_shippable = True
+
+    def __init__(self, products):
+        self.products = list(products)
+        self.total = Decimal("0")
+        for product in self.products:
+            self.total += product.unit_price
+
+    def get_shipment_list(self):
+        return list(self.products)
+
+    def get_shipment_lines(self):
+        return [(product, 1) for product in self.products]
+
+def warm_quote_cache(destinations, products, methods=None, workers=None, timeout=None):
+    """Quote shipping `products` to each of `destinations` to fill the quote cache.
+
+    `destinations` is a list of (postal code, `Country`) pairs, and `methods`
+    defaults to the active shipping methods.  Returns the number of quotes
+    that succeeded.
+    """
+    from shipping.config import shipping_methods
+
+    if methods is None:
+        methods = shipping_methods()
+    cart = _WarmupCart(products)
+
+    ct = 0
+    for postal_code, country in destinations:
+        contact = _WarmupContact(_WarmupAddress(postal_code, country))
+        quoted = quote_methods([copy.copy(method) for method in methods], cart, contact,
+            workers=workers, timeout=timeout)
+        for method in quoted:
+            if method.valid():
+                ct += 1
+    log.debug('Warmed the shipping quote cache with %i quotes', ct)
+    return ct
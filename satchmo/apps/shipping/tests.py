@@ -1,11 +1,21 @@
 from decimal import Decimal
 from django.contrib.sites.models import Site
 from django.test import TestCase
+from livesettings import config_get
 from product.models import Product
+from shipping.config import shipping_method_by_key, shipping_registry, ShippingModuleNotFound
 from satchmo_store.shop.models import Cart
+from shipping.modules.base import BaseShipper
 from shipping.modules.flat.shipper import Shipper as flat
 from shipping.modules.per.shipper import Shipper as per
+from shipping.packing import BoxType, ShipmentBuilder, ShipmentLine, shipment_value, shipment_weight
+from shipping.quotes import QuoteCache, ShippingQuoter, shipment_signature
+import BaseHTTPServer
+import SocketServer
 import keyedcache
+import threading
+import time
+import urllib2
 
 class ShippingBaseTest(TestCase):
 
@@ -28,3 +38,187 @@ class ShippingBaseTest(TestCase):
         self.assert_(self.cart1.is_shippable)
         self.assertEqual(flat(self.cart1, None).cost(), Decimal("4.00"))
         self.assertEqual(per(self.cart1, None).cost(), Decimal("12.00"))
+
+class StubCarrierServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class StubCarrierHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers /<seconds>/<status> after sleeping for that long."""
+
+    def do_GET(self):
+        delay, status = self.path.strip('/').split('/')
+        time.sleep(float(delay))
+        self.send_response(int(status))
+        self.end_headers()
+        self.wfile.write('10.00')
+
+    def log_message(self, *args):
+        pass
+
+class StubCarrier(BaseShipper):
+    def __init__(self, url):
+        self.id = url
+        self.url = url
+        super(StubCarrier, self).__init__()
+
+    def calculate(self, cart, contact):
+        super(StubCarrier, self).calculate(cart, contact)
+        self.charges = Decimal(urllib2.urlopen(self.url).read())
+
+class QuoteTest(TestCase):
+
+    def setUp(self):
+        self.server = StubCarrierServer(('127.0.0.1', 0), StubCarrierHandler)
+        self.base = 'http://127.0.0.1:%i' % self.server.server_address[1]
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def carriers(self, *paths):
+        return [StubCarrier(self.base + path) for path in paths]
+
+    def test_concurrent(self):
+        quoter = ShippingQuoter(workers=3, timeout=5)
+        start = time.time()
+        quoted = quoter.quote(self.carriers('/0.5/200', '/0.5/200', '/0.5/200'), None, None)
+        self.assertEqual(len(quoted), 3)
+        self.assert_(time.time() - start < 1.4)
+        for carrier in quoted:
+            self.assertEqual(carrier.charges, Decimal("10.00"))
+
+    def test_slow_and_failing(self):
+        carriers = self.carriers('/0/200', '/3/200', '/0/500')
+        quoter = ShippingQuoter(workers=3, timeout=1)
+        start = time.time()
+        quoted = quoter.quote(carriers, None, None)
+        self.assert_(time.time() - start < 2.5)
+        self.assertEqual(quoted, carriers[:1])
+        self.assertEqual(quoter.failed, carriers[1:])
+        self.assert_(quoter.jobs[1].timed_out)
+        self.assert_(isinstance(quoter.jobs[2].error, urllib2.HTTPError))
+
+    def test_serial(self):
+        carriers = self.carriers('/0/200', '/0/500')
+        quoted = ShippingQuoter(workers=1).quote(carriers, None, None)
+        self.assertEqual(quoted, carriers[:1])
+
+class StubPackage(object):
+    def __init__(self, weight, units='LB'):
+        self.attrs = {'weight' : weight, 'weight_units' : units}
+
+    def smart_attr(self, attr):
+        return self.attrs.get(attr, None)
+
+class StubAddress(object):
+    def __init__(self, postal_code, country):
+        self.postal_code = postal_code
+        self.country = country
+
+class QuoteCacheTest(TestCase):
+
+    def test_signature(self):
+        origin = StubAddress('66044', 'US')
+        packages = [StubPackage(Decimal('1.50')), StubPackage(2)]
+        sig = shipment_signature('ups', origin, StubAddress('90210', 'US'), packages)
+
+        same = shipment_signature('ups', origin, StubAddress(' 90210', 'us'),
+            [StubPackage(Decimal('2.0')), StubPackage('1.5', 'lb')])
+        self.assertEqual(sig, same)
+
+        self.assertNotEqual(sig, shipment_signature('ups', origin, StubAddress('90211', 'US'), packages))
+        self.assertNotEqual(sig, shipment_signature('ups', origin, StubAddress('90210', 'US'), packages[:1]))
+        self.assertNotEqual(sig, shipment_signature('ups', origin, StubAddress('90210', 'US'), packages, service='03'))
+
+    def test_lru(self):
+        cache = QuoteCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 3)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['size'], 2)
+
+    def test_ttl(self):
+        cache = QuoteCache(maxsize=2, ttl=1)
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        time.sleep(1.1)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(len(cache), 0)
+
+class StubProduct(object):
+    def __init__(self, name, weight, length=None, width=None, height=None, unit_price='1.00'):
+        self.name = name
+        self.unit_price = Decimal(unit_price)
+        self.attrs = {'weight' : weight, 'weight_units' : 'lb', 'length' : length,
+            'width' : width, 'height' : height, 'length_units' : 'in'}
+
+    def smart_attr(self, attr):
+        return self.attrs.get(attr, None)
+
+class PackingTest(TestCase):
+
+    def setUp(self):
+        self.boxes = [BoxType('small', 10, 10, 10, 20), BoxType('large', 20, 20, 20, 50)]
+
+    def test_own_packages(self):
+        line = ShipmentLine(StubProduct('shirt', Decimal('0.5')), 500)
+        packages = ShipmentBuilder(boxes=[]).pack([line])
+        self.assertEqual(len(packages), 1)
+        self.assertEqual(packages[0].count, 500)
+        self.assertEqual(packages[0].weight, Decimal('0.5'))
+        self.assertEqual(packages[0].name, 'shirt')
+        self.assertEqual(shipment_weight(packages), (Decimal('250.0'), 'lb'))
+        self.assertEqual(shipment_value(packages), Decimal('500.00'))
+
+    def test_first_fit_decreasing(self):
+        heavy = ShipmentLine(StubProduct('heavy', 2, 5, 5, 5), 503)
+        light = ShipmentLine(StubProduct('light', 1, 4, 4, 4), 2)
+        huge = ShipmentLine(StubProduct('huge', 1, 30, 5, 5), 3)
+        packages = ShipmentBuilder(boxes=self.boxes).pack([light, huge, heavy])
+
+        self.assertEqual([(p.name, p.count, p.quantity) for p in packages],
+            [('large', 20, 25), ('huge', 3, 1), ('small', 1, 5)])
+        # the light products go into the box opened for the rest of the heavy ones
+        self.assertEqual([(line.name, quantity) for line, quantity in packages[2].items],
+            [('heavy', 3), ('light', 2)])
+        self.assertEqual(packages[2].weight, Decimal('8'))
+        self.assertEqual(shipment_weight(packages)[0], Decimal('1011'))
+
+    def test_quantity(self):
+        line = ShipmentLine(StubProduct('heavy', 2, 5, 5, 5), 1000000)
+        packages = ShipmentBuilder(boxes=self.boxes).pack([line])
+        self.assertEqual([(p.name, p.count, p.quantity) for p in packages], [('large', 40000, 25)])
+
+class ShippingRegistryTest(TestCase):
+
+    def tearDown(self):
+        keyedcache.cache_delete()
+        shipping_registry.clear()
+
+    def test_methods(self):
+        methods = shipping_registry.methods()
+        again = shipping_registry.methods()
+        self.assertEqual([m.id for m in methods], [m.id for m in again])
+        self.assert_(methods[0] is not again[0])
+
+        method = shipping_method_by_key(methods[0].id)
+        self.assertEqual(method.id, methods[0].id)
+        self.assert_(method is not methods[0])
+        self.assertRaises(ShippingModuleNotFound, shipping_method_by_key, 'no-such-method')
+
+    def test_cleared_on_settings_change(self):
+        shipping_registry.methods()
+        self.assert_(shipping_registry._state is not None)
+        config_get('SHIPPING', 'HIDING').update('YES')
+        self.assert_(shipping_registry._state is None)
@@ -35,6 +35,13 @@ class TaxRate(models.Model):
     class Meta:
         verbose_name = _("Tax Rate")
         verbose_name_plural = _("Tax Rates")
-        
+
+from django.db.models.signals import post_delete, post_save
+from rates import area_rates_changed
+
+for model in (TaxRate, TaxClass, AdminArea, Country):
+    post_save.connect(area_rates_changed, sender=model)
+    post_delete.connect(area_rates_changed, sender=model)
+
 import config
 
@@ -1,10 +1,7 @@
 from decimal import Decimal
 from django.core.exceptions import ImproperlyConfigured
-from django.db.models import Q
-from l10n.models import AdminArea, Country
 from livesettings import config_value
-from models import TaxRate
-from product.models import TaxClass
+from rates import get_rate_table
 from satchmo_store.contact.models import Contact
 from satchmo_utils import is_string_like
 import logging
@@ -22,10 +19,36 @@ class Processor(object):
         """
         self.order = order
         self.user = user
-        
+        self._locations = {}
+        self._table = None
+
+    def _get_table(self):
+        if self._table is None:
+            self._table = get_rate_table()
+        return self._table
+
+    table = property(_get_table)
+
     def _get_location(self):
-        area=country=None
+        """Return the ids of the admin area and the country to tax for."""
         calc_by_ship_address = bool(config_value('TAX','TAX_AREA_ADDRESS') == 'ship')
+        # get_rate is called once per tax class, only look the address up once
+        if self.order:
+            if calc_by_ship_address:
+                key = (self.order.ship_state, self.order.ship_country)
+            else:
+                key = (self.order.bill_state, self.order.bill_country)
+        elif self.user and self.user.is_authenticated():
+            key = (calc_by_ship_address, self.user.pk)
+        else:
+            key = None
+
+        if not key in self._locations:
+            self._locations[key] = self._find_location(calc_by_ship_address)
+        return self._locations[key]
+
+    def _find_location(self, calc_by_ship_address):
+        area=country=None
         if self.order:
             if calc_by_ship_address:
                 country = self.order.ship_country
@@ -35,49 +58,34 @@ class Processor(object):
                 area = self.order.bill_state
         
             if country:
-                try:
-                    country = Country.objects.get(iso2_code__exact=country)
-                except Country.DoesNotExist:
-                    log.info("Couldn't find Country from string: %s", country)
-                    country = None
+                iso2_code = country
+                country = self.table.country(iso2_code)
+                if country is None:
+                    log.info("Couldn't find Country from string: %s", iso2_code)
         
         elif self.user and self.user.is_authenticated():
             try:
                 contact = Contact.objects.get(user=self.user)
-                try:
-                    if calc_by_ship_address:
-                        area = contact.shipping_address.state
-                    else:
-                        area = contact.billing_address.state
-                except AttributeError:
-                    pass
-                try:
-                    if calc_by_ship_address:
-                        country = contact.shipping_address.country
-                    else:
-                        country = contact.billing_address.country
-                except AttributeError:
-                    pass
+                if calc_by_ship_address:
+                    address = contact.shipping_address
+                else:
+                    address = contact.billing_address
+                if address is not None:
+                    area = address.state
+                    country = address.country_id
 
             except Contact.DoesNotExist:
                 pass
 
         if not country:
             from satchmo_store.shop.models import Config
-            country = Config.objects.get_current().sales_country
+            country = getattr(Config.objects.get_current(), 'sales_country_id', None)
 
         if area:
-            try:
-                area = AdminArea.objects.get(name__iexact=area,
-                                             country=country)
-            except AdminArea.DoesNotExist:
-                try:
-                    area = AdminArea.objects.get(abbrev__iexact=area,
-                                                 country=country)
-                except AdminArea.DoesNotExist:
-                    log.info("Couldn't find AdminArea from string: %s", area)
-                    area = None
-
+            name = area
+            area = self.table.area(name, country)
+            if area is None:
+                log.info("Couldn't find AdminArea from string: %s", name)
 
         return area, country
         
@@ -87,30 +95,19 @@ class Processor(object):
     def get_rate(self, taxclass=None, area=None, country=None, get_object=False, **kwargs):
         if not taxclass:
             taxclass = "Default"
-        rate = None
-        if not (area or country):
+        if area or country:
+            area = getattr(area, 'pk', area)
+            country = getattr(country, 'pk', country)
+        else:
             area, country = self._get_location()
             
         if is_string_like(taxclass):
-            try:
-                taxclass = TaxClass.objects.get(title__iexact=taxclass)
-            
-            except TaxClass.DoesNotExist:
-                raise ImproperlyConfigured("Can't find a '%s' Tax Class", taxclass)            
-            
-        if area:
-            try:
-                rate = TaxRate.objects.get(taxClass=taxclass, taxZone=area)
-                
-            except TaxRate.DoesNotExist:
-                rate = None
-                
-        if not rate:
-            try:
-                rate = TaxRate.objects.get(taxClass=taxclass, taxCountry=country)
-                
-            except TaxRate.DoesNotExist:
-                rate = None
+            title = taxclass
+            taxclass = self.table.taxclass(title)
+            if taxclass is None:
+                raise ImproperlyConfigured("Can't find a '%s' Tax Class", title)
+
+        rate = self.table.rate(taxclass.pk, area, country)
         
         log.debug("Got rate [%s] = %s", taxclass, rate)
         if get_object:
@@ -153,8 +150,7 @@ class Processor(object):
             rate = None
             if config_value('TAX','TAX_SHIPPING'):
                 try:
-                    tc = TaxClass.objects.get(title=config_value('TAX', 'TAX_CLASS'))
-                    rate = self.get_rate(taxclass=tc)
+                    rate = self.get_rate(taxclass=config_value('TAX', 'TAX_CLASS'))
                 except:
                     log.error("'Shipping' TaxClass doesn't exist.")
 
@@ -0,0 +1,116 @@
+"""
+A process wide table of the area tax rates.
+
+`Processor.get_rate` used to run up to five queries per call, and it is
+called for every order item and every product variation.  `AreaRateTable`
+loads the tax classes, the rates and the names of the countries and admin
+areas once, so resolving a rate is a handful of dict lookups.
+
+Saving or deleting a `TaxRate`, `TaxClass`, `AdminArea` or `Country` calls
+`area_rates_changed`, which bumps a `VersionKey` so that every process
+reloads its table on the next lookup.
+"""
+from satchmo_utils.versionkey import VersionKey
+import logging
+import threading
+import time
+
+log = logging.getLogger('tax.area.rates')
+
+VERSION_KEY = 'tax-area-rates-version'
+_VERSION = VersionKey(VERSION_KEY)
+
+class AreaRateTable(object):
+    """The `TaxRate`s keyed by (tax class, area) and (tax class, country) ids."""
+
+    def __init__(self):
+        self.version = None
+        self.classes = {}
+        self.area_rates = {}
+        self.country_rates = {}
+        self.countries = {}
+        self.area_names = {}
+        self.area_abbrevs = {}
+
+    def load(self):
+        from l10n.models import AdminArea, Country
+        from product.models import TaxClass
+        from tax.modules.area.models import TaxRate
+
+        start = time.time()
+        self.version = _VERSION.current()
+
+        for taxclass in TaxClass.objects.order_by('-id'):
+            self.classes[taxclass.title.lower()] = taxclass
+
+        for rate in TaxRate.objects.order_by('-id'):
+            if rate.taxZone_id:
+                self.area_rates[(rate.taxClass_id, rate.taxZone_id)] = rate
+            if rate.taxCountry_id:
+                self.country_rates[(rate.taxClass_id, rate.taxCountry_id)] = rate
+
+        self.countries = dict(Country.objects.values_list('iso2_code', 'id'))
+
+        for pk, country, name, abbrev in AdminArea.objects.order_by('-id').values_list(
+            'id', 'country', 'name', 'abbrev'):
+            self.area_names[(country, name.lower())] = pk
+            if abbrev:
+                self.area_abbrevs[(country, abbrev.lower())] = pk
+
+        log.debug('Loaded %i area tax rates in %.2f seconds',
+            len(self.area_rates) + len(self.country_rates), time.time() - start)
+
+    def is_current(self):
+        return _VERSION.is_current(self.version)
+
+    def taxclass(self, title):
+        """Return the `TaxClass` titled `title`, ignoring case, or None."""
+        return self.classes.get(title.lower(), None)
+
+    def country(self, iso2_code):
+        """Return the id of the country with `iso2_code`, or None."""
+        return self.countries.get(iso2_code, None)
+
+    def area(self, name, country):
+        """Return the id of the admin area of `country` (an id) with the name
+        or the postal abbreviation `name`, or None."""
+        name = name.lower()
+        pk = self.area_names.get((country, name), None)
+        if pk is None:
+            pk = self.area_abbrevs.get((country, name), None)
+        return pk
+
+    def rate(self, taxclass, area, country):
+        """Return the `TaxRate` of `taxclass` for `area`, or else `country`
+        (all ids), or None."""
+        rate = None
+        if area:
+            rate = self.area_rates.get((taxclass, area), None)
+        if rate is None:
+            rate = self.country_rates.get((taxclass, country), None)
+        return rate
+
+_TABLE = None
+_LOCK = threading.Lock()
+
+def get_rate_table():
+    """Return the process wide `AreaRateTable`, (re)loading it if needed."""
+    global _TABLE
+    table = _TABLE
+    if table is None or not table.is_current():
+        _LOCK.acquire()
+        try:
+            table = AreaRateTable()
+            table.load()
+            _TABLE = table
+        finally:
+            _LOCK.release()
+    return table
+
+def area_rates_changed(sender=None, **kwargs):
+    """Make all processes reload their rate table, connected to the
+    `post_save` and `post_delete` signals of the models the table is
+    built from."""
+    global _TABLE
+    _VERSION.changed()
+    _TABLE = None
@@ -26,3 +26,13 @@ config_register(
          default='Shipping'
      )
 )
+
+config_register(
+     BooleanValue(TAX_GROUP,
+         'US_SST_INDEX',
+         description=_("Look up SST boundries in memory?"),
+         help_text=_("Load the ZIP code boundries into memory once per process instead of querying the database for every lookup."),
+         requires=TAX_MODULE,
+         requiresvalue='tax.modules.us_sst',
+         default=True)
+)
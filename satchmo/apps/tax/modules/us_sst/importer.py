@@ -0,0 +1,342 @@
+"""
+Bulk importers for the SST boundry and rate files.
+
+The state files run to millions of lines.  The importers read them a line at
+a time and write them in chunks: each chunk costs one query to find the rows
+which are already loaded, a few multi-row INSERTs, and a transaction of its
+own.
+
+By default a file is merged into the live table.  Rows which are already
+loaded get their end date updated and new rows are added, as the importers
+always did.  With `replace=True` the file is loaded into a staging table
+instead, and then swapped in for the rows of the states it covers in a
+single transaction, so tax lookups never see a half loaded state.
+"""
+from datetime import date
+from decimal import Decimal
+from django.db import connection, transaction
+from satchmo_utils.db import bulk_insert, chunked, DEFAULT_CHUNK_SIZE
+from tax.modules.us_sst.index import sst_data_changed
+from tax.modules.us_sst.models import TaxBoundry, TaxRate
+import logging
+import time
+
+log = logging.getLogger('tax.us_sst.importer')
+
+def ash_split(arg, qty):
+    """Unfortunately, states don't alwys publish the full SST fields in the
+    boundry files like they are required to. It's a shame really. So this function
+    will force a string to split to 'qty' fields, adding None values as needed to
+    get there.
+    """
+    l = arg.split(',')
+    if len(l) < qty:
+        l.extend([None for x in xrange(qty-len(l))])
+    return l
+
+def parse_date(value):
+    """Parse the YYYYMMDD dates of the SST files."""
+    value = value.strip()
+    return date(int(value[0:4]), int(value[4:6]), int(value[6:8]))
+
+CSV_MAP = (
+    'recordType', 'startDate', 'endDate',
+    'lowAddress', 'highAddress', 'oddEven',
+    'streetPreDirection', 'streetName', 'streetSuffix', 'streetPostDirection',
+    'addressSecondaryAbbr', 'addressSecondaryLow', 'addressSecondaryHigh', 'addressSecondaryOddEven',
+    'cityName', 'zipCode', 'plus4',
+    'zipCodeLow', 'zipExtensionLow', 'zipCodeHigh', 'zipExtensionHigh',
+    'serCode',
+    'fipsStateCode', 'fipsStateIndicator', 'fipsCountyCode', 'fipsPlaceCode', 'fipsPlaceType',
+    'long', 'lat',
+    'special_1_source', 'special_1_code', 'special_1_type',
+    'special_2_source', 'special_2_code', 'special_2_type',
+    'special_3_source', 'special_3_code', 'special_3_type',
+    'special_4_source', 'special_4_code', 'special_4_type',
+    'special_5_source', 'special_5_code', 'special_5_type',
+    'special_6_source', 'special_6_code', 'special_6_type',
+    'special_7_source', 'special_7_code', 'special_7_type',
+    'special_8_source', 'special_8_code', 'special_8_type',
+    'special_9_source', 'special_9_code', 'special_9_type',
+    'special_10_source', 'special_10_code', 'special_10_type',
+    'special_11_source', 'special_11_code', 'special_11_type',
+    'special_12_source', 'special_12_code', 'special_12_type',
+    'special_13_source', 'special_13_code', 'special_13_type',
+    'special_14_source', 'special_14_code', 'special_14_type',
+    'special_15_source', 'special_15_code', 'special_15_type',
+    'special_16_source', 'special_16_code', 'special_16_type',
+    'special_17_source', 'special_17_code', 'special_17_type',
+    'special_18_source', 'special_18_code', 'special_18_type',
+    'special_19_source', 'special_19_code', 'special_19_type',
+    'special_20_source', 'special_20_code', 'special_20_type',
+)
+# Some fields we're not using.
+DELETE_FIELDS = (
+    'long', 'lat',
+    'special_1_source',
+    'special_2_source',
+    'special_3_source',
+    'special_4_source',
+    'special_5_source',
+    'special_6_source',
+    'special_7_source',
+    'special_8_source',
+    'special_9_source',
+    'special_10_source',
+    'special_11_source',
+    'special_12_source',
+    'special_13_source',
+    'special_14_source',
+    'special_15_source',
+    'special_16_source',
+    'special_17_source',
+    'special_18_source',
+    'special_19_source',
+    'special_20_source',
+)
+
+class SSTImporter(object):
+    """Streams the lines of an SST file into `model`.
+
+    This is an abstract base class, use `RateImporter` or `BoundryImporter`.
+    Subclasses must set `model`, `keyfields` - the fields which identify a
+    row apart from its end date, `lookupfields` - the indexed part of the
+    key used to find the loaded rows of a chunk, and `statefield`, and
+    implement `parse`.
+
+    `progress`, if given, is called with the importer after every chunk.
+    """
+    model = None
+    keyfields = ()
+    lookupfields = ()
+    statefield = None
+
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE, replace=False, progress=None):
+        if self.model is None:
+            raise TypeError("%s is abstract, use a subclass which sets the model" % type(self).__name__)
+        self.chunk_size = chunk_size
+        self.replace = replace
+        self.progress = progress
+        self.fields = [f.name for f in self.model._meta.fields if not f.primary_key]
+        self.read = 0
+        self.skipped = 0
+        self.new = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.removed = 0
+        self.states = set()
+        self.started = None
+        self.elapsed = 0.0
+
+    def _rate(self):
+        if self.elapsed:
+            return self.read / self.elapsed
+        return 0.0
+    rate = property(_rate)
+
+    def parse(self, line):
+        """Return a dict of field values for `line`, or None to skip it.
+        Subclasses must implement this."""
+        raise NotImplementedError("%s doesn't implement parse" % type(self).__name__)
+
+    def rows(self, lines):
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            self.read += 1
+            row = self.parse(line)
+            if row is None:
+                self.skipped += 1
+                continue
+            yield row
+
+    def load(self, lines):
+        """Import `lines`, an iterable such as an open file."""
+        self.started = time.time()
+        try:
+            if self.replace:
+                self.create_staging()
+                for chunk in chunked(self.rows(lines), self.chunk_size):
+                    self.stage(chunk)
+                    self._progress()
+                if self.states:
+                    self.swap()
+            else:
+                for chunk in chunked(self.rows(lines), self.chunk_size):
+                    self.merge(chunk)
+                    self._progress()
+        finally:
+            if self.replace:
+                self.drop_staging()
+            # chunks which were committed before an error are live too
+            sst_data_changed()
+            self.elapsed = time.time() - self.started
+
+        log.info('Imported %i %s lines in %.2fs (%.1f rows/s)',
+            self.read, self.model._meta.object_name, self.elapsed, self.rate)
+
+    def _progress(self):
+        if self.progress is not None:
+            self.elapsed = time.time() - self.started
+            self.progress(self)
+
+    def _key(self, row):
+        return tuple([row[name] for name in self.keyfields])
+
+    def _values(self, row):
+        return tuple([row.get(name, None) for name in self.fields])
+
+    def _merge(self, chunk):
+        # a line repeated later in the file wins, as it did when every
+        # line was saved in turn
+        pending = {}
+        for row in chunk:
+            pending[self._key(row)] = row
+        self.unchanged += len(chunk) - len(pending)
+
+        filters = {}
+        for name in self.lookupfields:
+            filters['%s__in' % name] = list(set([row[name] for row in pending.values()]))
+        loaded = {}
+        for values in self.model.objects.filter(**filters).values_list('pk', 'endDate', *self.keyfields):
+            loaded[tuple(values[2:])] = values[:2]
+
+        inserts = []
+        updates = {}
+        for key, row in pending.items():
+            if key in loaded:
+                pk, end = loaded[key]
+                # Over time, end dates can change. A new row with a new start
+                # date will also appear.
+                if end != row['endDate']:
+                    updates.setdefault(row['endDate'], []).append(pk)
+                    self.updated += 1
+                else:
+                    self.unchanged += 1
+            else:
+                inserts.append(self._values(row))
+
+        for end, pks in updates.items():
+            self.model.objects.filter(pk__in=pks).update(endDate=end)
+        self.new += bulk_insert(self.model, self.fields, inserts, chunk_size=self.chunk_size)
+
+    merge = transaction.commit_on_success(_merge)
+
+    def _staging_table(self):
+        return '%s_staging' % self.model._meta.db_table
+    staging_table = property(_staging_table)
+
+    def _columns(self):
+        qn = connection.ops.quote_name
+        return ", ".join([qn(self.model._meta.get_field(name).column) for name in self.fields])
+
+    def _create_staging(self):
+        qn = connection.ops.quote_name
+        cursor = connection.cursor()
+        cursor.execute("DROP TABLE IF EXISTS %s" % qn(self.staging_table))
+        cursor.execute("CREATE TABLE %s AS SELECT %s FROM %s WHERE 1 = 0" % (
+            qn(self.staging_table), self._columns(), qn(self.model._meta.db_table)))
+        transaction.set_dirty()
+
+    create_staging = transaction.commit_on_success(_create_staging)
+
+    def _stage(self, chunk):
+        for row in chunk:
+            if row[self.statefield] is not None:
+                self.states.add(row[self.statefield])
+        self.new += bulk_insert(self.model, self.fields, [self._values(row) for row in chunk],
+            chunk_size=self.chunk_size, table=self.staging_table)
+
+    stage = transaction.commit_on_success(_stage)
+
+    def _swap(self):
+        """Replace the live rows of the staged states with the staging table."""
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        column = qn(self.model._meta.get_field(self.statefield).column)
+        states = list(self.states)
+        cursor = connection.cursor()
+        cursor.execute("DELETE FROM %s WHERE %s IN (%s)" % (table, column, ", ".join(["%s"] * len(states))),
+            states)
+        self.removed = cursor.rowcount
+        cursor.execute("INSERT INTO %s (%s) SELECT %s FROM %s" % (
+            table, self._columns(), self._columns(), qn(self.staging_table)))
+        transaction.set_dirty()
+
+    swap = transaction.commit_on_success(_swap)
+
+    def _drop_staging(self):
+        cursor = connection.cursor()
+        cursor.execute("DROP TABLE IF EXISTS %s" % connection.ops.quote_name(self.staging_table))
+        transaction.set_dirty()
+
+    drop_staging = transaction.commit_on_success(_drop_staging)
+
+class RateImporter(SSTImporter):
+    """Imports a rate file: state,type,code,rate_intra,rate_inter,food_intra,food_inter,start,end"""
+    model = TaxRate
+    keyfields = ('state', 'jurisdictionType', 'jurisdictionFipsCode', 'startDate')
+    lookupfields = ('state', 'jurisdictionFipsCode', 'startDate')
+    statefield = 'state'
+
+    def parse(self, line):
+        (state, type, code, rate_intra, rate_inter, food_intra, food_inter,
+         start, end) = line.split(',')
+        return {
+            'state' : int(state),
+            'jurisdictionType' : int(type),
+            'jurisdictionFipsCode' : code,
+            'generalRateIntrastate' : Decimal(rate_intra),
+            'generalRateInterstate' : Decimal(rate_inter),
+            'foodRateIntrastate' : Decimal(food_intra),
+            'foodRateInterstate' : Decimal(food_inter),
+            'startDate' : parse_date(start),
+            'endDate' : parse_date(end),
+        }
+
+class BoundryImporter(SSTImporter):
+    """Imports the ZIP-5 and ZIP+4 records of a boundry file."""
+    model = TaxBoundry
+    keyfields = tuple([name for name in CSV_MAP if name not in DELETE_FIELDS and name != 'endDate'])
+    lookupfields = ('recordType', 'zipCodeLow', 'startDate')
+    statefield = 'fipsStateCode'
+
+    def parse(self, line):
+        #Z,20080701,99991231,,,,,,,,,,,,,,,00073,,00073,,EXTRA
+        fields = ash_split(line, len(CSV_MAP))
+
+        # Turn it all into a dict, then remove the keys we don't care about or use.
+        d = dict(zip(CSV_MAP, fields))
+        for v in DELETE_FIELDS:
+            del(d[v])
+
+        d['recordType'] = d['recordType'].upper()
+        if d['recordType'] == 'A':
+            # For now, skip these, as they barely work.
+            # Zip+4 is the best way always. These are a bad idea in general.
+            return None
+
+        d['startDate'] = parse_date(d['startDate'])
+        d['endDate'] = parse_date(d['endDate'])
+
+        # Empty strings are nulls.
+        for k in d.keys():
+            if d[k] == '':
+                d[k] = None
+
+        if d['recordType'] == '4':
+            d['zipCodeLow']       = int(d['zipCodeLow'])
+            d['zipExtensionLow']  = int(d['zipExtensionLow'])
+            d['zipCodeHigh']      = int(d['zipCodeHigh'])
+            d['zipExtensionHigh'] = int(d['zipExtensionHigh'])
+        elif d['recordType'] == 'Z':
+            d['zipCodeLow']       = int(d['zipCodeLow'])
+            d['zipCodeHigh']      = int(d['zipCodeHigh'])
+
+        # Now, handle mapping boundries to rates.
+        #extra = SER,state_providing,state_taxed,County,Place,Class,Long,Lat, (ST/VD,Special Code,Special Type,) x 20
+        # IF SER, then the tax module should report all sales taxes by that SER code.
+        # Otherwise, report it by each applicable tax.
+        # Total tax is still the same in both cases. Just the state wants it reported differently.
+        return d
@@ -0,0 +1,220 @@
+"""
+In-memory indexes of the SST tax boundries and rates.
+
+The boundry files have hundreds of thousands of rows, and the ZIP range
+queries in `TaxBoundry.lookup` are slow.  `BoundryIndex` loads the ZIP-5 and
+ZIP+4 boundries once per process into sorted arrays, and answers lookups with
+a binary search.  `RateCache` keeps the `TaxRate` of each (state, FIPS code,
+date) once it has been loaded.
+
+The importers call `sst_data_changed`, which bumps a `VersionKey` so that
+every process reloads its index and forgets its rates on the next lookup.
+"""
+from array import array
+from bisect import bisect_right
+from satchmo_utils.versionkey import VersionKey
+import copy
+import logging
+import threading
+import time
+
+log = logging.getLogger('tax.us_sst.index')
+
+VERSION_KEY = 'us_sst-data-version'
+_VERSION = VersionKey(VERSION_KEY)
+
+class IntervalIndex(object):
+    """Closed [low, high] intervals, each valid from `start` to `end`
+    (date ordinals), sorted by `low`.
+
+    `maxhighs[i]` is the highest `high` of the first i+1 intervals, so a
+    lookup can stop scanning back as soon as no earlier interval can reach
+    the key.
+    """
+
+    def __init__(self, rows):
+        """`rows` is a list of (low, high, start, end, pk, extra) tuples."""
+        rows.sort()
+        self.lows = array('l')
+        self.highs = array('l')
+        self.maxhighs = array('l')
+        self.starts = array('l')
+        self.ends = array('l')
+        self.pks = array('l')
+        self.extras = []
+
+        maxhigh = None
+        for low, high, start, end, pk, extra in rows:
+            if maxhigh is None or high > maxhigh:
+                maxhigh = high
+            self.lows.append(low)
+            self.highs.append(high)
+            self.maxhighs.append(maxhigh)
+            self.starts.append(start)
+            self.ends.append(end)
+            self.pks.append(pk)
+            self.extras.append(extra)
+
+    def __len__(self):
+        return len(self.lows)
+
+    def lookup(self, key, day, check=None):
+        """Return the pk of the interval containing `key` on `day`, or None.
+        If several do, the one which started last wins.  `check(extra)` can
+        reject candidates."""
+        best = None
+        i = bisect_right(self.lows, key) - 1
+        while i >= 0 and self.maxhighs[i] >= key:
+            if (self.highs[i] >= key and self.starts[i] <= day <= self.ends[i]
+                and (check is None or check(self.extras[i]))):
+                if best is None or self.starts[i] > self.starts[best]:
+                    best = i
+            i -= 1
+
+        if best is None:
+            return None
+        return self.pks[best]
+
+class BoundryIndex(object):
+    """Index of the ZIP-5 ('Z') and ZIP+4 ('4') `TaxBoundry` records."""
+
+    MAXOBJECTS = 1000
+
+    def __init__(self):
+        self.version = None
+        self.zip5 = self.zip4 = None
+        self.objects = {}
+        self._lock = threading.Lock()
+
+    def _loaded(self):
+        return self.zip5 is not None
+
+    loaded = property(_loaded)
+
+    def load(self):
+        from tax.modules.us_sst.models import TaxBoundry
+
+        start = time.time()
+        version = _VERSION.current()
+        zip5 = []
+        zip4 = []
+        rows = TaxBoundry.objects.filter(recordType__in=('Z', '4')).values_list(
+            'pk', 'recordType', 'zipCodeLow', 'zipExtensionLow', 'zipCodeHigh',
+            'zipExtensionHigh', 'startDate', 'endDate')
+        for pk, rtype, zlow, elow, zhigh, ehigh, startdate, enddate in rows.iterator():
+            if zlow is None or zhigh is None:
+                continue
+            if rtype == 'Z':
+                zip5.append((zlow, zhigh, startdate.toordinal(), enddate.toordinal(), pk, None))
+            elif elow is not None and ehigh is not None:
+                # The ZIP+4 ranges are searched as zip*10000+ext, which covers
+                # every zip and extension within the separate ranges.
+                zip4.append((zlow*10000 + elow, zhigh*10000 + ehigh,
+                    startdate.toordinal(), enddate.toordinal(), pk, (zlow, elow, zhigh, ehigh)))
+
+        self._lock.acquire()
+        try:
+            self.zip5 = IntervalIndex(zip5)
+            self.zip4 = IntervalIndex(zip4)
+            self.objects = {}
+            self.version = version
+        finally:
+            self._lock.release()
+        log.debug('Loaded %i ZIP-5 and %i ZIP+4 tax boundries in %.2f seconds',
+            len(self.zip5), len(self.zip4), time.time() - start)
+
+    def is_current(self):
+        if not self.loaded:
+            return False
+        return _VERSION.is_current(self.version)
+
+    def lookup(self, zip, ext=None, date=None):
+        """Return the pk of the `TaxBoundry` for `zip` and `ext` on `date`,
+        trying ZIP+4 first like `TaxBoundry.lookup`, or None."""
+        day = date.toordinal()
+        if ext:
+            def check(extra):
+                zlow, elow, zhigh, ehigh = extra
+                return zlow <= zip <= zhigh and elow <= ext <= ehigh
+            pk = self.zip4.lookup(zip*10000 + ext, day, check)
+            if pk is not None:
+                return pk
+
+        return self.zip5.lookup(zip, day)
+
+    def boundry(self, pk):
+        """Return a copy of the `TaxBoundry` with `pk`, which is loaded only once."""
+        from tax.modules.us_sst.models import TaxBoundry
+
+        obj = self.objects.get(pk, None)
+        if obj is None:
+            if len(self.objects) > self.MAXOBJECTS:
+                self.objects = {}
+            obj = TaxBoundry.objects.get(pk=pk)
+            self.objects[pk] = obj
+        # callers set useIntrastate and useFood on the boundry
+        return copy.copy(obj)
+
+class RateCache(object):
+    """`TaxRate`s by (state, FIPS code, date), None when there is no rate."""
+
+    MAXSIZE = 10000
+
+    def __init__(self):
+        self.version = _VERSION.current()
+        self.rates = {}
+
+    def is_current(self):
+        return _VERSION.is_current(self.version)
+
+    def get_rates(self, state, codes, date):
+        """Return a dict of FIPS code to `TaxRate` for `codes`, loading the
+        missing ones with a single query."""
+        from tax.modules.us_sst.models import TaxRate
+
+        state = int(state)
+        found = {}
+        missing = []
+        for code in codes:
+            key = (state, code, date)
+            if key in self.rates:
+                found[code] = self.rates[key]
+            elif not code in missing:
+                missing.append(code)
+
+        if missing:
+            if len(self.rates) > self.MAXSIZE:
+                self.rates = {}
+            loaded = dict([(code, None) for code in missing])
+            for rate in TaxRate.objects.filter(state=state, jurisdictionFipsCode__in=missing,
+                startDate__lte=date, endDate__gte=date):
+                loaded[rate.jurisdictionFipsCode] = rate
+            for code, rate in loaded.items():
+                self.rates[(state, code, date)] = rate
+                found[code] = rate
+
+        return found
+
+_INDEX = BoundryIndex()
+_RATES = None
+
+def get_boundry_index():
+    """Return the process wide `BoundryIndex`, (re)loading it if needed."""
+    if not _INDEX.is_current():
+        _INDEX.load()
+    return _INDEX
+
+def get_rate_cache():
+    """Return the process wide `RateCache`."""
+    global _RATES
+    if _RATES is None or not _RATES.is_current():
+        _RATES = RateCache()
+    return _RATES
+
+def sst_data_changed():
+    """Make all processes reload the boundry index and the rates, call after
+    changing the SST tables."""
+    global _RATES
+    _VERSION.changed()
+    _INDEX.zip5 = _INDEX.zip4 = None
+    _RATES = None
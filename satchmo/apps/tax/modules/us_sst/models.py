@@ -1,8 +1,10 @@
 # coding=UTF-8
 from django.db import models
 from django.utils.translation import ugettext, ugettext_lazy as _
+from livesettings import config_value_safe
 from product.models import TaxClass
 from l10n.models import AdminArea, Country
+from tax.modules.us_sst.index import get_boundry_index, get_rate_cache
 #from satchmo_store.shop.models import Order
 #from satchmo_store.shop.signals import order_success
 #from tax import Processor
@@ -305,7 +307,7 @@ class TaxBoundry(models.Model):
             date = _date.today()
             
         # Lookup all the applicable codes.
-        for fips in (
+        codes = [fips for fips in (
             self.fipsStateIndicator, self.fipsCountyCode, self.fipsPlaceCode,
             self.special_1_code, self.special_2_code, self.special_3_code,
             self.special_4_code, self.special_5_code, self.special_6_code,
@@ -314,16 +316,13 @@ class TaxBoundry(models.Model):
             self.special_13_code, self.special_14_code, self.special_15_code,
             self.special_16_code, self.special_17_code, self.special_18_code,
             self.special_19_code, self.special_20_code
-        ):
-            if not fips:
-                continue
-            
-            rate = TaxRate.objects.get(
-                state=state,
-                jurisdictionFipsCode=fips,
-                startDate__lte=date,
-                endDate__gte=date,
-            )
+        ) if fips]
+
+        found = get_rate_cache().get_rates(state, codes, date)
+        for fips in codes:
+            rate = found[fips]
+            if rate is None:
+                raise TaxRate.DoesNotExist("No tax rate for state %s, FIPS code %s on %s" % (state, fips, date))
             l.append( rate  )
         
         return l
@@ -357,11 +356,23 @@ class TaxBoundry(models.Model):
         for it."""
         if not date:
             date = _date.today()
-        
+
+        if config_value_safe('TAX', 'US_SST_INDEX', True):
+            index = get_boundry_index()
+            pk = index.lookup(zip, ext, date)
+            if pk is None:
+                return None
+            return index.boundry(pk)
+        return cls.query(zip, ext, date)
+
+    @classmethod
+    def query(cls, zip, ext, date):
+        """`lookup` from the database, without the boundry index."""
+        # Where the dates of several records overlap, the one which started
+        # last wins, as in the index.
         # Try for a ZIP+4 lookup first if we can.
         if ext:
-            try:
-                return cls.objects.get(
+            found = list(cls.objects.filter(
                     recordType='4',
                     zipCodeLow__lte=zip,
                     zipCodeHigh__gte=zip,
@@ -369,22 +380,22 @@ class TaxBoundry(models.Model):
                     zipExtensionHigh__gte=ext,
                     startDate__lte=date,
                     endDate__gte=date,
-                )
-            except cls.DoesNotExist:
-                # Not all zip+4 have entires. That's OK.
-                pass
+                ).order_by('-startDate')[:1])
+            if found:
+                return found[0]
+            # Not all zip+4 have entires. That's OK.
         
         # Try for just the ZIP then.
-        try:
-            return cls.objects.get(
+        found = list(cls.objects.filter(
                 recordType='Z',
                 zipCodeLow__lte=zip,
                 zipCodeHigh__gte=zip,
                 startDate__lte=date,
                 endDate__gte=date,
-            )
-        except cls.DoesNotExist:
-            return None
+            ).order_by('-startDate')[:1])
+        if found:
+            return found[0]
+        return None
 
     class Meta:
         verbose_name = _("Tax Boundry")
@@ -28,8 +28,22 @@ class Processor(object):
         """
         self.order = order
         self.user = user
+        self._locations = {}
 
     def _get_location(self):
+        # get_rate is called once per tax class, only look the address up once
+        if self.order:
+            key = (self.order.ship_state, self.order.ship_postal_code, self.order.ship_country)
+        elif self.user and self.user.is_authenticated():
+            key = self.user.pk
+        else:
+            key = None
+
+        if not key in self._locations:
+            self._locations[key] = self._find_location()
+        return self._locations[key]
+
+    def _find_location(self):
         area=country=postal_code=None
 
         if self.order:
@@ -0,0 +1,192 @@
+from decimal import Decimal
+from django.db import connection
+from django.test import TestCase
+from keyedcache import cache_delete
+from tax.modules.us_sst.importer import BoundryImporter, RateImporter, SSTImporter
+from tax.modules.us_sst.index import sst_data_changed
+from tax.modules.us_sst.models import TaxBoundry, TaxRate
+import datetime
+
+def _rate_line(state, code, rate, start='20080101', end='20081231', type='00'):
+    return "%s,%s,%s,%s,%s,0.0000000,0.0000000,%s,%s" % (state, type, code, rate, rate, start, end)
+
+def _boundry_line(record, zlow, zhigh, elow='', ehigh='', start='20080101', end='20081231',
+    state='18', county='097', place=''):
+    fields = [record, start, end] + [''] * 14 + [zlow, elow, zhigh, ehigh, '', state, '', county, place, '']
+    return ",".join(fields)
+
+class SSTImporterTest(TestCase):
+
+    def tearDown(self):
+        cache_delete()
+
+    def _import(self, importer, lines, **kwargs):
+        importer = importer(**kwargs)
+        importer.load(lines)
+        return importer
+
+    def testAbstract(self):
+        self.assertRaises(TypeError, SSTImporter)
+
+    def testRateReimport(self):
+        lines = [
+            _rate_line('18', '18', '0.0600000', type='45'),
+            _rate_line('18', '001', '0.0100000'),
+            _rate_line('18', '003', '0.0100000'),
+        ]
+        importer = self._import(RateImporter, lines)
+        self.assertEqual((importer.read, importer.new, importer.updated, importer.unchanged), (3, 3, 0, 0))
+        self.assertEqual(TaxRate.objects.count(), 3)
+
+        # a changed end date, and a new rate starting the next day
+        lines[2] = _rate_line('18', '003', '0.0100000', end='20090630')
+        lines.append(_rate_line('18', '003', '0.0150000', start='20090701', end='99991231'))
+        importer = self._import(RateImporter, lines, chunk_size=2)
+        self.assertEqual((importer.read, importer.new, importer.updated, importer.unchanged), (4, 1, 1, 2))
+        self.assertEqual(TaxRate.objects.count(), 4)
+        rates = TaxRate.objects.filter(jurisdictionFipsCode='003').order_by('startDate')
+        self.assertEqual([(r.endDate, r.generalRateIntrastate) for r in rates],
+            [(datetime.date(2009, 6, 30), Decimal('0.0100000')),
+             (datetime.date(9999, 12, 31), Decimal('0.0150000'))])
+
+    def testBoundryReimport(self):
+        lines = [
+            _boundry_line('Z', '46201', '46299'),
+            _boundry_line('4', '46201', '46201', '0001', '4999', place='36003'),
+            # address records are skipped
+            'A,20080101,20081231,100,200,B,,MAIN,ST',
+        ]
+        importer = self._import(BoundryImporter, lines)
+        self.assertEqual((importer.read, importer.skipped, importer.new), (3, 1, 2))
+
+        importer = self._import(BoundryImporter, lines)
+        self.assertEqual((importer.new, importer.updated, importer.unchanged), (0, 0, 2))
+        self.assertEqual(TaxBoundry.objects.count(), 2)
+        zip4 = TaxBoundry.objects.get(recordType='4')
+        self.assertEqual((zip4.zipExtensionLow, zip4.zipExtensionHigh, zip4.fipsPlaceCode),
+            (1, 4999, '36003'))
+
+    def testRepeatedLines(self):
+        """A line repeated later in a file wins, within a chunk or across chunks."""
+        lines = [
+            _rate_line('18', '001', '0.0100000'),
+            _rate_line('18', '001', '0.0100000', end='20090630'),
+        ]
+        importer = self._import(RateImporter, lines)
+        self.assertEqual((importer.new, importer.updated, importer.unchanged), (1, 0, 1))
+        self.assertEqual(TaxRate.objects.get().endDate, datetime.date(2009, 6, 30))
+
+        TaxRate.objects.all().delete()
+        importer = self._import(RateImporter, lines, chunk_size=1)
+        self.assertEqual((importer.new, importer.updated, importer.unchanged), (1, 1, 0))
+        self.assertEqual(TaxRate.objects.get().endDate, datetime.date(2009, 6, 30))
+
+    def testReplace(self):
+        self._import(RateImporter, [
+            _rate_line('18', '001', '0.0100000'),
+            _rate_line('18', '003', '0.0100000'),
+            _rate_line('19', '001', '0.0200000'),
+        ])
+
+        importer = self._import(RateImporter, [
+            _rate_line('18', '005', '0.0300000'),
+        ], replace=True)
+        self.assertEqual((importer.removed, importer.new), (2, 1))
+        self.assertEqual(list(TaxRate.objects.order_by('state').values_list(
+            'state', 'jurisdictionFipsCode')), [(18, u'005'), (19, u'001')])
+        self.assert_(not importer.staging_table in connection.introspection.table_names())
+
+    def testStagingDroppedOnError(self):
+        self._import(RateImporter, [_rate_line('18', '001', '0.0100000')])
+
+        importer = RateImporter(replace=True, chunk_size=1)
+        lines = [
+            _rate_line('18', '003', '0.0100000'),
+            _rate_line('18', '005', 'broken'),
+        ]
+        self.assertRaises(ArithmeticError, importer.load, lines)
+        self.assert_(not importer.staging_table in connection.introspection.table_names())
+        # the live rates are untouched
+        self.assertEqual(list(TaxRate.objects.values_list('jurisdictionFipsCode', flat=True)), [u'001'])
+
+class SSTIndexTest(TestCase):
+    """Test that the boundry index finds the same boundries as the queries."""
+
+    def setUp(self):
+        BoundryImporter().load([
+            _boundry_line('Z', '46201', '46299', end='20081231', county='097'),
+            # overlaps the dates of the first from July 2008
+            _boundry_line('Z', '46201', '46299', start='20080701', end='99991231', county='098'),
+            _boundry_line('4', '46201', '46201', '0001', '4999', end='99991231', place='36003'),
+            _boundry_line('Z', '47000', '47099', end='20081231'),
+        ])
+        RateImporter().load([
+            _rate_line('18', '097', '0.0100000', end='99991231'),
+            _rate_line('18', '098', '0.0200000', end='99991231'),
+            _rate_line('18', '36003', '0.0050000', end='99991231'),
+        ])
+
+    def tearDown(self):
+        cache_delete()
+
+    def _lookup(self, zip, ext=None, date=None):
+        """Look up a boundry with and without the index, and return the
+        pk both found."""
+        queried = TaxBoundry.query(zip, ext, date)
+        indexed = TaxBoundry.lookup(zip, ext, date)
+        self.assertEqual(queried is None, indexed is None)
+        if queried is None:
+            return None
+        self.assertEqual(queried.pk, indexed.pk)
+        return indexed.pk
+
+    def _boundry(self, record, **kwargs):
+        return TaxBoundry.objects.get(recordType=record, **kwargs).pk
+
+    def testZip5(self):
+        day = datetime.date(2008, 3, 1)
+        self.assertEqual(self._lookup(46250, date=day), self._boundry('Z', fipsCountyCode='097'))
+        self.assertEqual(self._lookup(46201, date=day), self._boundry('Z', fipsCountyCode='097'))
+        self.assertEqual(self._lookup(47099, date=day), self._boundry('Z', zipCodeLow=47000))
+        self.assertEqual(self._lookup(46300, date=day), None)
+        self.assertEqual(self._lookup(46250, date=datetime.date(2007, 12, 31)), None)
+
+    def testZip4(self):
+        day = datetime.date(2008, 3, 1)
+        zip4 = self._boundry('4')
+        self.assertEqual(self._lookup(46201, 1, day), zip4)
+        self.assertEqual(self._lookup(46201, 4999, day), zip4)
+        # ZIP+4 misses fall back to the ZIP-5 boundries
+        self.assertEqual(self._lookup(46201, 5000, day), self._boundry('Z', fipsCountyCode='097'))
+        self.assertEqual(self._lookup(46202, 1, day), self._boundry('Z', fipsCountyCode='097'))
+        self.assertEqual(self._lookup(47000, 1, datetime.date(2009, 1, 1)), None)
+
+    def testOverlappingDates(self):
+        old = self._boundry('Z', fipsCountyCode='097')
+        new = self._boundry('Z', fipsCountyCode='098')
+        self.assertEqual(self._lookup(46250, date=datetime.date(2008, 6, 30)), old)
+        self.assertEqual(self._lookup(46250, date=datetime.date(2008, 7, 1)), new)
+        self.assertEqual(self._lookup(46250, date=datetime.date(2008, 12, 31)), new)
+        self.assertEqual(self._lookup(46250, date=datetime.date(2010, 1, 1)), new)
+
+        boundry = TaxBoundry.lookup(46250, date=datetime.date(2010, 1, 1))
+        self.assertEqual(boundry.get_percentage(datetime.date(2010, 1, 1)), Decimal('0.0200000'))
+
+    def testDataChanged(self):
+        day = datetime.date(2010, 1, 1)
+        self.assertEqual(self._lookup(48000, date=day), None)
+        boundry = TaxBoundry.lookup(46250, date=day)
+        self.assertEqual(boundry.get_percentage(day), Decimal('0.0200000'))
+
+        created = TaxBoundry.objects.create(recordType='Z', zipCodeLow=48000, zipCodeHigh=48099,
+            startDate=datetime.date(2008, 1, 1), endDate=datetime.date(9999, 12, 31),
+            fipsStateCode='18', fipsCountyCode='098')
+        TaxRate.objects.filter(jurisdictionFipsCode='098').update(
+            generalRateIntrastate=Decimal('0.0250000'), generalRateInterstate=Decimal('0.0250000'))
+        # the index and the rates are only reloaded once told
+        self.assertEqual(TaxBoundry.lookup(48000, date=day), None)
+        self.assertEqual(TaxBoundry.lookup(46250, date=day).get_percentage(day), Decimal('0.0200000'))
+
+        sst_data_changed()
+        self.assertEqual(self._lookup(48000, date=day), created.pk)
+        self.assertEqual(TaxBoundry.lookup(46250, date=day).get_percentage(day), Decimal('0.0250000'))
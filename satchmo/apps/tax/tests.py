@@ -1,8 +1,10 @@
 from decimal import Decimal
+from django.core.cache import cache
 from django.test import TestCase
 from keyedcache import cache_delete
 from livesettings import config_get
 from satchmo_store.shop.tests import make_test_order, make_order_payment
+from tax.modules.area.rates import area_rates_changed, VERSION_KEY
 import logging
 log = logging.getLogger('tax.test')
 
@@ -24,6 +26,7 @@ class TaxTest(TestCase):
 
     def tearDown(self):
         cache_delete()
+        area_rates_changed()
 
     def testAreaCountries(self):
         """Test Area tax module"""
@@ -116,6 +119,41 @@ class TaxTest(TestCase):
         self.assertEqual(tmain.tax, Decimal('20.00'))
         self.assertEqual(tship.tax, Decimal('0.00'))
 
+    def testAreaRateTable(self):
+        """Test that the area rates are cached, and reloaded when they change"""
+        from tax.modules.area.models import TaxRate
+        from tax.modules.area.processor import Processor
+
+        cache_delete()
+        tax = config_get('TAX','MODULE')
+        tax.update('tax.modules.area')
+
+        order = make_test_order('DE', '')
+        processor = Processor(order=order)
+        self.assertEqual(processor.get_rate(), Decimal('0.2'))
+        self.assertEqual(processor.get_rate('default'), Decimal('0.2'))
+
+        # an update() sends no signals, so the cached rate is still used
+        TaxRate.objects.filter(taxCountry__iso2_code='DE').update(percentage=Decimal('0.18'))
+        processor = Processor(order=order)
+        self.assertEqual(processor.get_rate(), Decimal('0.2'))
+
+        # but not once the version key has been evicted
+        cache.delete(VERSION_KEY)
+        processor = Processor(order=order)
+        self.assertEqual(processor.get_rate(), Decimal('0.18'))
+        self.assertNotEqual(cache.get(VERSION_KEY), None)
+
+        rate = TaxRate.objects.get(taxCountry__iso2_code='DE')
+        rate.percentage = Decimal('0.19')
+        rate.save()
+        processor = Processor(order=order)
+        self.assertEqual(processor.get_rate(), Decimal('0.19'))
+
+        rate.delete()
+        processor = Processor(order=order)
+        self.assertEqual(processor.get_rate(), Decimal('0.00'))
+
     def testPercent(self):
         """Test percent tax without shipping"""
         shp = _set_percent_taxer('10')
@@ -205,4 +243,3 @@ class TaxTest(TestCase):
 
         #self.assertEqual(order.balance, Decimal("0.00"))
         self.assert_(order.paid_in_full)
-
@@ -66,6 +66,7 @@ MIDDLEWARE_CLASSES = (
     "django.middleware.doc.XViewMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "threaded_multihost.middleware.ThreadLocalMiddleware",
+    "product.middleware.PriceCacheMiddleware",
     "satchmo_store.shop.SSLMiddleware.SSLRedirect",
     #"satchmo_ext.recentlist.middleware.RecentProductMiddleware",
     #'djangologging.middleware.LoggingMiddleware',
@@ -106,6 +107,7 @@ INSTALLED_APPS = (
     'tax.modules.no',
     'tax.modules.area',
     'tax.modules.percent',
+    'tax.modules.us_sst',
     'shipping',
     #'satchmo_store.contact.supplier',
     #'shipping.modules.tiered',
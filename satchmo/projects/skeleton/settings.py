@@ -70,6 +70,7 @@ MIDDLEWARE_CLASSES = (
     "django.middleware.doc.XViewMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "threaded_multihost.middleware.ThreadLocalMiddleware",
+    "product.middleware.PriceCacheMiddleware",
     "satchmo_store.shop.SSLMiddleware.SSLRedirect",
     #"satchmo_ext.recentlist.middleware.RecentProductMiddleware",
     #'djangologging.middleware.LoggingMiddleware',